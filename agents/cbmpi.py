@@ -32,14 +32,16 @@ class Cbmpi:
 
     def learn(self, *args, **kwargs):
         start_time = time.time()
-        state_features, state_values, state_action_features, state_action_values, did_rollout, num_available_actions = \
-            self.rollout_handler.perform_rollouts(self.policy_weights, self.value_weights, self.generative_model)
+        rollout = self.rollout_handler.perform_rollouts(self.policy_weights, self.value_weights, self.generative_model,
+                                                        self.value_function_approximator.is_approximator)
         if self.verbose:
             print("Rollouts took " + str((time.time() - start_time) / 60) + " minutes.")
+            if self.rollout_handler.feature_cache_size > 0:
+                print("Feature cache hit rate: " + str(self.rollout_handler.feature_cache_hit_rate()))
 
         start_time = time.time()
-        self.value_weights = self.value_function_approximator.fit(state_features, state_values)
-        self.policy_weights = self.policy_approximator.fit(state_action_features, state_action_values, did_rollout, num_available_actions)
+        self.value_weights = self.value_function_approximator.fit(**rollout)
+        self.policy_weights = self.policy_approximator.fit(**rollout)
 
         if self.verbose:
             print("Function approximation took " + str((time.time() - start_time) / 60) + " minutes.")
@@ -1,5 +1,6 @@
 import numpy as np
 from tetris.state import State, TerminalState
+from tetris.serialization import put_int, get_int, put_float, get_float
 import numba
 from numba import njit, float64, int64, bool_, int64
 from numba.experimental import jitclass
@@ -15,6 +16,11 @@ spec_agent = [
     ('use_cumul_dom_filter', bool_)
 ]
 
+# Byte encoding (see tetris.serialization): kind, num_features, use_filter_in_eval, use_dom_filter,
+# use_cumul_dom_filter (1 byte each), 3 padding bytes, policy_weights and feature_directors (float64).
+CONSTANT_AGENT_KIND = 4
+CONSTANT_AGENT_HEADER_SIZE = 8
+
 
 @jitclass(spec_agent)
 class ConstantAgent:
@@ -44,42 +50,26 @@ class ConstantAgent:
         self.feature_directors = feature_directors
 
     def choose_action(self, start_state, start_tetromino):
-        children_states = start_tetromino.get_after_states(start_state)  # , current_state=
-        num_children = len(children_states)
+        # Children are only enumerated by their features; the State is built for the chosen placement only.
+        action_features, action_placements = start_tetromino.get_after_state_features(start_state)
+        num_children = len(action_features)
         if num_children == 0:
             # Terminal state!!
             return State(np.zeros((1, 1), dtype=np.bool_),
                          np.zeros(1, dtype=np.int64),
+                         np.zeros(1, dtype=np.int64),
+                         0,
                          np.array([0], dtype=np.int64),
                          np.array([0], dtype=np.int64),
                          0.0,
                          1,
                          "bcts",
-                         True,
-                         False)
+                         True)
 
-        action_features = np.zeros((num_children, self.num_features))
-        for ix, after_state in enumerate(children_states):
-            action_features[ix] = after_state.get_features_pure(False)
-
-        if self.use_filter_in_eval:
-            not_simply_dominated, not_cumu_dominated = dominance_filter(action_features * self.feature_directors,
-                                                                        len_after_states=num_children)  # domtools.
-            if self.use_cumul_dom_filter:
-                action_features = action_features[not_cumu_dominated]
-                map_back_vector = np.nonzero(not_cumu_dominated)[0]
-            else:
-                action_features = action_features[not_simply_dominated]
-                map_back_vector = np.nonzero(not_simply_dominated)[0]
-
-        utilities = action_features.dot(np.ascontiguousarray(self.policy_weights))
-        max_indices = np.where(utilities == np.max(utilities))[0]
-        move_index = np.random.choice(max_indices)
-        if self.use_filter_in_eval:
-            move = children_states[map_back_vector[move_index]]
-        else:
-            move = children_states[move_index]
-        return move
+        is_candidate = dominance_candidates(action_features, self.feature_directors, self.use_filter_in_eval,
+                                            self.use_cumul_dom_filter)
+        move_index = choose_max_utility_index(action_features, self.policy_weights, is_candidate)
+        return start_tetromino.get_after_state(start_state, action_placements[move_index])
 
     # def choose_action_test_with_filters(self, start_state, start_tetromino):
     #     """
@@ -145,3 +135,65 @@ class ConstantAgent:
     #     move_index = np.random.choice(max_indices)
     #     move = children_states[move_index]
     #     return move
+
+
+@njit(cache=False)
+def dominance_candidates(action_features, feature_directors, use_filter, use_cumul_dom_filter):
+    # Actions that survive the cumulative (if use_cumul_dom_filter) or simple dominance filter; all if not use_filter.
+    num_actions = len(action_features)
+    if not use_filter:
+        return np.ones(num_actions, dtype=np.bool_)
+    not_simply_dominated, not_cumu_dominated = dominance_filter(action_features * feature_directors,
+                                                                len_after_states=num_actions)  # domtools.
+    if use_cumul_dom_filter:
+        return not_cumu_dominated
+    return not_simply_dominated
+
+
+@njit(cache=False)
+def choose_max_utility_index(action_features, policy_weights, is_candidate):
+    # Index of a utility-maximizing candidate action. Ties are broken uniformly at random.
+    utilities = action_features.dot(np.ascontiguousarray(policy_weights))
+    max_utility = -np.inf
+    for ix in range(len(utilities)):
+        if is_candidate[ix] and utilities[ix] > max_utility:
+            max_utility = utilities[ix]
+    max_indices = np.where(is_candidate & (utilities == max_utility))[0]
+    return np.random.choice(max_indices)
+
+
+@njit(cache=False)
+def encode_constant_agent_array(agent):
+    buffer = np.zeros(CONSTANT_AGENT_HEADER_SIZE + 16 * agent.num_features, dtype=np.uint8)
+    put_int(buffer, 0, CONSTANT_AGENT_KIND, 1)
+    put_int(buffer, 1, agent.num_features, 1)
+    put_int(buffer, 2, np.int64(agent.use_filter_in_eval), 1)
+    put_int(buffer, 3, np.int64(agent.use_dom_filter), 1)
+    put_int(buffer, 4, np.int64(agent.use_cumul_dom_filter), 1)
+    position = CONSTANT_AGENT_HEADER_SIZE
+    for ix in range(agent.num_features):
+        position = put_float(buffer, position, agent.policy_weights[ix])
+    for ix in range(agent.num_features):
+        position = put_float(buffer, position, agent.feature_directors[ix])
+    return buffer
+
+
+@njit(cache=False)
+def decode_constant_agent_array(buffer):
+    assert get_int(buffer, 0, 1) == CONSTANT_AGENT_KIND, "Not an encoded ConstantAgent."
+    num_features = get_int(buffer, 1, 1)
+    policy_weights = np.zeros(num_features, dtype=np.float64)
+    feature_directors = np.zeros(num_features, dtype=np.float64)
+    for ix in range(num_features):
+        policy_weights[ix] = get_float(buffer, CONSTANT_AGENT_HEADER_SIZE + 8 * ix)
+        feature_directors[ix] = get_float(buffer, CONSTANT_AGENT_HEADER_SIZE + 8 * (num_features + ix))
+    return ConstantAgent(policy_weights, "bcts", feature_directors, get_int(buffer, 2, 1) == 1,
+                         get_int(buffer, 3, 1) == 1, get_int(buffer, 4, 1) == 1)
+
+
+def encode_constant_agent(agent):
+    return encode_constant_agent_array(agent).tobytes()
+
+
+def decode_constant_agent(data):
+    return decode_constant_agent_array(np.frombuffer(data, dtype=np.uint8))
@@ -4,7 +4,11 @@ from tetris import tetromino
 from stew import StewMultinomialLogit, ChoiceSetData
 from stew.utils import create_diff_matrix, create_ridge_matrix
 from tetris.state import State
-from numba import njit, float64
+from tetris.bitboard import BitboardState, BOARD_BACKENDS, bitboard_state_from_state, state_from_bitboard_state
+from tetris.hashing import FeatureCache, RolloutValueCache, rollout_key
+from tetris.samplers import SAMPLER_TYPES
+from agents.rollout_allocation import RacingAllocator, ROLLOUT_ALLOCATIONS
+from numba import njit, prange, objmode, float64, get_num_threads
 from scipy.stats import binom_test
 import time
 
@@ -36,7 +40,14 @@ class MLearning:
                  feature_directors=np.array([-1, -1, -1, -1, -1, -1, 1, -1], dtype=np.float64),
                  feature_type="bcts",
                  verbose=False,
-                 verbose_stew=False):
+                 verbose_stew=False,
+                 common_random_numbers=False,
+                 parallel_rollouts=False,
+                 rollout_allocation="uniform",
+                 rollout_budget=0,
+                 rollout_cache_size=0,
+                 board_backend="bool",
+                 feature_cache_size=0):
 
         self.name = name
         # Tetris params
@@ -48,7 +59,13 @@ class MLearning:
                                        'eroded', 'hole_depth'])  # Uses BCTS features.
         self.verbose = verbose
         self.max_choice_set_size = 34  # There are never more than 34 actions in Tetris
-        self.generative_model = tetromino.Tetromino(self.feature_type, self.num_features, self.num_columns)
+        # Random stream until generative_model.seed() is called.
+        self.generative_model = tetromino.make_tetromino(self.feature_type, self.num_features, self.num_columns,
+                                                         "uniform", 0, np.random.randint(0, 2 ** 62), 0)
+
+        # After-state features of the (serial) rollouts are cached by board hash and placement in a
+        # hashing.FeatureCache of feature_cache_size entries (0: no cache); see feature_cache_hit_rate().
+        self.generative_model.use_feature_cache(feature_cache_size)
 
         # Algo params
         self.gamma = gamma
@@ -59,6 +76,28 @@ class MLearning:
         self.cumu_dom_filter = cumu_dom_filter
         self.rollout_dom_filter = rollout_dom_filter
         self.rollout_cumu_dom_filter = rollout_cumu_dom_filter
+        # If True, all children of a decision are rolled out on the same pre-generated tetromino sequences.
+        self.common_random_numbers = common_random_numbers
+        # If True, the rollouts of a decision run in parallel threads (see roll_out_children_in_parallel()).
+        self.parallel_rollouts = parallel_rollouts
+        # "uniform": number_of_rollouts_per_child rollouts for every child. "racing": at most that many, children that
+        # are out of contention are dropped (see agents.rollout_allocation); rollout_budget caps the total number of
+        # rollouts per decision (<= 0: no cap beyond the uniform one), also of choose_action_anytime(). Racing runs
+        # serially.
+        assert rollout_allocation in ROLLOUT_ALLOCATIONS
+        self.rollout_allocation = rollout_allocation
+        self.rollout_budget = rollout_budget
+        # Rollout returns per (after-state, first piece) are kept across decisions in a cache of rollout_cache_size
+        # entries (0: no cache) until the rollout policy changes (see check_rollout_cache()). Not used by
+        # parallel_rollouts. The key does not cover the pre-sampled sequences of common random numbers.
+        if rollout_cache_size > 0 and common_random_numbers:
+            raise ValueError("The rollout cache cannot be used with common random numbers.")
+        self.rollout_cache = RolloutValueCache(rollout_cache_size, 4)
+        self.rollout_policy_fingerprint = None
+        # "bitboard": decisions and rollouts run on tetris.bitboard.BitboardStates (packed rows), which are cheaper to
+        # copy than the boolean boards of tetris.state.State. Both backends choose the same actions.
+        assert board_backend in BOARD_BACKENDS
+        self.board_backend = board_backend
 
         # Algo init
         # self.policy_weights = np.random.normal(loc=0.0, scale=0.1, size=self.num_features)
@@ -96,16 +135,77 @@ class MLearning:
     def copy_current_policy_weights(self):
         return self.policy_weights.copy() * self.feature_directors.copy()
 
+    def feature_cache_hit_rate(self):
+        return self.generative_model.feature_cache.hit_rate()
+
     def update_steps(self):
         self.step += 1
         self.step_in_current_phase += 1
 
+    def rollout_policy(self):
+        # Everything the rollout returns depend on, apart from the start state.
+        return (self.policy_weights.tobytes(), self.feature_directors.tobytes(), self.gamma, self.rollout_length,
+                self.rollout_dom_filter, self.rollout_cumu_dom_filter)
+
+    def check_rollout_cache(self):
+        # Cached rollout returns are only valid for the rollout policy that produced them, and only if the pieces of
+        # a rollout depend on nothing but the first piece (no bag or history, at most one preview piece).
+        if self.rollout_cache.enabled:
+            sampler = self.generative_model.sampler
+            if SAMPLER_TYPES[sampler.sampler_type] != "uniform" or sampler.preview_size > 1:
+                raise ValueError("The rollout cache needs a uniform sampler with a preview of at most one piece.")
+            rollout_policy = self.rollout_policy()
+            if rollout_policy != self.rollout_policy_fingerprint:
+                self.rollout_cache.invalidate()
+                self.rollout_policy_fingerprint = rollout_policy
+
+    def to_board_backend(self, start_state):
+        if self.board_backend == "bitboard":
+            return bitboard_state_from_state(start_state)
+        return start_state
+
+    def from_board_backend(self, child_state, start_state):
+        # The chosen child as a tetris.state.State (the game_over_state() of start_state if there was none).
+        if self.board_backend == "bitboard":
+            if child_state.terminal_state:
+                return game_over_state(start_state)
+            return state_from_bitboard_state(child_state)
+        return child_state
+
     def choose_action(self, start_state, start_tetromino):
-        return choose_action_using_rollouts(start_state, start_tetromino,
-                                            self.rollout_length, self.generative_model, self.policy_weights,
-                                            self.dom_filter, self.cumu_dom_filter, self.rollout_dom_filter, self.rollout_cumu_dom_filter,
-                                            self.feature_directors, self.num_features, self.gamma,
-                                            self.number_of_rollouts_per_child)
+        self.check_rollout_cache()
+        child_state, child_index, action_features = \
+            choose_action_using_rollouts(self.to_board_backend(start_state), start_tetromino, "max_util",
+                                         self.rollout_length, self.generative_model, self.policy_weights,
+                                         self.dom_filter, self.cumu_dom_filter, self.rollout_dom_filter, self.rollout_cumu_dom_filter,
+                                         self.feature_directors, self.num_features, self.gamma,
+                                         self.number_of_rollouts_per_child,
+                                         np.zeros(self.num_features, dtype=np.float64),
+                                         self.common_random_numbers, self.parallel_rollouts,
+                                         self.rollout_allocation, self.rollout_budget, self.rollout_cache)
+        return self.from_board_backend(child_state, start_state), child_index, action_features
+
+    def max_anytime_rollouts(self, max_rollouts):
+        # The smaller of max_rollouts and rollout_budget (<= 0: no limit).
+        if self.rollout_budget > 0 and (max_rollouts <= 0 or max_rollouts > self.rollout_budget):
+            return self.rollout_budget
+        return max_rollouts
+
+    def choose_action_anytime(self, start_state, start_tetromino, time_limit=0.0, max_rollouts=0):
+        # Like choose_action() but stops rolling out after time_limit seconds or max_rollouts rollouts (<= 0: no
+        # limit; capped by rollout_budget). Also returns the number of rollouts per child (see
+        # choose_action_anytime()).
+        self.check_rollout_cache()
+        child_state, child_index, action_features, num_rollouts = \
+            choose_action_anytime(self.to_board_backend(start_state), start_tetromino, "max_util",
+                                  self.rollout_length, self.generative_model, self.policy_weights,
+                                  self.dom_filter, self.cumu_dom_filter, self.rollout_dom_filter, self.rollout_cumu_dom_filter,
+                                  self.feature_directors, self.num_features, self.gamma,
+                                  self.number_of_rollouts_per_child,
+                                  np.zeros(self.num_features, dtype=np.float64),
+                                  self.common_random_numbers, self.rollout_allocation, self.rollout_cache,
+                                  time_limit, self.max_anytime_rollouts(max_rollouts))
+        return self.from_board_backend(child_state, start_state), child_index, action_features, num_rollouts
 
     def append_data(self, action_features, action_index):
         delete_oldest = (self.mlogit_data.current_number_of_choice_sets > self.max_batch_size
@@ -166,7 +266,12 @@ class HierarchicalLearning(MLearning):
                  feature_type="bcts",
                  verbose=False,
                  verbose_stew=False,
-                 provide_directions=False):
+                 provide_directions=False,
+                 common_random_numbers=False,
+                 parallel_rollouts=False,
+                 rollout_allocation="uniform",
+                 rollout_budget=0,
+                 rollout_cache_size=0):
         self.phase_names = phase_names
         self.num_phases = len(self.phase_names)
         self.current_phase_index = 0
@@ -206,7 +311,8 @@ class HierarchicalLearning(MLearning):
                          rollout_cumu_dom_filter_per_phase[0], lambda_min, lambda_max, num_lambdas, fixed_lambda, gamma_per_phase[0], rollout_length,
                          number_of_rollouts_per_child, learn_every_step_until, max_batch_size, learn_periodicity,
                          increase_learn_periodicity, learn_from_step_in_current_phase, num_columns, self.feature_directors, feature_type,
-                         verbose, verbose_stew)
+                         verbose, verbose_stew, common_random_numbers, parallel_rollouts,
+                         rollout_allocation, rollout_budget, rollout_cache_size)
 
         self.positive_direction_counts = np.zeros(self.num_features)
         self.meaningful_comparisons = np.zeros(self.num_features)
@@ -381,7 +487,11 @@ class HierarchicalLearning(MLearning):
                 self.feature_directors = self.feature_directors[self.learned_order]
                 print("...and accordingly, the new directions are: ", self.feature_directors)
 
+    def rollout_policy(self):
+        return super().rollout_policy() + (self.rollout_mechanism, self.learned_directions.tobytes())
+
     def choose_action(self, start_state, start_tetromino):
+        self.check_rollout_cache()
         return choose_action_using_rollouts(start_state, start_tetromino, self.rollout_mechanism,
                                             self.rollout_length, self.generative_model, self.policy_weights,
                                             self.dom_filter, self.cumu_dom_filter, self.rollout_dom_filter,
@@ -389,7 +499,22 @@ class HierarchicalLearning(MLearning):
                                             self.feature_directors,
                                             self.num_features, self.gamma,
                                             self.number_of_rollouts_per_child,
-                                            self.learned_directions)
+                                            self.learned_directions,
+                                            self.common_random_numbers, self.parallel_rollouts,
+                                            self.rollout_allocation, self.rollout_budget, self.rollout_cache)
+
+    def choose_action_anytime(self, start_state, start_tetromino, time_limit=0.0, max_rollouts=0):
+        self.check_rollout_cache()
+        return choose_action_anytime(start_state, start_tetromino, self.rollout_mechanism,
+                                     self.rollout_length, self.generative_model, self.policy_weights,
+                                     self.dom_filter, self.cumu_dom_filter, self.rollout_dom_filter,
+                                     self.rollout_cumu_dom_filter,
+                                     self.feature_directors,
+                                     self.num_features, self.gamma,
+                                     self.number_of_rollouts_per_child,
+                                     self.learned_directions,
+                                     self.common_random_numbers, self.rollout_allocation, self.rollout_cache,
+                                     time_limit, self.max_anytime_rollouts(max_rollouts))
         # if self.rollout_mechanism == "max_util":
         #     super().choose_action(start_state, start_tetromino)
         # elif self.rollout_mechanism == "greedy_if_reward_else_random":
@@ -417,42 +542,61 @@ def choose_action_using_rollouts(start_state, start_tetromino, rollout_mechanism
                                  rollout_length, generative_model, policy_weights,
                                  dom_filter, cumu_dom_filter, rollout_dom_filter, rollout_cumu_dom_filter,
                                  feature_directors, num_features, gamma, number_of_rollouts_per_child,
-                                 learned_directions):
-    children_states = start_tetromino.get_after_states(start_state)
+                                 learned_directions, common_random_numbers, parallel_rollouts,
+                                 rollout_allocation, rollout_budget, rollout_cache):
+    children_states, action_features, do_rollout = expand_children(start_state, start_tetromino, feature_directors,
+                                                                   num_features, dom_filter, cumu_dom_filter)
     num_children = len(children_states)
     if num_children == 0:
         # Game over!
-        return (State(np.zeros((1, 1), dtype=np.bool_), np.zeros(1, dtype=np.int64),
-                      np.array([0], dtype=np.int64), np.array([0], dtype=np.int64),
-                      0.0, 1, "bcts", True, False),  # dummy state
+        return (game_over_state(start_state),
                 0,                                   # dummy child_index
                 np.zeros((2, 2)))                    # dummy action_features
 
-    action_features = np.zeros((num_children, num_features), dtype=np.float_)
-    for ix in range(num_children):
-        action_features[ix] = children_states[ix].get_features_and_direct(feature_directors, False)  # , order_by=self.feature_order
-    if dom_filter or cumu_dom_filter:
-        not_simply_dominated, not_cumu_dominated = dominance_filter(action_features, len_after_states=num_children)
+    # Shared by all rollouts of this decision.
+    after_states_buffer = generative_model.get_after_states_buffer(start_state.num_rows)
+    if common_random_numbers:
+        # The r-th rollout of every child uses the same pieces, so children are compared on paired samples.
+        piece_sequences = generative_model.sample_sequences(number_of_rollouts_per_child, rollout_length)
+    else:
+        piece_sequences = np.zeros((number_of_rollouts_per_child, 0), dtype=np.int8)
 
     child_total_values = np.zeros(num_children)
+    # A capped uniform allocation does the first `budget` rollouts of the rounds of one rollout per child (on every
+    # path). Child values are then mean instead of total rollout values (same argmax under the uniform allocation).
+    budget = np.sum(do_rollout) * number_of_rollouts_per_child
+    if rollout_budget > 0:
+        budget = min(budget, rollout_budget)
+    if rollout_allocation == "racing" or (not parallel_rollouts and (rollout_cache.enabled or rollout_budget > 0)):
+        allocator = RacingAllocator(do_rollout, number_of_rollouts_per_child, budget, rollout_allocation == "racing")
+        roll_out_allocated(allocator, rollout_cache, np.inf, children_states, rollout_length, rollout_mechanism,
+                           generative_model, policy_weights, rollout_dom_filter, rollout_cumu_dom_filter,
+                           feature_directors, num_features, gamma, learned_directions, after_states_buffer,
+                           piece_sequences)
+        child_total_values = allocator.means()
+    elif parallel_rollouts:
+        rollout_values = roll_out_children_in_parallel(children_states, do_rollout, rollout_length, rollout_mechanism,
+                                                       generative_model.copy_with_same_current_tetromino(),
+                                                       policy_weights, rollout_dom_filter, rollout_cumu_dom_filter,
+                                                       feature_directors, num_features, gamma, learned_directions,
+                                                       piece_sequences, number_of_rollouts_per_child, budget)
+        num_rollouts = rollouts_per_child(do_rollout, number_of_rollouts_per_child, budget)
+        for child in range(num_children):
+            if num_rollouts[child] > 0:
+                child_total_values[child] = np.sum(rollout_values[child]) / num_rollouts[child]
+            else:
+                child_total_values[child] = -np.inf
+    else:
+        for child in range(num_children):
+            if do_rollout[child]:
+                for rollout_ix in range(number_of_rollouts_per_child):
+                    child_total_values[child] += roll_out(children_states[child], rollout_length, rollout_mechanism,
+                                                          generative_model, policy_weights,
+                                                          rollout_dom_filter, rollout_cumu_dom_filter,
+                                                          feature_directors, num_features, gamma, learned_directions,
+                                                          after_states_buffer, piece_sequences[rollout_ix])
     for child in range(num_children):
-        do_rollout = False
-        if cumu_dom_filter:
-            if not_cumu_dominated[child]:
-                do_rollout = True
-        elif dom_filter:
-            if not_simply_dominated[child]:
-                do_rollout = True
-        else:
-            do_rollout = True
-
-        if do_rollout:
-            for rollout_ix in range(number_of_rollouts_per_child):
-                child_total_values[child] += roll_out(children_states[child], rollout_length, rollout_mechanism,
-                                                      generative_model, policy_weights,
-                                                      rollout_dom_filter, rollout_cumu_dom_filter,
-                                                      feature_directors, num_features, gamma, learned_directions)
-        else:
+        if not do_rollout[child]:
             child_total_values[child] = -np.inf
 
     max_value = np.max(child_total_values)
@@ -461,35 +605,254 @@ def choose_action_using_rollouts(start_state, start_tetromino, rollout_mechanism
     return children_states[child_index], child_index, action_features
 
 
+@njit(cache=False)
+def choose_action_anytime(start_state, start_tetromino, rollout_mechanism,
+                          rollout_length, generative_model, policy_weights,
+                          dom_filter, cumu_dom_filter, rollout_dom_filter, rollout_cumu_dom_filter,
+                          feature_directors, num_features, gamma, number_of_rollouts_per_child,
+                          learned_directions, common_random_numbers, rollout_allocation, rollout_cache,
+                          time_limit, max_rollouts):
+    """
+    Anytime version of choose_action_using_rollouts(). Rollouts are interleaved across children (rounds of one
+    rollout per child; with rollout_allocation == "racing" children that are out of contention are dropped) until
+    time_limit seconds have passed (checked after every rollout), max_rollouts rollouts are done or every child has
+    number_of_rollouts_per_child rollouts. time_limit <= 0 and max_rollouts <= 0 mean no limit.
+
+    Returns the child with the best mean rollout value so far (the max-utility child if no rollout was finished), its
+    index, the action features and the number of rollouts per child.
+    """
+    deadline = np.inf
+    if time_limit > 0:
+        deadline = clock() + time_limit
+    children_states, action_features, do_rollout = expand_children(start_state, start_tetromino, feature_directors,
+                                                                   num_features, dom_filter, cumu_dom_filter)
+    num_children = len(children_states)
+    if num_children == 0:
+        # Game over!
+        return game_over_state(start_state), 0, np.zeros((2, 2)), np.zeros(0, dtype=np.int64)
+
+    after_states_buffer = generative_model.get_after_states_buffer(start_state.num_rows)
+    if common_random_numbers:
+        piece_sequences = generative_model.sample_sequences(number_of_rollouts_per_child, rollout_length)
+    else:
+        piece_sequences = np.zeros((number_of_rollouts_per_child, 0), dtype=np.int8)
+    budget = np.sum(do_rollout) * number_of_rollouts_per_child
+    if max_rollouts > 0:
+        budget = min(budget, max_rollouts)
+    allocator = RacingAllocator(do_rollout, number_of_rollouts_per_child, budget, rollout_allocation == "racing")
+    roll_out_allocated(allocator, rollout_cache, deadline, children_states, rollout_length, rollout_mechanism,
+                       generative_model, policy_weights, rollout_dom_filter, rollout_cumu_dom_filter,
+                       feature_directors, num_features, gamma, learned_directions, after_states_buffer,
+                       piece_sequences)
+
+    if allocator.num_rollouts > 0:
+        child_values = allocator.means()
+    else:
+        child_values = np.full(num_children, -np.inf)
+        for child in range(num_children):
+            if do_rollout[child]:
+                child_values[child] = action_features[child].dot(policy_weights)
+    max_value = np.max(child_values)
+    max_value_indices = np.where(child_values == max_value)[0]
+    child_index = np.random.choice(max_value_indices)
+    return children_states[child_index], child_index, action_features, allocator.counts.copy()
+
+
+@njit(cache=False)
+def expand_children(start_state, start_tetromino, feature_directors, num_features, dom_filter, cumu_dom_filter):
+    # Returns the children, their (directed) features and which of them survive the dominance filter.
+    children_states = start_tetromino.get_after_states(start_state)
+    num_children = len(children_states)
+    action_features = np.zeros((num_children, num_features), dtype=np.float_)
+    for ix in range(num_children):
+        action_features[ix] = children_states[ix].get_features_and_direct(feature_directors, False)  # , order_by=self.feature_order
+    is_candidate = np.ones(num_children, dtype=np.bool_)
+    if num_children > 0 and (dom_filter or cumu_dom_filter):
+        not_simply_dominated, not_cumu_dominated = dominance_filter(action_features, len_after_states=num_children)
+        if cumu_dom_filter:
+            is_candidate = not_cumu_dominated
+        else:
+            is_candidate = not_simply_dominated
+    return children_states, action_features, is_candidate
+
+
+@njit(cache=False)
+def game_over_state(start_state):
+    # Dummy state (of the board backend of start_state) returned when there is no child.
+    if isinstance(start_state, BitboardState):
+        return BitboardState(np.zeros(1, dtype=np.uint16), np.zeros(1, dtype=np.int64), 0,
+                             np.array([0], dtype=np.int64), np.array([0], dtype=np.int64), 0.0, 1, "bcts", True)
+    return State(np.zeros((1, 1), dtype=np.bool_), np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), 0,
+                 np.array([0], dtype=np.int64), np.array([0], dtype=np.int64),
+                 0.0, 1, "bcts", True)
+
+
+@njit(cache=False)
+def clock():
+    with objmode(now='float64'):
+        now = time.perf_counter()
+    return now
+
+
+@njit(cache=False)
+def roll_out_allocated(allocator, rollout_cache, deadline, children_states, rollout_length, rollout_mechanism,
+                       generative_model, policy_weights, rollout_dom_filter, rollout_cumu_dom_filter,
+                       feature_directors, num_features, gamma, learned_directions, after_states_buffer,
+                       piece_sequences):
+    # Runs the rollouts chosen by allocator (an agents.rollout_allocation.RacingAllocator) until it is done or
+    # deadline (in time.perf_counter() seconds; np.inf: none) has passed. If rollout_cache is enabled, cached
+    # rollouts of the children count as done and the new rollouts are added to the cache.
+    num_children = len(children_states)
+    if rollout_cache.enabled:
+        # Rollouts of an after-state do not depend on how it was reached. Unless a preview shows it, the first piece
+        # is unknown. Other sampler state (7-bag, history, longer previews) is not part of the key, so
+        # MLearning.check_rollout_cache() refuses such samplers.
+        first_piece = -1
+        if generative_model.sampler.preview_size > 0:
+            first_piece = generative_model.preview()[0]
+        keys = np.zeros(num_children, dtype=np.int64)
+        for child in range(num_children):
+            if allocator.in_contention[child]:
+                keys[child] = rollout_key(children_states[child].board_hash, first_piece)
+                slot = rollout_cache.lookup(keys[child])
+                if slot >= 0:
+                    # The cache holds returns without the lines cleared by the child itself.
+                    reward = children_states[child].n_cleared_lines
+                    count = rollout_cache.counts[slot]
+                    value_sum = rollout_cache.sums[slot]
+                    allocator.add_statistics(child, count, value_sum + count * reward,
+                                             rollout_cache.sums_of_squares[slot] + 2 * reward * value_sum
+                                             + count * reward ** 2)
+        counts_before = allocator.counts.copy()
+        sums_before = allocator.sums.copy()
+        sums_of_squares_before = allocator.sums_of_squares.copy()
+
+    check_clock = deadline < np.inf
+    child = allocator.next_child()
+    while child >= 0:
+        value = roll_out(children_states[child], rollout_length, rollout_mechanism,
+                         generative_model, policy_weights,
+                         rollout_dom_filter, rollout_cumu_dom_filter,
+                         feature_directors, num_features, gamma, learned_directions,
+                         after_states_buffer, piece_sequences[allocator.counts[child]])
+        allocator.update(child, value)
+        if check_clock and clock() >= deadline:
+            break
+        child = allocator.next_child()
+
+    if rollout_cache.enabled:
+        for child in range(num_children):
+            count = allocator.counts[child] - counts_before[child]
+            if count > 0:
+                reward = children_states[child].n_cleared_lines
+                value_sum = allocator.sums[child] - sums_before[child]
+                value_sum_of_squares = allocator.sums_of_squares[child] - sums_of_squares_before[child]
+                rollout_cache.add(keys[child], count, value_sum - count * reward,
+                                  value_sum_of_squares - 2 * reward * value_sum + count * reward ** 2)
+
+
+@njit(cache=False, parallel=True)
+def roll_out_children_in_parallel(children_states, do_rollout, rollout_length, rollout_mechanism, generative_model,
+                                  policy_weights, rollout_dom_filter, rollout_cumu_dom_filter,
+                                  feature_directors, num_features, gamma, learned_directions,
+                                  piece_sequences, number_of_rollouts_per_child, budget):
+    # Returns the (num_children x number_of_rollouts_per_child) rollout values (0 for rollouts that were not done).
+    # The work items (rollout_ix, child) are the first `budget` rollouts of the rounds of one rollout per child
+    # with do_rollout (see rollouts_per_child()). They are split into one contiguous chunk per thread, and each chunk
+    # reuses one Tetromino (and its AfterStates buffer). Rollout rollout_ix of child draws its pieces from sub-stream
+    # child * number_of_rollouts_per_child + rollout_ix of generative_model, independent of the number of threads.
+    # The threads do not use the feature cache of generative_model (hashing.FeatureCache is not thread-safe).
+    num_children = len(children_states)
+    candidates = np.nonzero(do_rollout)[0]
+    num_candidates = len(candidates)
+    num_items = min(num_candidates * number_of_rollouts_per_child, budget)
+    rollout_values = np.zeros((num_children, number_of_rollouts_per_child))
+    num_chunks = min(get_num_threads(), num_items)
+    for chunk in prange(num_chunks):
+        chunk_model = generative_model.split(0)
+        no_feature_cache = FeatureCache(0, num_features, 4)
+        after_states_buffer = chunk_model.get_after_states_buffer(children_states[0].num_rows)
+        for item in range(chunk * num_items // num_chunks, (chunk + 1) * num_items // num_chunks):
+            child = candidates[item % num_candidates]
+            rollout_ix = item // num_candidates
+            generative_model.clone_into(chunk_model, child * number_of_rollouts_per_child + rollout_ix)
+            chunk_model.feature_cache = no_feature_cache
+            rollout_values[child, rollout_ix] = roll_out(children_states[child], rollout_length,
+                                                         rollout_mechanism, chunk_model,
+                                                         policy_weights, rollout_dom_filter,
+                                                         rollout_cumu_dom_filter, feature_directors, num_features,
+                                                         gamma, learned_directions, after_states_buffer,
+                                                         piece_sequences[rollout_ix])
+    return rollout_values
+
+
+@njit(cache=False)
+def rollouts_per_child(do_rollout, number_of_rollouts_per_child, budget):
+    # Number of rollouts per child if the first `budget` rollouts of the rounds of one rollout per child with
+    # do_rollout are done (the uniform allocation of agents.rollout_allocation.RacingAllocator).
+    candidates = np.nonzero(do_rollout)[0]
+    num_rollouts = np.zeros(len(do_rollout), dtype=np.int64)
+    for item in range(min(len(candidates) * number_of_rollouts_per_child, budget)):
+        num_rollouts[candidates[item % len(candidates)]] += 1
+    return num_rollouts
+
+
 @njit(cache=False)
 def roll_out(start_state, rollout_length, rollout_mechanism,
              generative_model, policy_weights,
              rollout_dom_filter, rollout_cumu_dom_filter,
-             feature_directors, num_features, gamma, learned_directions):
+             feature_directors, num_features, gamma, learned_directions, after_states_buffer, piece_sequence):
+    # Pieces are taken from piece_sequence if it is not empty (common random numbers), else they are sampled.
     value_estimate = start_state.n_cleared_lines
     state_tmp = start_state
     count = 1
     while not state_tmp.terminal_state and count <= rollout_length:
-        generative_model.next_tetromino()
+        if len(piece_sequence) > 0:
+            generative_model.current_tetromino = piece_sequence[count - 1]
+        else:
+            generative_model.next_tetromino()
+        if rollout_mechanism == "max_util":
+            if isinstance(start_state, BitboardState):
+                # BitboardStates are cheap to materialize (same placements, features and tie-breaking as below).
+                available_after_states = generative_model.get_after_states(state_tmp)
+                num_after_states = len(available_after_states)
+                if num_after_states == 0:
+                    # Game over!
+                    return value_estimate
+                action_features = np.zeros((num_after_states, num_features), dtype=np.float64)
+                for ix in range(num_after_states):
+                    action_features[ix] = available_after_states[ix].get_features_pure(False)
+                move_index = choose_max_util_action_in_rollout(
+                    action_features * feature_directors, policy_weights,
+                    rollout_dom_filter, rollout_cumu_dom_filter, generative_model.sampler.rng)
+                state_tmp = available_after_states[move_index]
+            else:
+                # Only the chosen placement is turned into a State.
+                num_after_states = generative_model.fill_after_states(state_tmp, after_states_buffer)
+                if num_after_states == 0:
+                    # Game over!
+                    return value_estimate
+                move_index = choose_max_util_action_in_rollout(
+                    after_states_buffer.features[:num_after_states] * feature_directors, policy_weights,
+                    rollout_dom_filter, rollout_cumu_dom_filter, generative_model.sampler.rng)
+                state_tmp = after_states_buffer.get_state(move_index)
+            value_estimate += gamma ** count * state_tmp.n_cleared_lines
+            count += 1
+            continue
         available_after_states = generative_model.get_after_states(state_tmp)
         if len(available_after_states) == 0:
             # Game over!
             return value_estimate
-        if rollout_mechanism == "max_util":
-            state_tmp = choose_max_util_action_in_rollout(
-                available_after_states, policy_weights,
-                rollout_dom_filter, rollout_cumu_dom_filter,
-                feature_directors, num_features)
-        elif rollout_mechanism == "greedy_if_reward_else_random":
+        if rollout_mechanism == "greedy_if_reward_else_random":
             state_tmp = choose_greedy_if_reward_else_random_action_in_rollout(
                 available_after_states, policy_weights,
                 rollout_dom_filter, rollout_cumu_dom_filter,
-                feature_directors, num_features)
+                feature_directors, num_features, generative_model.sampler.rng)
         elif rollout_mechanism == "greedy_if_reward_else_max_util_from_learned_directions":
             state_tmp = choose_greedy_if_reward_else_max_util_from_learned_directions_action_in_rollout(
                 available_after_states, policy_weights,
                 rollout_dom_filter, rollout_cumu_dom_filter,
-                feature_directors, num_features, learned_directions)
+                feature_directors, num_features, learned_directions, generative_model.sampler.rng)
 
         value_estimate += gamma ** count * state_tmp.n_cleared_lines
         count += 1
@@ -497,13 +860,11 @@ def roll_out(start_state, rollout_length, rollout_mechanism,
 
 
 @njit(cache=False)
-def choose_max_util_action_in_rollout(available_after_states, policy_weights,
-                                      rollout_dom_filter, rollout_cumu_dom_filter,
-                                      feature_directors, num_features):
-    num_states = len(available_after_states)
-    action_features = np.zeros((num_states, num_features))
-    for ix, after_state in enumerate(available_after_states):
-        action_features[ix] = after_state.get_features_and_direct(feature_directors, False)  # , order_by=self.feature_order
+def choose_max_util_action_in_rollout(action_features, policy_weights,
+                                      rollout_dom_filter, rollout_cumu_dom_filter, tie_rng):
+    # action_features have to be directed already. Returns the index of the chosen action; ties are broken with
+    # tie_rng (a tetris.rng.CounterRNG, e.g., the rollout's own stream, so that parallel rollouts are reproducible).
+    num_states = len(action_features)
     if rollout_dom_filter or rollout_cumu_dom_filter:
         not_simply_dominated, not_cumu_dominated = dominance_filter(action_features, len_after_states=num_states)  # domtools.
         if rollout_cumu_dom_filter:
@@ -515,16 +876,21 @@ def choose_max_util_action_in_rollout(available_after_states, policy_weights,
     else:
         map_back_vector = np.arange(num_states)
     utilities = action_features.dot(policy_weights)
-    move_index = np.random.choice(map_back_vector[utilities == np.max(utilities)])
+    move_index = random_element(map_back_vector[utilities == np.max(utilities)], tie_rng)
     # move_index = np.argmax(utilities)
-    move = available_after_states[move_index]
-    return move
+    return move_index
+
+
+@njit(cache=False)
+def random_element(array, tie_rng):
+    return array[tie_rng.randint(len(array))]
 
 
 @njit(cache=False)
 def choose_greedy_if_reward_else_random_action_in_rollout(available_after_states, policy_weights,
                                                           rollout_dom_filter, rollout_cumu_dom_filter,
-                                                          feature_directors, num_features):
+                                                          feature_directors, num_features, tie_rng):
+    # Random choices are drawn from tie_rng (see choose_max_util_action_in_rollout()).
     num_states = len(available_after_states)
     if rollout_dom_filter or rollout_cumu_dom_filter:
         action_features = np.zeros((num_states, num_features))
@@ -553,10 +919,10 @@ def choose_greedy_if_reward_else_random_action_in_rollout(available_after_states
                 max_reward = reward_of_after_state
     if max_reward > 0:
         max_reward_indeces = np.where(rewards == max_reward)[0]
-        move_index = np.random.choice(max_reward_indeces)
+        move_index = random_element(max_reward_indeces, tie_rng)
         # move = np.random.choice([available_after_states[i] for i in max_reward_indeces])
     else:
-        move_index = np.random.choice(num_states)
+        move_index = tie_rng.randint(num_states)
         # move = np.random.choice(available_after_states)
     move = available_after_states[move_index]
     return move
@@ -568,7 +934,8 @@ def choose_greedy_if_reward_else_max_util_from_learned_directions_action_in_roll
         rollout_dom_filter, rollout_cumu_dom_filter,
         feature_directors,
         num_features,
-        learned_directions):
+        learned_directions,
+        tie_rng):
     num_states = len(available_after_states)
     action_features = np.zeros((num_states, num_features))
     for ix, after_state in enumerate(available_after_states):
@@ -605,7 +972,7 @@ def choose_greedy_if_reward_else_max_util_from_learned_directions_action_in_roll
         num_states = len(available_after_states)
     utilities = action_features.dot(policy_weights * learned_directions)
     # utilities == np.max(utilities)
-    move_index = np.random.choice(np.arange(num_states)[utilities == np.max(utilities)])
+    move_index = random_element(np.arange(num_states)[utilities == np.max(utilities)], tie_rng)
     # move_index = np.argmax(utilities)
     move = available_after_states[move_index]
     return move
@@ -23,12 +23,13 @@ class MultinomialLogisticRegression:
         self.mlogit_data = ChoiceSetData(num_features=self.num_features, max_choice_set_size=self.max_choice_set_size)
 
     def fit(self, **rollout):
+        # State-action data is ragged: the actions of state ix are rows offsets[ix]:offsets[ix + 1].
         self.mlogit_data.delete_data()
-        for ix in range(len(rollout['state_action_values'])):
+        offsets = rollout['state_action_offsets']
+        for ix in range(len(rollout['did_rollout'])):
             if rollout['did_rollout'][ix]:
-                num_available_actions_ix = rollout['num_available_actions'][ix]
-                action_features = rollout['state_action_features'][ix][:num_available_actions_ix, :]
-                action_values = rollout['state_action_values'][ix][:num_available_actions_ix]
+                action_features = rollout['state_action_features'][offsets[ix]:offsets[ix + 1]]
+                action_values = rollout['state_action_values'][offsets[ix]:offsets[ix + 1]]
                 choice_index = np.random.choice(np.flatnonzero(action_values == np.max(action_values)))
                 self.mlogit_data.push(features=action_features,
                                       choice_index=choice_index,
@@ -89,31 +90,34 @@ class CmaesClassifier:
             inopts={'verb_disp': 0,
                     'verb_filenameprefix': "output/cmaesout" + str(self.seed),
                     'popsize': self.n})
-        N = len(rollout['state_action_features'])
+        N = len(rollout['did_rollout'])
         policy_weights = self.cmaes.optimize(lambda x: policy_loss_function(x,
                                                                             N,
                                                                             rollout['did_rollout'],
                                                                             rollout['state_action_features'],
-                                                                            rollout['num_available_actions'],
+                                                                            rollout['state_action_offsets'],
                                                                             rollout['state_action_values']),
                                              min_iterations=self.min_iterations).result.xbest
         return policy_weights
 
 
-@njit(cache=False)
+@njit(cache=True)
 def policy_loss_function(pol_weights,
                          N,
                          did_rollout,
                          state_action_features,
-                         num_available_actions,
+                         state_action_offsets,
                          state_action_values):
+    # The actions of state state_ix are rows state_action_offsets[state_ix]:state_action_offsets[state_ix + 1].
     loss = 0.
     number_of_samples = 0
     for state_ix in range(N):
         if did_rollout[state_ix]:
-            values = state_action_features[state_ix, :num_available_actions[state_ix]].dot(pol_weights)
-            pol_value = state_action_values[state_ix, np.argmax(values)]
-            max_value = np.max(state_action_values[state_ix, :len(values)])
+            start = state_action_offsets[state_ix]
+            end = state_action_offsets[state_ix + 1]
+            values = state_action_features[start:end].dot(pol_weights)
+            pol_value = state_action_values[start + np.argmax(values)]
+            max_value = np.max(state_action_values[start:end])
             loss += max_value - pol_value
             number_of_samples += 1
     loss /= number_of_samples
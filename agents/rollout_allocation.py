@@ -0,0 +1,119 @@
+"""
+Adaptive allocation of a rollout budget across the children (after-states) of a decision.
+
+RacingAllocator plays rounds: in every round each child that is still in contention gets one more rollout. After
+a round (and once every child has MIN_RACING_ROLLOUTS rollouts) a child is dropped if the upper end of its confidence
+interval (mean + RACING_CONFIDENCE * standard error) is below the lower end of the best child's. Racing stops when
+one child is left, every remaining child has max_rollouts_per_child rollouts, or the total budget is spent.
+With racing=False no child is dropped (plain round robin), which is what anytime action selection uses for the
+"uniform" allocation.
+
+With common random numbers, the k-th rollout of every child is its rollout number counts[child] == k, so children
+are still compared on the same piece sequences.
+
+Usage (from compiled code):
+    allocator = RacingAllocator(is_candidate, max_rollouts_per_child, budget, racing)
+    child = allocator.next_child()
+    while child >= 0:
+        allocator.update(child, <value of rollout number allocator.counts[child] of child>)
+        child = allocator.next_child()
+    allocator.means()
+"""
+
+import numpy as np
+from numba import int64, float64, bool_
+from numba.experimental import jitclass
+
+ROLLOUT_ALLOCATIONS = ("uniform", "racing")
+MIN_RACING_ROLLOUTS = 2
+RACING_CONFIDENCE = 2.0
+
+specRacingAllocator = [
+    ('num_children', int64),
+    ('max_rollouts_per_child', int64),
+    ('budget', int64),
+    ('num_rollouts', int64),
+    ('counts', int64[:]),
+    ('sums', float64[:]),
+    ('sums_of_squares', float64[:]),
+    ('in_contention', bool_[:]),
+    ('next_position', int64),
+    ('racing', bool_)
+]
+
+
+@jitclass(specRacingAllocator)
+class RacingAllocator:
+    def __init__(self, is_candidate, max_rollouts_per_child, budget, racing):
+        # is_candidate: children that may be rolled out at all (e.g., not dominated).
+        # budget: total number of rollouts over all children.
+        self.num_children = len(is_candidate)
+        self.max_rollouts_per_child = max_rollouts_per_child
+        self.budget = budget
+        self.num_rollouts = 0
+        self.counts = np.zeros(self.num_children, dtype=np.int64)
+        self.sums = np.zeros(self.num_children)
+        self.sums_of_squares = np.zeros(self.num_children)
+        self.in_contention = is_candidate.copy()
+        self.next_position = 0
+        self.racing = racing
+
+    def num_in_contention(self):
+        return np.sum(self.in_contention)
+
+    def next_child(self):
+        # Returns the child to roll out next, or -1 if racing is over.
+        while self.num_rollouts < self.budget and self.num_in_contention() > 0:
+            if self.next_position == self.num_children:
+                # End of round.
+                self.eliminate()
+                self.next_position = 0
+                remaining_counts = self.counts[self.in_contention]
+                if np.min(remaining_counts) >= self.max_rollouts_per_child:
+                    return -1
+                if len(remaining_counts) == 1 and remaining_counts[0] >= MIN_RACING_ROLLOUTS:
+                    return -1
+            child = self.next_position
+            self.next_position += 1
+            if self.in_contention[child] and self.counts[child] < self.max_rollouts_per_child:
+                return child
+        return -1
+
+    def update(self, child, value):
+        self.counts[child] += 1
+        self.sums[child] += value
+        self.sums_of_squares[child] += value * value
+        self.num_rollouts += 1
+
+    def add_statistics(self, child, count, value_sum, value_sum_of_squares):
+        # Rollouts done earlier (e.g., cached ones); they count towards max_rollouts_per_child but not the budget.
+        self.counts[child] += count
+        self.sums[child] += value_sum
+        self.sums_of_squares[child] += value_sum_of_squares
+
+    def eliminate(self):
+        if not self.racing or np.min(self.counts[self.in_contention]) < MIN_RACING_ROLLOUTS:
+            return
+        lower_bounds = np.full(self.num_children, -np.inf)
+        upper_bounds = np.full(self.num_children, -np.inf)
+        for child in range(self.num_children):
+            if self.in_contention[child]:
+                count = self.counts[child]
+                mean = self.sums[child] / count
+                variance = max(self.sums_of_squares[child] / count - mean * mean, 0.0) * count / (count - 1)
+                half_width = RACING_CONFIDENCE * np.sqrt(variance / count)
+                lower_bounds[child] = mean - half_width
+                upper_bounds[child] = mean + half_width
+        best_lower_bound = np.max(lower_bounds)
+        for child in range(self.num_children):
+            if self.in_contention[child] and upper_bounds[child] < best_lower_bound:
+                self.in_contention[child] = False
+
+    def means(self):
+        # Mean rollout value per child (-inf for children that were never rolled out).
+        means = np.full(self.num_children, -np.inf)
+        for child in range(self.num_children):
+            if self.counts[child] > 0:
+                means[child] = self.sums[child] / self.counts[child]
+        return means
+
@@ -1,7 +1,42 @@
 import numpy as np
 from domtools import dom_filter as dominance_filter
+import numba
 from numba import njit
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
 import warnings
+from tetris.features import bcts_features_batch_parallel
+from tetris.population import RolloutStatePopulation, population_from_states
+from tetris.tetromino import make_tetromino
+from tetris.samplers import SAMPLER_TYPES
+from agents.rollout_allocation import RacingAllocator, ROLLOUT_ALLOCATIONS
+
+
+# TBB and GNU OpenMP are not fork-safe: processes forked after a parallel kernel (e.g., bcts_features_batch_parallel)
+# ran in the parent can hang, e.g., at exit. numba's own "workqueue" layer is.
+FORK_SAFE_THREADING_LAYER = "workqueue"
+
+
+def use_fork_safe_threading_layer():
+    # Has to be called before the first parallel kernel runs (the threading layer cannot be changed afterwards).
+    try:
+        threading_layer = numba.threading_layer()
+    except ValueError:
+        # Not initialized yet.
+        numba.config.THREADING_LAYER = FORK_SAFE_THREADING_LAYER
+        return True
+    if threading_layer != FORK_SAFE_THREADING_LAYER:
+        warnings.warn(f"numba uses the '{threading_layer}' threading layer, forked worker processes may hang. "
+                      f"Set NUMBA_THREADING_LAYER={FORK_SAFE_THREADING_LAYER} to avoid this.")
+        return False
+    return True
+
+
+def fork_pool(num_workers):
+    # The resource tracker is started first, so that the workers share it and SharedArrays attached by them stay
+    # owned by the parent (a worker's own tracker would unlink them when the worker exits).
+    resource_tracker.ensure_running()
+    return multiprocessing.get_context("fork").Pool(num_workers)
 
 
 class OnlineRollout:
@@ -34,8 +69,17 @@ class BatchRollout:
                  use_cumul_dom=False,
                  use_filters_during_rollout=False,
                  use_filters_before_rollout=False,
-                 gamma=0.9):
+                 gamma=0.9,
+                 common_random_numbers=False,
+                 num_workers=1,
+                 rollout_allocation="uniform",
+                 rollout_budget=0,
+                 pool=None,
+                 feature_cache_size=0):
         self.name = "BatchRollout"
+        # Array store of the rollout start states (see tetris.population); the rollout set indexes into it.
+        if not isinstance(rollout_state_population, RolloutStatePopulation):
+            rollout_state_population = population_from_states(rollout_state_population, num_features)
         self.rollout_state_population = rollout_state_population
         self.rollout_set = None  # use self.construct_rollout_set()
         self.rollout_length = rollout_length
@@ -61,34 +105,145 @@ class BatchRollout:
         # Feature directors are only used for filtering.
         self.feature_directors = feature_directors
 
+        # If True, all actions of a rollout state are rolled out on the same pre-generated tetromino sequences.
+        self.common_random_numbers = common_random_numbers
+
+        # "racing" drops actions that are out of contention before they got rollouts_per_action rollouts
+        # (see agents.rollout_allocation); rollout_budget caps the rollouts per rollout state (<= 0: no extra cap), but
+        # every action gets at least one rollout.
+        assert rollout_allocation in ROLLOUT_ALLOCATIONS
+        self.rollout_allocation = rollout_allocation
+        self.rollout_budget = rollout_budget
+
+        # Every rollouts_for_states() call (i.e., every shard of an iteration) caches after-state features in its own
+        # hashing.FeatureCache of feature_cache_size entries (0: no cache). Hits and misses are summed over the
+        # iterations (see feature_cache_hit_rate()).
+        self.feature_cache_size = feature_cache_size
+        self.feature_cache_hits = 0
+        self.feature_cache_misses = 0
+
+        # num_workers > 1 shards the rollout set across a pool of forked processes (see perform_rollouts_in_pool()).
+        # `pool` can be an existing pool (e.g., a run.worker_pool.WarmPool) that outlives this object; otherwise
+        # a pool is forked on first use and terminated by close().
+        self.num_workers = num_workers
+        self.pool = pool
+        self.owns_pool = pool is None
+        if self.num_workers > 1:
+            use_fork_safe_threading_layer()
+        self.shared_population = None
+
     def construct_rollout_set(self):
-        self.rollout_set = np.random.choice(a=self.rollout_state_population, size=self.rollout_set_size,
-                                            replace=False if len(self.rollout_state_population) > self.rollout_set_size else True)
+        # Population indices of the rollout states.
+        self.rollout_set = self.rollout_state_population.sample(self.rollout_set_size)
 
     def perform_rollouts(self, policy_weights, value_weights, generative_model, use_state_values):
         self.construct_rollout_set()
         state_features = np.zeros((self.rollout_set_size, self.num_value_features), dtype=np.float)
-        state_values = np.zeros(self.rollout_set_size, dtype=np.float)
-        state_action_values = np.zeros((self.rollout_set_size, 34), dtype=np.float)
-        state_action_features = np.zeros((self.rollout_set_size, 34, self.num_features))
-        num_available_actions = np.zeros(self.rollout_set_size, dtype=np.int64)
-        did_rollout = np.ones(self.rollout_set_size, dtype=bool)
-        for ix, rollout_state in enumerate(self.rollout_set):
-            # print(f"rollout state = {ix}")
+        if use_state_values:
+            # Features of all rollout states at once (without intercept).
+            representations, lowest_free_rows = self.rollout_state_population.boards(self.rollout_set)
+            num_rows = self.rollout_state_population.num_rows
+            # Rollout start states have no landing height and no eroded piece cells.
+            no_placement = np.zeros(self.rollout_set_size, dtype=np.float64)
+            state_features[:, :self.num_features] = bcts_features_batch_parallel(representations, lowest_free_rows, num_rows,
+                                                                                 no_placement, no_placement)
+            mean_heights = np.mean(lowest_free_rows, axis=1)
+            state_features[:, self.num_features:] = np.exp(-(mean_heights[:, np.newaxis] - np.arange(5) * num_rows / 4) ** 2 / (2 * (num_rows / 5) ** 2))
+
+        # Rollout state ix uses sub-stream ix of a fresh stream per iteration, so results do not depend on num_workers.
+        iteration_model = generative_model.copy_with_same_current_tetromino()
+        generator_spec = (iteration_model.sampler.sampler_type, iteration_model.sampler.preview_size,
+                          iteration_model.sampler.rng.seed, iteration_model.sampler.rng.stream,
+                          iteration_model.num_features, iteration_model.num_columns)
+        if self.num_workers > 1:
+            results = self.perform_rollouts_in_pool(policy_weights, value_weights, generator_spec, use_state_values)
+        else:
+            num_available_actions = self.count_actions_for_states(self.rollout_state_population, self.rollout_set, 0,
+                                                                  generator_spec)
+            results = self.allocate_results(np.zeros, num_available_actions)
+            _, hits, misses = self.rollouts_for_states(self.rollout_state_population, self.rollout_set, 0,
+                                                       policy_weights, value_weights, generator_spec, use_state_values,
+                                                       results)
+            self.feature_cache_hits += hits
+            self.feature_cache_misses += misses
+        return dict(state_features=state_features, **results)
+
+    def feature_cache_hit_rate(self):
+        num_lookups = self.feature_cache_hits + self.feature_cache_misses
+        if num_lookups == 0:
+            return 0.0
+        return self.feature_cache_hits / num_lookups
+
+    def allocate_results(self, allocate, num_available_actions):
+        """
+        Result buffers for the whole rollout set in a ragged (CSR) layout: the actions of rollout state i are rows
+        state_action_offsets[i]:state_action_offsets[i + 1] of state_action_values and state_action_features.
+        `allocate` is called with (shape, dtype); num_available_actions comes from count_actions_for_states().
+        """
+        state_action_offsets = np.zeros(self.rollout_set_size + 1, dtype=np.int64)
+        np.cumsum(num_available_actions, out=state_action_offsets[1:])
+        num_actions = state_action_offsets[-1]
+        results = dict(state_values=allocate((self.rollout_set_size,), np.float64),
+                       state_action_values=allocate((num_actions,), np.float64),
+                       state_action_features=allocate((num_actions, self.num_features), np.float64),
+                       state_action_offsets=allocate((self.rollout_set_size + 1,), np.int64),
+                       num_available_actions=allocate((self.rollout_set_size,), np.int64),
+                       did_rollout=allocate((self.rollout_set_size,), np.bool_))
+        for name, counts in (("state_action_offsets", state_action_offsets),
+                             ("num_available_actions", num_available_actions)):
+            buffer = results[name]
+            (buffer if isinstance(buffer, np.ndarray) else buffer.array)[:] = counts
+        return results
+
+    def count_actions_for_states(self, rollout_state_population, rollout_set_ixs, first_ix, generator_spec):
+        """
+        Number of actions rollouts_for_states() returns for each of the population states rollout_set_ixs (with the
+        same tetrominos), without rolling out. Sizes the result buffers (see allocate_results()).
+        """
+        base_model = seeded_generative_model(generator_spec)
+        generative_model = base_model.split(0)
+        num_available_actions = np.zeros(len(rollout_set_ixs), dtype=np.int64)
+        for offset, population_ix in enumerate(rollout_set_ixs):
+            base_model.clone_into(generative_model, first_ix + offset)
+            generative_model.next_tetromino()
+            _, _, is_not_filtered_out = rollout_candidates(rollout_state_population[population_ix], generative_model,
+                                                           self.num_features, self.use_filters_before_rollout,
+                                                           self.use_dom, self.use_cumul_dom, self.feature_directors)
+            num_available_actions[offset] = np.sum(is_not_filtered_out)
+        return num_available_actions
+
+    def rollouts_for_states(self, rollout_state_population, rollout_set_ixs, first_ix, policy_weights, value_weights,
+                            generator_spec, use_state_values, results):
+        """
+        Rolls out the population states rollout_set_ixs, where rollout_set_ixs[i] is rollout state first_ix + i (this
+        determines its tetromino stream), and writes their results into the buffers `results` (see
+        allocate_results()). Returns the number of states rolled out and the hits and misses of the feature cache.
+        """
+        # Rollout state ix uses sub-stream ix of the generator; the Tetrominos are reused for all states (and share
+        # one feature cache).
+        base_model = seeded_generative_model(generator_spec)
+        base_model.use_feature_cache(self.feature_cache_size)
+        generative_model, value_model, action_model = base_model.split(0), base_model.split(0), base_model.split(0)
+        state_action_offsets = results["state_action_offsets"]
+        for offset, population_ix in enumerate(rollout_set_ixs):
+            ix = first_ix + offset
+            rollout_state = rollout_state_population[population_ix]
             # Sample tetromino for each rollout state (same for state and state-action rollouts)
+            base_model.clone_into(generative_model, ix)
             generative_model.next_tetromino()
 
+            results["state_values"][ix] = 0.0
             if use_state_values:
                 # Rollouts for state-value function estimation
-                state_features[ix, :] = rollout_state.get_features_pure(True)[1:]  # Don't store intercept
-                state_values[ix] = value_roll_out(rollout_state, self.rollout_length, self.gamma,
-                                                  generative_model.copy_with_same_current_tetromino(),
-                                                  policy_weights, value_weights, self.num_features,
-                                                  self.reward_greedy, self.use_filters_during_rollout,
-                                                  self.use_dom, self.use_cumul_dom,
-                                                  self.feature_directors)
+                generative_model.copy_into(value_model)
+                results["state_values"][ix] = value_roll_out(rollout_state, self.rollout_length, self.gamma,
+                                                             value_model, policy_weights, value_weights,
+                                                             self.num_features, self.reward_greedy,
+                                                             self.use_filters_during_rollout, self.use_dom,
+                                                             self.use_cumul_dom, self.feature_directors)
 
             # Rollouts for action-value function estimation
+            generative_model.copy_into(action_model)
             actions_value_estimates, state_action_features_ix = \
                 general_action_value_rollout(self.use_filters_during_rollout,
                                              self.use_filters_before_rollout,
@@ -96,7 +251,7 @@ class BatchRollout:
                                              self.rollout_length,
                                              self.rollouts_per_action,
                                              self.gamma,
-                                             generative_model.copy_with_same_current_tetromino(),
+                                             action_model,
                                              policy_weights,
                                              value_weights,
                                              self.num_features,
@@ -104,41 +259,151 @@ class BatchRollout:
                                              self.reward_greedy,
                                              self.use_dom,
                                              self.use_cumul_dom,
-                                             self.feature_directors)
-            # if (self.use_dom or self.use_cumul_dom) and not self.use_filters_during_rollout:
-            #     # Use dominance filters to filter the actions-to-be-considered, i.e., the initial A(s).
-            #     actions_value_estimates, state_action_features_ix = \
-            #         action_value_roll_out_with_filters(rollout_state, self.rollout_length, self.rollouts_per_action, self.gamma,
-            #                                            generative_model.copy_with_same_current_tetromino(),
-            #                                            policy_weights, value_weights, self.num_features, use_state_values,
-            #                                            self.reward_greedy, self.use_dom, self.use_cumul_dom, self.feature_directors)
-            # elif self.use_filters_during_rollout:
-            #     # Evaluate all actions in A(s), but use rollouts during filters.
-            #     actions_value_estimates, state_action_features_ix = \
-            #         action_value_roll_out_with_filters_during_rollouts(rollout_state, self.rollout_length, self.rollouts_per_action, self.gamma,
-            #                                                            generative_model.copy_with_same_current_tetromino(),
-            #                                                            policy_weights, value_weights, self.num_features, use_state_values,
-            #                                                            self.reward_greedy, self.use_dom, self.use_cumul_dom, self.feature_directors)
-            # else:
-            #     actions_value_estimates, state_action_features_ix = \
-            #         action_value_roll_out(rollout_state, self.rollout_length, self.rollouts_per_action, self.gamma,
-            #                               generative_model.copy_with_same_current_tetromino(),
-            #                               policy_weights, value_weights, self.num_features, use_state_values,
-            #                               self.reward_greedy)
+                                             self.feature_directors,
+                                             self.common_random_numbers,
+                                             self.rollout_allocation,
+                                             self.rollout_budget)
             num_av_acts = len(actions_value_estimates)
-            num_available_actions[ix] = num_av_acts
-            state_action_values[ix, :num_av_acts] = actions_value_estimates
-            if num_av_acts > 0:
-                state_action_features[ix, :num_av_acts, :] = state_action_features_ix
-            else:
-                # Rollout starting state was terminal state.
-                did_rollout[ix] = False
-        return dict(state_features=state_features,
-                    state_values=state_values,
-                    state_action_features=state_action_features,
-                    state_action_values=state_action_values,
-                    did_rollout=did_rollout,
-                    num_available_actions=num_available_actions)
+            start, end = state_action_offsets[ix], state_action_offsets[ix + 1]
+            assert num_av_acts == end - start, "Rollout state has a different number of actions than counted."
+            results["state_action_values"][start:end] = actions_value_estimates
+            results["state_action_features"][start:end] = state_action_features_ix.reshape(num_av_acts,
+                                                                                            self.num_features)
+            # False if the rollout starting state was a terminal state.
+            results["did_rollout"][ix] = num_av_acts > 0
+        return len(rollout_set_ixs), base_model.feature_cache.hits, base_model.feature_cache.misses
+
+    def perform_rollouts_in_pool(self, policy_weights, value_weights, generator_spec, use_state_values):
+        """
+        Shards the rollout set across self.num_workers processes. The population arrays are copied to shared memory
+        once (the jitclass States cannot be pickled); tasks only carry index vectors and workers build their States
+        from the shared arrays. A first pass counts the actions of every rollout state, so that the workers can write
+        their results in place into exact-size shared result buffers, which only live for this call.
+        """
+        if self.pool is None:
+            self.pool = fork_pool(self.num_workers)
+            self.owns_pool = True
+        if self.shared_population is None:
+            self.shared_population = {name: SharedArray.from_array(getattr(self.rollout_state_population, name))
+                                      for name in ("rows", "heights")}
+        specs = {name: shared_array.spec() for name, shared_array in self.shared_population.items()}
+        bounds = np.linspace(0, self.rollout_set_size, self.num_workers + 1).astype(np.int64)
+        shards = [(self.rollout_set[bounds[w]:bounds[w + 1]], bounds[w])
+                  for w in range(self.num_workers) if bounds[w + 1] > bounds[w]]
+        count_tasks = [(self, "count_actions_for_states", specs, {}, (rollout_set_ixs, first_ix, generator_spec))
+                       for rollout_set_ixs, first_ix in shards]
+        num_available_actions = np.concatenate(self.pool.map(pool_worker, count_tasks))
+        shared_results = self.allocate_results(SharedArray, num_available_actions)
+        try:
+            result_specs = {name: shared_array.spec() for name, shared_array in shared_results.items()}
+            tasks = [(self, "rollouts_for_states", specs, result_specs,
+                      (rollout_set_ixs, first_ix, policy_weights, value_weights, generator_spec, use_state_values))
+                     for rollout_set_ixs, first_ix in shards]
+            num_states_done, hits, misses = np.sum(self.pool.map(pool_worker, tasks), axis=0)
+            assert num_states_done == self.rollout_set_size
+            self.feature_cache_hits += hits
+            self.feature_cache_misses += misses
+            return {name: shared_array.array.copy() for name, shared_array in shared_results.items()}
+        finally:
+            for shared_array in shared_results.values():
+                shared_array.release(unlink=True)
+
+    def close(self):
+        if self.pool is not None and self.owns_pool:
+            self.pool.terminate()
+        self.pool = None
+        if self.shared_population is not None:
+            for shared_array in self.shared_population.values():
+                shared_array.release(unlink=True)
+        self.shared_population = None
+
+    def __getstate__(self):
+        # Sent to the workers: everything but the population (read from shared memory instead) and the pool.
+        worker_state = self.__dict__.copy()
+        worker_state["rollout_state_population"] = None
+        worker_state["rollout_set"] = None
+        worker_state["pool"] = None
+        worker_state["shared_population"] = None
+        return worker_state
+
+
+class SharedArray:
+    """ A NumPy array in shared memory that can be attached to by name from other processes. """
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            # Workers share the creator's resource tracker (see fork_pool()), which already tracks the block.
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def from_array(cls, array):
+        shared_array = cls(array.shape, array.dtype)
+        shared_array.array[...] = array
+        return shared_array
+
+    def spec(self):
+        return self.shm.name, self.shape, self.dtype.str
+
+    def release(self, unlink=False):
+        self.array = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def pool_worker(task):
+    # Calls BatchRollout.<method>(population, *args[, results]) on the shared population (and result buffers).
+    rollout_handler, method, specs, result_specs, args = task
+    shared = {name: SharedArray(shape, dtype, name=shm_name) for name, (shm_name, shape, dtype) in specs.items()}
+    shared_results = {name: SharedArray(shape, dtype, name=shm_name)
+                      for name, (shm_name, shape, dtype) in result_specs.items()}
+    try:
+        rollout_state_population = RolloutStatePopulation(shared["rows"].array, shared["heights"].array,
+                                                          rollout_handler.num_features)
+        results = {name: shared_array.array for name, shared_array in shared_results.items()}
+        if results:
+            args = args + (results,)
+        return getattr(rollout_handler, method)(rollout_state_population, *args)
+    finally:
+        # The shared blocks can only be closed once no array refers to them.
+        rollout_state_population = None
+        results = None
+        for shared_array in list(shared.values()) + list(shared_results.values()):
+            shared_array.release()
+
+
+def seeded_generative_model(generator_spec):
+    # Tetromino on the stream described by generator_spec (see perform_rollouts()).
+    sampler_type, preview_size, seed, stream, num_features, num_columns = generator_spec
+    return make_tetromino("bcts", num_features, num_columns, SAMPLER_TYPES[sampler_type], preview_size, seed, stream)
+
+
+@njit(cache=False)
+def rollout_candidates(start_state, generative_model, num_features, use_filters_before_rollout, use_dom, use_cumul_dom,
+                       feature_directors):
+    # After-states of start_state for the current tetromino, their features, and which of them are rolled out (and
+    # returned) by general_action_value_rollout(). Uses no random numbers.
+    child_states = generative_model.get_after_states(start_state)
+    num_child_states = len(child_states)
+    state_action_features = np.zeros((num_child_states, num_features), dtype=np.float_)
+    for ix in range(num_child_states):
+        state_action_features[ix] = child_states[ix].get_features_pure(False)  # , order_by=self.feature_order
+    is_not_filtered_out = np.ones(num_child_states, dtype=np.bool_)
+    if use_filters_before_rollout and num_child_states > 0:
+        not_simply_dominated, not_cumu_dominated = dominance_filter(state_action_features * feature_directors,
+                                                                    len_after_states=num_child_states)
+        if use_dom:
+            is_not_filtered_out = not_simply_dominated
+        elif use_cumul_dom:
+            is_not_filtered_out = not_cumu_dominated
+        else:
+            raise ValueError
+    return child_states, state_action_features, is_not_filtered_out
 
 
 @njit(cache=False)
@@ -156,93 +421,119 @@ def general_action_value_rollout(use_filters_during_rollout,
                                  reward_greedy,
                                  use_dom,
                                  use_cumul_dom,
-                                 feature_directors):
-    child_states = generative_model.get_after_states(start_state)
+                                 feature_directors,
+                                 common_random_numbers,
+                                 rollout_allocation,
+                                 rollout_budget):
+    child_states, state_action_features, is_not_filtered_out = \
+        rollout_candidates(start_state, generative_model, num_features, use_filters_before_rollout, use_dom,
+                           use_cumul_dom, feature_directors)
     num_child_states = len(child_states)
     action_value_estimates = np.zeros(num_child_states)
-    state_action_features = np.zeros((num_child_states, num_features))
 
     if num_child_states == 0:
         # Rollout starting state is terminal state
         return action_value_estimates, state_action_features
 
-    state_action_features = np.zeros((num_child_states, num_features), dtype=np.float_)
-    for ix in range(num_child_states):
-        state_action_features[ix] = child_states[ix].get_features_pure(False)  # , order_by=self.feature_order
+    # Shared by all rollouts from this state.
+    after_states_buffer = generative_model.get_after_states_buffer(start_state.num_rows)
+    if common_random_numbers:
+        # The r-th rollout of every child uses the same pieces (including the one for the truncation value).
+        piece_sequences = generative_model.sample_sequences(rollouts_per_action, rollout_length + 1)
+    else:
+        piece_sequences = np.zeros((rollouts_per_action, 0), dtype=np.int8)
+
+    if rollout_allocation == "racing" or rollout_budget > 0:
+        # A capped uniform allocation does the first `budget` rollouts of the rounds of one rollout per child. The
+        # budget covers at least the first round, so that every returned action has a (finite) value estimate.
+        num_candidates = np.sum(is_not_filtered_out)
+        budget = num_candidates * rollouts_per_action
+        if rollout_budget > 0:
+            budget = min(budget, max(rollout_budget, num_candidates))
+        allocator = RacingAllocator(is_not_filtered_out, rollouts_per_action, budget, rollout_allocation == "racing")
+        child_ix = allocator.next_child()
+        while child_ix >= 0:
+            cumulative_reward = action_value_roll_out_once(child_states[child_ix], rollout_length, gamma,
+                                                           generative_model, policy_weights, value_weights,
+                                                           use_state_values, use_filters_during_rollout,
+                                                           use_dom, use_cumul_dom, feature_directors,
+                                                           after_states_buffer,
+                                                           piece_sequences[allocator.counts[child_ix]])
+            allocator.update(child_ix, cumulative_reward)
+            child_ix = allocator.next_child()
+        # Children that dropped out keep the mean of the rollouts they got.
+        action_value_estimates = allocator.means()
+    else:
+        for child_ix in range(num_child_states):
+            if is_not_filtered_out[child_ix]:
+                for rollout_ix in range(rollouts_per_action):
+                    action_value_estimates[child_ix] += action_value_roll_out_once(child_states[child_ix], rollout_length,
+                                                                                   gamma, generative_model,
+                                                                                   policy_weights, value_weights,
+                                                                                   use_state_values,
+                                                                                   use_filters_during_rollout,
+                                                                                   use_dom, use_cumul_dom,
+                                                                                   feature_directors,
+                                                                                   after_states_buffer,
+                                                                                   piece_sequences[rollout_ix])
+        action_value_estimates /= rollouts_per_action
 
-    if use_filters_before_rollout:
-        not_simply_dominated, not_cumu_dominated = dominance_filter(state_action_features * feature_directors,
-                                                                    len_after_states=num_child_states)
+    action_value_estimates = action_value_estimates[is_not_filtered_out]
+    state_action_features = state_action_features[is_not_filtered_out]
+    return action_value_estimates, state_action_features
 
-    is_not_filtered_out = np.ones(num_child_states, dtype=np.bool_)
-    for child_ix in range(num_child_states):
-        do_rollout = False
-        if use_filters_before_rollout:
-            if use_dom:
-                if not_simply_dominated[child_ix]:
-                    do_rollout = True
-            elif use_cumul_dom:
-                if not_cumu_dominated[child_ix]:
-                    do_rollout = True
-            else:
-                raise ValueError
+
+@njit(cache=False)
+def action_value_roll_out_once(child_state, rollout_length, gamma, generative_model, policy_weights, value_weights,
+                               use_state_values, use_filters_during_rollout, use_dom, use_cumul_dom,
+                               feature_directors, after_states_buffer, piece_sequence):
+    # Discounted return of one rollout from child_state. Pieces are taken from piece_sequence if it is not empty
+    # (common random numbers), else they are sampled.
+    state_tmp = child_state
+    cumulative_reward = state_tmp.n_cleared_lines
+    game_ended = False
+    count = 0
+    while not game_ended and count < rollout_length:  # there are rollout_length rollouts
+        if len(piece_sequence) > 0:
+            generative_model.current_tetromino = piece_sequence[count]
         else:
-            do_rollout = True
-
-        if do_rollout:
-            state_tmp = child_states[child_ix]
-            start_reward = state_tmp.n_cleared_lines
-
-            for rollout_ix in range(rollouts_per_action):
-                cumulative_reward = start_reward
-                game_ended = False
-                count = 0
-                while not game_ended and count < rollout_length:  # there are rollout_length rollouts
-                    generative_model.next_tetromino()
-                    available_after_states = generative_model.get_after_states(state_tmp)
-                    num_after_states = len(available_after_states)
-                    if num_after_states == 0:
-                        # Terminal state
-                        game_ended = True
-                    else:
-                        state_tmp = select_action_in_rollout(available_after_states, policy_weights,
-                                                             num_features, use_filters_during_rollout, feature_directors,
-                                                             use_dom, use_cumul_dom)
-                        cumulative_reward += (gamma ** count) * state_tmp.n_cleared_lines
-                    count += 1
-
-                # One more (the (rollout_length+1)-th) for truncation value!
-                if use_state_values and not game_ended:
-                    generative_model.next_tetromino()
-                    available_after_states = generative_model.get_after_states(state_tmp)
-                    num_after_states = len(available_after_states)
-                    if num_after_states > 0:
-                        state_tmp = select_action_in_rollout(available_after_states, policy_weights,
-                                                             num_features, use_filters_during_rollout, feature_directors,
-                                                             use_dom, use_cumul_dom)
-
-                        # Get state value of last state.
-                        final_state_features = state_tmp.get_features_pure(True)
-                        cumulative_reward += (gamma ** count) * final_state_features.dot(value_weights)
-
-                action_value_estimates[child_ix] += cumulative_reward
+            generative_model.next_tetromino()
+        num_after_states = generative_model.fill_after_states(state_tmp, after_states_buffer)
+        if num_after_states == 0:
+            # Terminal state
+            game_ended = True
         else:
-            is_not_filtered_out[child_ix] = False
-            action_value_estimates[child_ix] = -np.inf
+            move_index = select_action_in_rollout(after_states_buffer.features[:num_after_states], policy_weights,
+                                                  use_filters_during_rollout, feature_directors,
+                                                  use_dom, use_cumul_dom)
+            state_tmp = after_states_buffer.get_state(move_index)
+            cumulative_reward += (gamma ** count) * state_tmp.n_cleared_lines
+        count += 1
 
-    action_value_estimates = action_value_estimates[is_not_filtered_out]
-    state_action_features = state_action_features[is_not_filtered_out]
-    action_value_estimates /= rollouts_per_action
-    return action_value_estimates, state_action_features
+    # One more (the (rollout_length+1)-th) for truncation value!
+    if use_state_values and not game_ended:
+        if len(piece_sequence) > 0:
+            generative_model.current_tetromino = piece_sequence[count]
+        else:
+            generative_model.next_tetromino()
+        num_after_states = generative_model.fill_after_states(state_tmp, after_states_buffer)
+        if num_after_states > 0:
+            move_index = select_action_in_rollout(after_states_buffer.features[:num_after_states], policy_weights,
+                                                  use_filters_during_rollout, feature_directors,
+                                                  use_dom, use_cumul_dom)
+            state_tmp = after_states_buffer.get_state(move_index)
+
+            # Get state value of last state.
+            final_state_features = state_tmp.get_features_pure(True)
+            cumulative_reward += (gamma ** count) * final_state_features.dot(value_weights)
+    return cumulative_reward
 
 
 @njit
-def select_action_in_rollout(available_after_states, policy_weights, num_features,
+def select_action_in_rollout(action_features, policy_weights,
                              use_filters_during_rollout, feature_directors, use_dom, use_cumul_dom):
-    num_after_states = len(available_after_states)
-    action_features = np.zeros((num_after_states, num_features))
-    for ix, after_state in enumerate(available_after_states):
-        action_features[ix] = after_state.get_features_pure(False)  # , order_by=self.feature_order
+    # Returns the index (into action_features) of the chosen after-state.
+    num_after_states = len(action_features)
     if use_filters_during_rollout:
         not_simply_dominated, not_cumu_dominated = dominance_filter(action_features * feature_directors,
                                                                     len_after_states=num_after_states)  # domtools.
@@ -258,10 +549,8 @@ def select_action_in_rollout(available_after_states, policy_weights, num_feature
     utilities = action_features.dot(np.ascontiguousarray(policy_weights))
     move_index = np.argmax(utilities)
     if use_filters_during_rollout:
-        state_tmp = available_after_states[map_back_vector[move_index]]
-    else:
-        state_tmp = available_after_states[move_index]
-    return state_tmp
+        move_index = map_back_vector[move_index]
+    return move_index
 
 
 @njit
@@ -278,16 +567,19 @@ def value_roll_out(start_state,
                    use_cumul_dom,
                    feature_directors):
     value_estimate = 0.0
+    if start_state.terminal_state:
+        return value_estimate
+    after_states_buffer = generative_model.get_after_states_buffer(start_state.num_rows)
     state_tmp = start_state
     count = 0
     while not state_tmp.terminal_state and count < rollout_length:  # there are only (m-1) rollouts
         # generative_model.next_tetromino()
-        available_after_states = generative_model.get_after_states(state_tmp)
-        num_after_states = len(available_after_states)
+        num_after_states = generative_model.fill_after_states(state_tmp, after_states_buffer)
         if num_after_states == 0:
             return value_estimate
-        state_tmp = select_action_in_rollout(available_after_states, policy_weights, num_features,
-                                             use_filters_during_rollout, feature_directors, use_dom, use_cumul_dom)
+        move_index = select_action_in_rollout(after_states_buffer.features[:num_after_states], policy_weights,
+                                              use_filters_during_rollout, feature_directors, use_dom, use_cumul_dom)
+        state_tmp = after_states_buffer.get_state(move_index)
         value_estimate += (gamma ** count) * state_tmp.n_cleared_lines
         count += 1
         generative_model.next_tetromino()
@@ -295,12 +587,12 @@ def value_roll_out(start_state,
     # One more (the m-th) for truncation value!
     if not state_tmp.terminal_state:
         # generative_model.next_tetromino()
-        available_after_states = generative_model.get_after_states(state_tmp)
-        num_after_states = len(available_after_states)
+        num_after_states = generative_model.fill_after_states(state_tmp, after_states_buffer)
         if num_after_states == 0:
             return value_estimate
-        state_tmp = select_action_in_rollout(available_after_states, policy_weights, num_features,
-                                             use_filters_during_rollout, feature_directors, use_dom, use_cumul_dom)
+        move_index = select_action_in_rollout(after_states_buffer.features[:num_after_states], policy_weights,
+                                              use_filters_during_rollout, feature_directors, use_dom, use_cumul_dom)
+        state_tmp = after_states_buffer.get_state(move_index)
         final_state_features = state_tmp.get_features_pure(True)  # order_by=None, standardize_by=None,
         value_estimate += (gamma ** count) * final_state_features.dot(value_weights)
     return value_estimate
@@ -314,13 +606,9 @@ def calculate_available_actions(rollout_state_population, generative_model, env)
     for ix in range(len(rollout_state_population)):
         # print(ix)
         generative_model.next_tetromino()
-        child_states = generative_model.get_after_states(rollout_state_population[ix])
-        num_child_states = len(child_states)
-        num_av_acts[ix] = len(child_states)
-
-        state_action_features = np.zeros((num_child_states, env.num_features), dtype=np.float_)
-        for child_ix in range(num_child_states):
-            state_action_features[child_ix] = child_states[child_ix].get_features_pure(False)  # , order_by=self.feature_order
+        state_action_features, _ = generative_model.get_after_state_features(rollout_state_population[ix])
+        num_child_states = len(state_action_features)
+        num_av_acts[ix] = num_child_states
 
         not_simply_dominated, not_cumu_dominated = dominance_filter(state_action_features * feature_directors,
                                                                     len_after_states=num_child_states)
@@ -1,4 +1,5 @@
 import tetris
+from tetris.rng import seed_global
 from agents.constant_agent import ConstantAgent
 import numpy as np
 import time
@@ -8,11 +9,13 @@ from numba import njit
 
 time_id = datetime.now().strftime('%Y_%m_%d_%H_%M')
 np.random.seed(1)
+seed_global(1)  # tie-breaking in compiled code
 
 
 @njit
-def evaluate(env, agent, num_runs):
-    np.random.seed(1)
+def evaluate(env, agent, num_runs, seed):
+    # Every policy is evaluated on the same tetromino sequences (stream 0 of `seed`).
+    env.seed(seed, 0)
     rewards = np.zeros(num_runs, dtype=np.int64)
     for i in range(num_runs):
         env.reset()
@@ -42,17 +45,17 @@ env = tetris.Tetris(num_columns=10, num_rows=10)
 
 print("Equal weights policy")
 agent = ConstantAgent(policy_weights=np.ones(8, dtype=np.float64))
-ew_rewards = evaluate(env, agent, num_runs)
+ew_rewards = evaluate(env, agent, num_runs, 1)
 
 
 print("RANDOM policy")
 agent = ConstantAgent(policy_weights=np.random.normal(0, 1, 8))
-random_rewards = evaluate(env, agent, num_runs, visualize=False, clear_the_output=False, sleep=0)
+random_rewards = evaluate(env, agent, num_runs, 1)
 
 
 print("Canonical non-compensatory weighting (i.e., 1/2, 1/4, 1/8, 1/16, 1/32, ...)")
 agent = ConstantAgent(policy_weights=0.5**np.arange(8))
-ttb_rewards = evaluate(env, agent, num_runs, visualize=False, clear_the_output=False, sleep=0)
+ttb_rewards = evaluate(env, agent, num_runs, 1)
 
 end = time.time()
 print("All together took ", end - start, " seconds.")
@@ -1,6 +1,11 @@
 import numpy as np
 from numba import njit
-from agents.constant_agent import ConstantAgent
+from agents.constant_agent import ConstantAgent, dominance_candidates, choose_max_utility_index
+from tetris.after_states import AfterStates
+from tetris.hashing import FeatureCache
+from tetris.state import NUM_HIDDEN_ROWS
+from tetris.rng import CounterRNG
+from tetris.samplers import NUM_TETROMINOS
 import time
 
 
@@ -136,3 +141,134 @@ def evaluate(env, agent, num_runs):
             env.make_step(after_state)
         rewards[i] = env.cleared_lines
     return rewards
+
+
+def evaluate_vectorized(vec_env, policy_weights, num_runs):
+    """
+    Same as evaluate() for a ConstantAgent without filters, but plays vec_env.num_games games (a
+    tetris.vec_game.VecTetris) at once. num_runs has to be a multiple of vec_env.num_games.
+    """
+    assert num_runs % vec_env.num_games == 0, "num_runs has to be a multiple of vec_env.num_games."
+    batch_weights = np.ascontiguousarray(np.broadcast_to(policy_weights, (vec_env.num_games, len(policy_weights))),
+                                         dtype=np.float64)
+    rewards = np.zeros(num_runs, dtype=np.int64)
+    for batch_ix in range(num_runs // vec_env.num_games):
+        rewards[batch_ix * vec_env.num_games:(batch_ix + 1) * vec_env.num_games] = vec_env.play(batch_weights)
+    return rewards
+
+
+@njit(cache=False)
+def sample_tetromino_sequences(num_sequences, sequence_length, seed, stream=0):
+    # Fixed (uniform) tetromino sequences for evaluate_policies(). Sequence ix comes from sub-stream ix of stream
+    # `stream` of the counter-based generator keyed by `seed` (see tetris.rng), so it does not depend on the global
+    # random state or on the number and length of the other sequences.
+    generator = CounterRNG(seed, stream)
+    sequence_generator = generator.split(0)
+    tetromino_sequences = np.empty((num_sequences, sequence_length), dtype=np.int8)
+    for sequence_ix in range(num_sequences):
+        generator.clone_into(sequence_generator, sequence_ix)
+        for step in range(sequence_length):
+            tetromino_sequences[sequence_ix, step] = sequence_generator.randint(NUM_TETROMINOS)
+    return tetromino_sequences
+
+
+@njit
+def evaluate_policies(policy_weights, tetromino_sequences, num_rows, num_columns, max_cleared_test_lines,
+                      feature_directors=np.array([-1, -1, -1, -1, -1, -1, 1, -1], dtype=np.float64),
+                      use_filter_in_eval=False, use_cumul_dom_filter=False):
+    """
+    Cleared lines of each of the K policies (rows of the K x num_features matrix policy_weights) in each game
+    given by a row of tetromino_sequences. Returns a (K x num_sequences) array.
+
+    Moves are chosen like ConstantAgent(policy_weights[k], feature_directors=feature_directors,
+    use_filter_in_eval=use_filter_in_eval, use_cumul_dom_filter=use_cumul_dom_filter) would: optionally
+    dominance-filtered, ties broken at random (seed with tetris.rng.seed_global()).
+    """
+    rewards = np.zeros((policy_weights.shape[0], tetromino_sequences.shape[0]), dtype=np.int64)
+    after_states_buffer = AfterStates(num_rows, num_columns, policy_weights.shape[1], "bcts")
+    for sequence_ix in range(tetromino_sequences.shape[0]):
+        rewards[:, sequence_ix] = evaluate_policies_on_sequence(policy_weights, tetromino_sequences[sequence_ix],
+                                                                num_rows, num_columns, max_cleared_test_lines,
+                                                                feature_directors, use_filter_in_eval,
+                                                                use_cumul_dom_filter, after_states_buffer)
+    return rewards
+
+
+@njit
+def evaluate_policies_on_sequence(policy_weights, tetromino_sequence, num_rows, num_columns, max_cleared_test_lines,
+                                  feature_directors, use_filter_in_eval, use_cumul_dom_filter, after_states_buffer):
+    """
+    Plays one game per policy (moves chosen as in evaluate_policies()) on the same tetromino sequence. Policies
+    whose games are still on the same board form a group: the after-states (and their dominance filter) are computed
+    once per group, and a group is only split when its policies choose different moves.
+    A game ends when it has no non-terminal move, when it has cleared more than max_cleared_test_lines lines or
+    when the sequence is exhausted. Returns the cleared lines per policy.
+    """
+    num_policies, num_features = policy_weights.shape
+    total_rows = num_rows + NUM_HIDDEN_ROWS
+    # Groups are double-buffered: the groups of the current step are read from [cur], the next ones go to [1 - cur].
+    # members[cur, group_starts[cur, g]:group_starts[cur, g + 1]] are the policies of group g.
+    representations = np.zeros((2, num_policies, total_rows, num_columns), dtype=np.bool_)
+    lowest_free_rows = np.zeros((2, num_policies, num_columns), dtype=np.int64)
+    column_masks = np.zeros((2, num_policies, num_columns), dtype=np.int64)
+    board_hashes = np.zeros((2, num_policies), dtype=np.int64)
+    cleared_lines = np.zeros((2, num_policies), dtype=np.int64)
+    members = np.zeros((2, num_policies), dtype=np.int64)
+    group_starts = np.zeros((2, num_policies + 1), dtype=np.int64)
+    members[0] = np.arange(num_policies)
+    group_starts[0, 1] = num_policies
+    num_groups = 1
+
+    rewards = np.zeros(num_policies, dtype=np.int64)
+    feature_cache = FeatureCache(0, num_features, 4)
+    move_of_policy = np.zeros(num_policies, dtype=np.int64)
+    group_of_move = np.zeros(after_states_buffer.capacity, dtype=np.int64)
+    group_sizes = np.zeros(num_policies, dtype=np.int64)
+    cur = 0
+    for step in range(len(tetromino_sequence)):
+        if num_groups == 0:
+            break
+        nxt = 1 - cur
+        num_new_groups = 0
+        for g in range(num_groups):
+            if cleared_lines[cur, g] > max_cleared_test_lines:
+                continue
+            num_after_states = after_states_buffer.fill_from_arrays(representations[cur, g], lowest_free_rows[cur, g],
+                                                                    column_masks[cur, g], board_hashes[cur, g],
+                                                                    tetromino_sequence[step], feature_cache)
+            if num_after_states == 0:
+                continue
+            action_features = after_states_buffer.features[:num_after_states]
+            is_candidate = dominance_candidates(action_features, feature_directors, use_filter_in_eval,
+                                                use_cumul_dom_filter)
+            group_of_move[:num_after_states] = -1
+            first_new_group = num_new_groups
+            for member_ix in range(group_starts[cur, g], group_starts[cur, g + 1]):
+                policy_ix = members[cur, member_ix]
+                move_index = choose_max_utility_index(action_features, policy_weights[policy_ix], is_candidate)
+                move_of_policy[policy_ix] = move_index
+                if group_of_move[move_index] < 0:
+                    new_group = num_new_groups
+                    num_new_groups += 1
+                    group_of_move[move_index] = new_group
+                    group_sizes[new_group] = 0
+                    representations[nxt, new_group] = after_states_buffer.representations[move_index]
+                    lowest_free_rows[nxt, new_group] = after_states_buffer.lowest_free_rows[move_index]
+                    column_masks[nxt, new_group] = after_states_buffer.column_masks[move_index]
+                    board_hashes[nxt, new_group] = after_states_buffer.board_hashes[move_index]
+                    cleared_lines[nxt, new_group] = cleared_lines[cur, g] + after_states_buffer.n_cleared_lines[move_index]
+                group_sizes[group_of_move[move_index]] += 1
+            # Members of the new groups (in order of their creation).
+            for new_group in range(first_new_group, num_new_groups):
+                group_starts[nxt, new_group + 1] = group_starts[nxt, new_group] + group_sizes[new_group]
+                group_sizes[new_group] = group_starts[nxt, new_group]  # now the next free position
+            for member_ix in range(group_starts[cur, g], group_starts[cur, g + 1]):
+                policy_ix = members[cur, member_ix]
+                new_group = group_of_move[move_of_policy[policy_ix]]
+                members[nxt, group_sizes[new_group]] = policy_ix
+                group_sizes[new_group] += 1
+                rewards[policy_ix] = cleared_lines[nxt, new_group]
+        num_groups = num_new_groups
+        cur = nxt
+    return rewards
+
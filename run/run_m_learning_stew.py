@@ -9,6 +9,8 @@ import random
 import multiprocessing
 from run import learn_and_evaluate
 from run import utils_run
+from run.worker_pool import WarmPool
+from tetris.rng import seed_global
 
 """
 
@@ -39,6 +41,7 @@ parameters = dict(
     cumu_dom_filter=True,
     rollout_dom_filter=True,
     rollout_cumu_dom_filter=True,
+    feature_cache_size=1 << 14,  # after-state features of the rollouts are cached (0: no cache)
 
     lambda_min=-7.0,  # lambda is the regularization parameter
     lambda_max=6,
@@ -50,6 +53,7 @@ parameters = dict(
     feature_type='bcts',
     standardize_features=False,
     max_cleared_test_lines=1000000,
+    board_backend="bool",  # "bitboard": the agent's decisions and rollouts use packed-row boards (see tetris.bitboard)
 
     # Misc parameters
     verbose=False,
@@ -67,7 +71,7 @@ ncpus = np.minimum(multiprocessing.cpu_count(), 2)
 def run_loop(p, seed):
     """
     This function contains a complete learning and evaluation run for ONE agent.
-    This function is passed multiprocessing.Pool.apply_async() and thus run multiple times (in parallel).
+    This function is passed to WarmPool.apply_async() and thus run multiple times (in parallel).
 
     :param p: `Bunch` of algorithm parameters.
     :param seed: integer, this seed is agent-specific. p also contains a run-specific random seed.
@@ -75,6 +79,8 @@ def run_loop(p, seed):
     """
     random.seed(seed + p.seed)
     np.random.seed(seed + p.seed)
+    # Pool workers are reused across agents, so compiled code (which has its own np.random state) is reseeded, too.
+    seed_global(seed + p.seed)
     agent = m_learning.MLearning(regularization=p.regularization,
                                  dom_filter=p.dominance_filter,
                                  cumu_dom_filter=p.cumu_dom_filter,
@@ -90,12 +96,20 @@ def run_loop(p, seed):
                                  learn_from_step_in_current_phase=p.learn_from_step,
                                  max_batch_size=p.max_batch_size,
                                  learn_periodicity=p.learn_periodicity,
-                                 num_columns=p.num_columns)
+                                 num_columns=p.num_columns,
+                                 board_backend=p.board_backend,
+                                 feature_cache_size=p.feature_cache_size)
     env = tetris.Tetris(num_columns=p.num_columns, num_rows=p.num_rows)
     test_env = tetris.Tetris(num_columns=p.num_columns, num_rows=p.num_rows, max_cleared_test_lines=p.max_cleared_test_lines)
+    # Tetromino streams of this agent: learning games, test games and rollouts.
+    env.seed(p.seed, 3 * seed)
+    test_env.seed(p.seed, 3 * seed + 1)
+    agent.generative_model.seed(p.seed, 3 * seed + 2)
     test_results_ix, tested_weights_ix = \
         learn_and_evaluate.learn_and_evaluate(env, test_env, agent, p.num_tests,
                                               p.num_games_per_test, p.test_points)
+    if p.feature_cache_size > 0:
+        print("Agent " + str(seed) + ", feature cache hit rate: " + str(agent.feature_cache_hit_rate()))
     return [test_results_ix, tested_weights_ix]
 
 
@@ -104,12 +118,12 @@ time_total_begin = time.time()
 # # Execute line below if num_agents == 1
 # results = [run_loop(p, 2)]
 
-# Run in parallel (only useful if num_agents > 1)
-pool = multiprocessing.Pool(np.minimum(ncpus, p.num_agents))
-results = [pool.apply_async(run_loop, (p, seed)) for seed in np.arange(p.num_agents)]
+# Run in parallel (only useful if num_agents > 1). The engine is compiled once here, before the workers are forked.
+with WarmPool(np.minimum(ncpus, p.num_agents), num_columns=p.num_columns, num_rows=p.num_rows) as pool:
+    results = [pool.apply_async(run_loop, (p, seed)) for seed in np.arange(p.num_agents)]
 
-# PROCESS AND SAVE RESULTS
-test_results = [results[ix].get()[0] for ix in np.arange(p.num_agents)]
+    # PROCESS AND SAVE RESULTS
+    test_results = [results[ix].get()[0] for ix in np.arange(p.num_agents)]
 test_results = np.stack(test_results, axis=0)
 print("Total time passed: " + str(time.time()-time_total_begin) + " seconds.")
 np.save(file=os.path.join(results_path, "test_results.npy"), arr=test_results)
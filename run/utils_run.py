@@ -1,7 +1,7 @@
 import os
 import json
 from tetris.utils import Bunch
-from tetris import state
+from tetris import population
 import numpy as np
 from numba import njit
 import glob
@@ -43,34 +43,20 @@ def process_parameters(param_dict, run_id_path):
 
 
 def load_rollout_state_population(p, max_samples, print_average_height=False):
-    sample_list_save_name = p.rollout_population_path
-    with open(sample_list_save_name, "r") as ins:
-        rollout_population = []
-        count = 0
-        for x in ins:
-            if count < max_samples:
-                # print(count)
-                rep = np.vstack((np.array([np.array([int(z) for z in bin(int(y))[3:13]]) for y in x.split()]),
-                           np.zeros((4, p.num_columns))))
-                rep = rep.astype(np.bool_)
-                lowest_free_rows = calc_lowest_free_rows(rep)
-                rollout_population.append(state.State(rep,
-                                                      lowest_free_rows,
-                                                      np.array([0], dtype=np.int64),  # changed_lines=
-                                                      np.array([0], dtype=np.int64),  # pieces_per_changed_row=
-                                                      0.0,  # landing_height_bonus=
-                                                      8,  # num_features=
-                                                      "bcts",  # feature_type=
-                                                      False  # terminal_state=
-                                                      ))
-                count += 1
-            else:
-                break
-
-    # print(f"Succesfully loaded {count} rollout starting states!")
+    """
+    Returns a memory-mapped tetris.population.RolloutStatePopulation (States are materialized on demand).
+    p.rollout_population_path can be a binary population file or a text file; a text file is converted once to a
+    binary file next to it (same name with the extension ".bin"), which later runs reuse.
+    """
+    path = p.rollout_population_path
+    if not population.is_population_file(path):
+        binary_path = os.path.splitext(path)[0] + ".bin"
+        if not os.path.exists(binary_path) or os.path.getmtime(binary_path) < os.path.getmtime(path):
+            population.convert_text_population(path, binary_path, p.num_columns)
+        path = binary_path
+    rollout_population = population.open_population(path, max_samples=max_samples)
     if print_average_height:
-        average_lowest_free_rows = np.mean([np.mean(d.lowest_free_rows) for d in rollout_population])
-        print("average height in rollout state population", average_lowest_free_rows)
+        print("average height in rollout state population", rollout_population.average_height())
     return rollout_population
 
 
@@ -84,7 +70,7 @@ def clean_up_cmaesout():
             print("Error while deleting file", file_path)
 
 
-@njit(fastmath=True, cache=False)
+@njit(fastmath=True, cache=True)
 def calc_lowest_free_rows(rep):
     num_rows, n_cols = rep.shape
     lowest_free_rows = np.zeros(n_cols, dtype=np.int64)
@@ -98,9 +84,11 @@ def calc_lowest_free_rows(rep):
     return lowest_free_rows
 
 
-def kill_files(folder):
+def kill_files(folder, extensions=None):
     for the_file in os.listdir(folder):
         file_path = os.path.join(folder, the_file)
+        if extensions is not None and os.path.splitext(the_file)[1] not in extensions:
+            continue
         try:
             print(f"Trying to kill {file_path} (for numba).")
             if os.path.isfile(file_path):
@@ -110,6 +98,11 @@ def kill_files(folder):
 
 
 def kill_numba_cache():
+    """
+    Deletes numba's on-disk cache (index and data files in __pycache__; Python's own .pyc files are kept).
+    numba only invalidates a cached kernel if its own source file changes, not if a function it calls in another
+    module does, so call this after changing such a function (or set NUMBA_CACHE_DIR to a fresh directory).
+    """
     root_folder = os.path.realpath(__file__ + "/../../")
     print(f"ROOT FOLDER: {root_folder}")
 
@@ -117,8 +110,7 @@ def kill_numba_cache():
         for dirname in dirnames:
             if dirname == "__pycache__":
                 try:
-                    # print(f"Found __pycache__ to kill (for numba).")
-                    kill_files(root + "/" + dirname)
+                    kill_files(root + "/" + dirname, extensions=(".nbi", ".nbc"))
                 except Exception as e:
                     print("failed on %s", root)
 
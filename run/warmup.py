@@ -0,0 +1,89 @@
+"""
+Compiles the game engine (including tetris.vec_game), the agents (including the parallel and anytime rollouts of
+MLearning), the rollout kernels and the evaluation functions on a tiny workload, e.g., at the start of a run or in the
+parent process before worker processes are forked, so that short jobs do not pay the JIT compile latency. Kernels on
+plain arrays are also stored in numba's on-disk cache (cache=True) and are loaded from it in later runs; everything
+that takes or builds jitclass instances can only be compiled in-process.
+
+    python -m run.warmup
+"""
+
+import time
+import numpy as np
+import tetris
+from tetris import serialization
+from tetris.population import population_from_states
+from tetris.vec_game import VecTetris
+from agents.constant_agent import ConstantAgent
+from agents.m_learning import MLearning
+from agents.rollout_mechanisms import BatchRollout
+from run.learn_and_evaluate import evaluate, evaluate_policies, sample_tetromino_sequences
+
+WARMUP_WEIGHTS = np.array([-13.08, -19.77, -9.22, -10.49, -6.60, -12.63, 24.04, -1.61])
+
+
+def warmup(num_columns=10, num_rows=10, verbose=True):
+    """
+    Returns the seconds spent per stage (mostly compilation).
+    """
+    timings = dict()
+    start = time.perf_counter()
+
+    stage_start = time.perf_counter()
+    env = tetris.Tetris(num_columns, num_rows, 5, 4, "bcts", 8, "uniform", 0)
+    env.seed(0, 0)
+    env.reset()
+    agent = ConstantAgent(WARMUP_WEIGHTS)
+    rollout_states = []
+    for _ in range(20):
+        env.make_step(agent.choose_action(env.current_state, env.generative_model))
+        if env.game_over:
+            env.reset()
+        rollout_states.append(env.current_state)
+    timings["game"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    evaluate(env, agent, 1)
+    evaluate_policies(WARMUP_WEIGHTS[np.newaxis], sample_tetromino_sequences(1, 20, 0), num_rows, num_columns, 5)
+    timings["evaluation"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    vec_env = VecTetris(2, num_columns, num_rows, 5, 8)
+    vec_env.seed(0)
+    vec_env.reset()
+    for _ in range(3):
+        vec_env.step(np.tile(WARMUP_WEIGHTS, (2, 1)))
+    timings["vec_game"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    m_agent = MLearning("warmup", "stew", False, False, False, False, -1.0, 1.0, 2, 0.0, 0.9, 2, 1, 1, 10, 1, False, 1,
+                        num_columns)
+    m_agent.generative_model.seed(0, 1)
+    m_agent.choose_action(env.current_state, env.generative_model)
+    m_agent.choose_action_anytime(env.current_state, env.generative_model, max_rollouts=2)
+    parallel_agent = MLearning("warmup", "stew", False, False, False, False, -1.0, 1.0, 2, 0.0, 0.9, 2, 1, 1, 10, 1,
+                               False, 1, num_columns, parallel_rollouts=True)
+    parallel_agent.generative_model.seed(0, 2)
+    parallel_agent.choose_action(env.current_state, env.generative_model)
+    timings["m_learning"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    batch_rollout = BatchRollout(population_from_states(rollout_states), 2, 1, 2, 8, 13, False,
+                                 m_agent.feature_directors, gamma=0.9)
+    generative_model = env.generative_model.copy_with_same_current_tetromino()
+    batch_rollout.perform_rollouts(WARMUP_WEIGHTS, np.zeros(14), generative_model, True)
+    timings["batch_rollouts"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    serialization.decode_state(serialization.encode_state(env.current_state, env.generative_model.current_tetromino))
+    serialization.decode_tetris(serialization.encode_tetris(env))
+    timings["serialization"] = time.perf_counter() - stage_start
+
+    timings["total"] = time.perf_counter() - start
+    if verbose:
+        print("Warm-up (compile) times: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items()))
+    return timings
+
+
+if __name__ == "__main__":
+    warmup()
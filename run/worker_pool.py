@@ -0,0 +1,54 @@
+"""
+A process pool whose workers do not compile anything themselves.
+
+WarmPool compiles the engine, agent and rollout kernels in the parent (run.warmup.warmup()) and only then forks
+its workers, which inherit the compiled code. The workers stay alive until close(), so one pool can run all agents,
+seeds and test points of a run (or of a sweep over many short configurations). Jobs have to reseed their random
+number generators (including compiled code's, see tetris.rng.seed_global()) because workers are reused.
+
+    with WarmPool(num_workers, num_columns=10, num_rows=10) as pool:
+        results = [pool.apply_async(run_loop, (p, seed)) for seed in range(num_agents)]
+        results = [result.get() for result in results]
+
+Jobs and results are pickled; jitclass instances can be sent as bytes (see tetris.serialization). A WarmPool can also
+be passed to agents.rollout_mechanisms.BatchRollout(pool=...) to shard rollout sets.
+"""
+
+from agents.rollout_mechanisms import use_fork_safe_threading_layer, fork_pool
+from run.warmup import warmup
+
+
+class WarmPool:
+    def __init__(self, num_workers, num_columns=10, num_rows=10, verbose=True):
+        # Has to happen before warmup() runs the first parallel kernel.
+        use_fork_safe_threading_layer()
+        self.compile_times = warmup(num_columns=num_columns, num_rows=num_rows, verbose=verbose)
+        self.num_workers = num_workers
+        self.pool = fork_pool(num_workers)
+
+    def apply_async(self, func, args=(), kwds=None):
+        return self.pool.apply_async(func, args, {} if kwds is None else kwds)
+
+    def map(self, func, iterable, chunksize=None):
+        return self.pool.map(func, iterable, chunksize)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        return self.pool.imap_unordered(func, iterable, chunksize)
+
+    def close(self):
+        # Waits for the submitted jobs to finish.
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
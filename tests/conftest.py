@@ -0,0 +1,39 @@
+import os
+
+# tetris.game reads this at import time.
+os.environ.setdefault("NUMBA_DISABLE_JIT", "0")
+# Rollout worker pools are forked after parallel kernels ran (see agents.rollout_mechanisms).
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+# Parallel kernels are tested with more than one thread, also on single-core machines.
+os.environ.setdefault("NUMBA_NUM_THREADS", "4")
+
+import numpy as np
+import pytest
+
+BCTS_WEIGHTS = np.array([-13.08, -19.77, -9.22, -10.49, -6.60, -12.63, 24.04, -1.61])
+FEATURE_DIRECTORS = np.array([-1, -1, -1, -1, -1, -1, 1, -1], dtype=np.float64)
+
+
+def play_greedy(env, num_steps):
+    # States (and the tetromino to be placed in them) visited by the greedy BCTS policy; restarts finished games.
+    visited = []
+    for _ in range(num_steps):
+        action_features, action_placements = env.generative_model.get_after_state_features(env.current_state)
+        if len(action_features) == 0:
+            env.reset()
+            continue
+        placement = action_placements[np.argmax(action_features.dot(BCTS_WEIGHTS))].copy()
+        env.make_step(env.generative_model.get_after_state(env.current_state, placement))
+        if env.game_over:
+            env.reset()
+        visited.append((env.current_state, env.generative_model.current_tetromino))
+    return visited
+
+
+@pytest.fixture(scope="session")
+def visited_states():
+    import tetris
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    env.seed(1, 0)
+    env.reset()
+    return play_greedy(env, 300)
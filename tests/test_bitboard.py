@@ -0,0 +1,43 @@
+import numpy as np
+import tetris
+from tetris import bitboard
+
+
+def test_bitboard_after_states_match_the_bool_engine(visited_states):
+    generative_model = tetris.tetromino.make_tetromino("bcts", 8, 10, "uniform", 0, 0, 0)
+    num_cleared_lines = 0
+    for current_state, tetromino_index in visited_states[::3]:
+        generative_model.current_tetromino = tetromino_index
+        after_states = generative_model.get_after_states(current_state)
+        bitboard_after_states = generative_model.get_after_states(bitboard.bitboard_state_from_state(current_state))
+        assert len(bitboard_after_states) == len(after_states)
+        for after_state, bitboard_after_state in zip(after_states, bitboard_after_states):
+            assert isinstance(bitboard_after_state, bitboard.BitboardState)
+            np.testing.assert_array_equal(bitboard_after_state.representation, after_state.representation)
+            np.testing.assert_array_equal(bitboard_after_state.lowest_free_rows, after_state.lowest_free_rows)
+            np.testing.assert_array_equal(bitboard_after_state.get_features_pure(True),
+                                          after_state.get_features_pure(True))
+            assert bitboard_after_state.board_hash == after_state.board_hash
+            assert bitboard_after_state.n_cleared_lines == after_state.n_cleared_lines
+            num_cleared_lines += after_state.n_cleared_lines
+
+            # Back to a State: same board and the same features (including the placement's eroded cells).
+            state = bitboard.state_from_bitboard_state(bitboard_after_state)
+            np.testing.assert_array_equal(state.representation, after_state.representation)
+            np.testing.assert_array_equal(state.column_masks, after_state.column_masks)
+            np.testing.assert_array_equal(state.get_features_pure(False), after_state.get_features_pure(False))
+            assert state.board_hash == after_state.board_hash
+            assert state.n_cleared_lines == after_state.n_cleared_lines
+    # Line clears are covered.
+    assert num_cleared_lines > 0
+
+
+def test_bitboard_and_bool_terminal_placements_agree(visited_states):
+    generative_model = tetris.tetromino.make_tetromino("bcts", 8, 10, "uniform", 0, 0, 0)
+    for current_state, tetromino_index in visited_states[::3]:
+        generative_model.current_tetromino = tetromino_index
+        bitboard_state = bitboard.bitboard_state_from_state(current_state)
+        for placement in tetris.placements.get_placements(current_state.lowest_free_rows, tetromino_index):
+            after_state = generative_model.get_after_state(current_state, placement)
+            bitboard_after_state = generative_model.get_after_state(bitboard_state, placement)
+            assert bitboard_after_state.terminal_state == after_state.terminal_state
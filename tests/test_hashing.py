@@ -0,0 +1,71 @@
+import numpy as np
+from tetris import hashing
+from tetris.after_states import AfterStates
+
+
+def test_incremental_board_hash_matches_recomputed_hash(visited_states):
+    for current_state, _ in visited_states:
+        assert current_state.board_hash == hashing.board_hash(current_state.column_masks,
+                                                              current_state.lowest_free_rows)
+
+
+def test_after_state_hashes_match_recomputed_hashes(visited_states):
+    buffer = AfterStates(10, 10, 8, "bcts")
+    disabled_cache = hashing.FeatureCache(0, 8, 4)
+    for current_state, tetromino_index in visited_states[::10]:
+        num_after_states = buffer.fill(current_state, tetromino_index, disabled_cache)
+        for ix in range(num_after_states):
+            assert buffer.board_hashes[ix] == hashing.board_hash(buffer.column_masks[ix], buffer.lowest_free_rows[ix])
+
+
+def test_feature_cache_returns_the_uncached_results(visited_states):
+    uncached, cached = AfterStates(10, 10, 8, "bcts"), AfterStates(10, 10, 8, "bcts")
+    disabled_cache = hashing.FeatureCache(0, 8, 4)
+    cache = hashing.FeatureCache(1 << 16, 8, 4)
+    for repetition in range(2):
+        for current_state, tetromino_index in visited_states:
+            num_after_states = uncached.fill(current_state, tetromino_index, disabled_cache)
+            assert cached.fill(current_state, tetromino_index, cache) == num_after_states
+            np.testing.assert_array_equal(cached.features[:num_after_states], uncached.features[:num_after_states])
+            np.testing.assert_array_equal(cached.placements[:num_after_states],
+                                          uncached.placements[:num_after_states])
+            np.testing.assert_array_equal(cached.board_hashes[:num_after_states],
+                                          uncached.board_hashes[:num_after_states])
+        if repetition == 0:
+            assert cache.misses > 0 and cache.evictions == 0
+            cache.reset_statistics()
+    # The second pass only hits.
+    assert cache.misses == 0 and cache.hits > 0
+
+
+def test_feature_cache_evicts_within_a_set():
+    cache = hashing.FeatureCache(4, 2, 4)  # a single set of four ways
+    features = np.ones(2)
+    for key in range(5):
+        cache.insert(key, features * key, 0, False, key)
+    assert cache.evictions == 1
+    assert cache.lookup(0) == -1
+    slot = cache.lookup(4)
+    assert slot >= 0 and cache.child_hashes[slot] == 4
+    np.testing.assert_array_equal(cache.features[slot], features * 4)
+
+
+def test_rollout_value_cache_hits_until_invalidated():
+    cache = hashing.RolloutValueCache(64, 4)
+    key = hashing.rollout_key(12345, 3)
+    assert cache.lookup(key) == -1
+    cache.add(key, 2, 5.0, 13.0)
+    cache.add(key, 1, 1.0, 1.0)
+    slot = cache.lookup(key)
+    assert slot >= 0
+    assert (cache.counts[slot], cache.sums[slot], cache.sums_of_squares[slot]) == (3, 6.0, 14.0)
+    # Another first piece is another entry.
+    assert cache.lookup(hashing.rollout_key(12345, -1)) == -1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # A new version of the rollout policy makes the entry stale; new rollouts start from scratch.
+    cache.invalidate()
+    assert cache.lookup(key) == -1
+    cache.add(key, 1, 4.0, 16.0)
+    slot = cache.lookup(key)
+    assert (cache.counts[slot], cache.sums[slot]) == (1, 4.0)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import tetris
+from tetris.rng import seed_global
+from agents.constant_agent import ConstantAgent
+from run.learn_and_evaluate import evaluate_policies, sample_tetromino_sequences
+from conftest import BCTS_WEIGHTS, FEATURE_DIRECTORS
+
+
+def play_sequence(env, agent, tetromino_sequence, max_cleared_test_lines):
+    env.reset()
+    current_state = env.current_state
+    cleared_lines = 0
+    for tetromino_index in tetromino_sequence:
+        if cleared_lines > max_cleared_test_lines:
+            break
+        env.generative_model.current_tetromino = tetromino_index
+        current_state = agent.choose_action(current_state, env.generative_model)
+        if current_state.terminal_state:
+            break
+        cleared_lines += current_state.n_cleared_lines
+    return cleared_lines
+
+
+@pytest.mark.parametrize("use_filter_in_eval, use_cumul_dom_filter", [(False, False), (True, False), (True, True)])
+def test_evaluate_policies_plays_like_constant_agent(use_filter_in_eval, use_cumul_dom_filter):
+    tetromino_sequences = sample_tetromino_sequences(4, 300, 3)
+    # Rounded weights make ties (and thus the random tie-breaking) common.
+    weights = np.round(BCTS_WEIGHTS / 10)
+    agent = ConstantAgent(weights, "bcts", FEATURE_DIRECTORS, use_filter_in_eval, not use_cumul_dom_filter,
+                          use_cumul_dom_filter)
+    env = tetris.Tetris(10, 10, 50, 4, "bcts", 8, "uniform", 0)
+    seed_global(5)
+    expected = [play_sequence(env, agent, sequence, 50) for sequence in tetromino_sequences]
+    seed_global(5)
+    rewards = evaluate_policies(weights[np.newaxis], tetromino_sequences, 10, 10, 50, FEATURE_DIRECTORS,
+                                use_filter_in_eval, use_cumul_dom_filter)
+    np.testing.assert_array_equal(rewards[0], expected)
+
+
+def test_tetromino_sequences_are_reproducible_per_seed_and_stream():
+    tetromino_sequences = sample_tetromino_sequences(5, 40, 11, 2)
+    assert tetromino_sequences.dtype == np.int8
+    assert tetromino_sequences.min() >= 0 and tetromino_sequences.max() < 7
+    # The global random state does not matter.
+    seed_global(1)
+    np.random.seed(1)
+    np.testing.assert_array_equal(sample_tetromino_sequences(5, 40, 11, 2), tetromino_sequences)
+    # Sequence ix only depends on (seed, stream, ix): fewer and shorter sequences are prefixes.
+    np.testing.assert_array_equal(sample_tetromino_sequences(3, 20, 11, 2), tetromino_sequences[:3, :20])
+    for other_seed, other_stream in ((12, 2), (11, 3)):
+        assert not np.array_equal(sample_tetromino_sequences(5, 40, other_seed, other_stream), tetromino_sequences)
@@ -0,0 +1,152 @@
+import numpy as np
+import numba
+import pytest
+import tetris
+from agents import m_learning
+from tetris.rng import seed_global
+from conftest import BCTS_WEIGHTS, FEATURE_DIRECTORS
+
+
+def parallel_rollout_values(current_state, env, do_rollout, budget):
+    env.seed(3, 0)
+    children, _, _ = m_learning.expand_children(current_state, env.generative_model, FEATURE_DIRECTORS, 8, False,
+                                                False)
+    return m_learning.roll_out_children_in_parallel(children, do_rollout, 4, "max_util", env.generative_model,
+                                                    BCTS_WEIGHTS, False, False, FEATURE_DIRECTORS, 8, 0.9,
+                                                    np.zeros(8), np.zeros((3, 0), dtype=np.int8), 3, budget)
+
+
+@pytest.mark.parametrize("budget", [1, 7, 20])
+def test_parallel_rollouts_respect_the_budget(visited_states, budget):
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    current_state, tetromino_index = visited_states[60]
+    env.generative_model.current_tetromino = tetromino_index
+    num_children = len(env.generative_model.get_after_states(current_state))
+    do_rollout = np.ones(num_children, dtype=np.bool_)
+    do_rollout[1::3] = False
+    all_values = parallel_rollout_values(current_state, env, do_rollout, 3 * num_children)
+
+    num_rollouts = m_learning.rollouts_per_child(do_rollout, 3, budget)
+    assert np.sum(num_rollouts) == min(budget, 3 * np.sum(do_rollout))
+    assert np.all(num_rollouts[~do_rollout] == 0)
+    # Rounds of one rollout per child: counts differ by at most one, earlier children first.
+    candidate_counts = num_rollouts[do_rollout]
+    assert np.all(np.diff(candidate_counts) <= 0) and candidate_counts[0] - candidate_counts[-1] <= 1
+
+    # The rollouts that are done do not depend on the budget.
+    values = parallel_rollout_values(current_state, env, do_rollout, budget)
+    is_done = np.arange(3) < num_rollouts[:, np.newaxis]
+    np.testing.assert_array_equal(values[is_done], all_values[is_done])
+    assert np.all(values[~is_done] == 0)
+
+
+def test_parallel_rollouts_do_not_share_the_feature_cache(visited_states):
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    current_state, tetromino_index = visited_states[60]
+    env.generative_model.current_tetromino = tetromino_index
+    do_rollout = np.ones(len(env.generative_model.get_after_states(current_state)), dtype=np.bool_)
+    expected = parallel_rollout_values(current_state, env, do_rollout, 3 * len(do_rollout))
+    # FeatureCache is not thread-safe: the threads roll out without the cache of the generative model.
+    env.generative_model.use_feature_cache(1 << 10)
+    values = parallel_rollout_values(current_state, env, do_rollout, 3 * len(do_rollout))
+    np.testing.assert_array_equal(values, expected)
+    assert env.generative_model.feature_cache.hits + env.generative_model.feature_cache.misses == 0
+
+
+def test_feature_cache_is_used_by_serial_rollouts(visited_states):
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    current_state, tetromino_index = visited_states[60]
+    env.generative_model.current_tetromino = tetromino_index
+    choices = []
+    for feature_cache_size in (0, 1 << 12):
+        agent = m_agent(feature_cache_size=feature_cache_size)
+        agent.policy_weights = BCTS_WEIGHTS * FEATURE_DIRECTORS
+        agent.generative_model.seed(5, 0)
+        seed_global(5)
+        choices.append(agent.choose_action(current_state, env.generative_model)[1])
+    assert choices[0] == choices[1]
+    assert agent.feature_cache_hit_rate() > 0
+
+
+def m_agent(**kwargs):
+    return m_learning.MLearning("test", "stew", False, False, False, False, -1.0, 1.0, 2, 0.0, 0.9, 3, 4, 1, 10, 1,
+                                False, 1, 10, **kwargs)
+
+
+def test_rollout_cache_is_reused_across_decisions(visited_states):
+    agent = m_agent(rollout_cache_size=1 << 12)
+    agent.policy_weights = BCTS_WEIGHTS.copy()
+    agent.generative_model.seed(2, 0)
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    current_state, tetromino_index = visited_states[80]
+    env.generative_model.current_tetromino = tetromino_index
+    agent.choose_action(current_state, env.generative_model)
+    assert agent.rollout_cache.hits == 0
+    num_children = agent.rollout_cache.misses
+
+    # The same decision again: every child is found in the cache.
+    agent.choose_action(current_state, env.generative_model)
+    assert agent.rollout_cache.hits == num_children
+
+    # A new rollout policy invalidates the cache.
+    agent.policy_weights = BCTS_WEIGHTS * 2
+    agent.rollout_cache.reset_statistics()
+    agent.choose_action(current_state, env.generative_model)
+    assert agent.rollout_cache.hits == 0
+
+
+def test_rollout_cache_refuses_unkeyed_sampler_state(visited_states):
+    with pytest.raises(ValueError):
+        m_agent(rollout_cache_size=1 << 12, common_random_numbers=True)
+    current_state, tetromino_index = visited_states[80]
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    env.generative_model.current_tetromino = tetromino_index
+    for sampler_type, preview_size in (("7bag", 0), ("history", 0), ("uniform", 2)):
+        agent = m_agent(rollout_cache_size=1 << 12)
+        agent.generative_model = tetris.tetromino.make_tetromino("bcts", 8, 10, sampler_type, preview_size, 2, 0)
+        with pytest.raises(ValueError):
+            agent.choose_action(current_state, env.generative_model)
+
+
+def test_parallel_rollouts_are_reproducible_with_ties(visited_states):
+    # Equal weights make ties in the rollout policy common; they are broken with each rollout's own stream.
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    current_state, tetromino_index = visited_states[60]
+    env.generative_model.current_tetromino = tetromino_index
+    children, _, do_rollout = m_learning.expand_children(current_state, env.generative_model, FEATURE_DIRECTORS, 8,
+                                                         False, False)
+    results = []
+    for num_threads in (4, 4, 1, 3):
+        numba.set_num_threads(num_threads)
+        seed_global(num_threads)
+        env.seed(3, 0)
+        env.generative_model.current_tetromino = tetromino_index
+        results.append(m_learning.roll_out_children_in_parallel(
+            children, do_rollout, 6, "max_util", env.generative_model, np.ones(8), False, False, FEATURE_DIRECTORS,
+            8, 0.9, np.zeros(8), np.zeros((4, 0), dtype=np.int8), 4, 4 * len(children)))
+    numba.set_num_threads(numba.config.NUMBA_NUM_THREADS)
+    assert numba.config.NUMBA_NUM_THREADS > 1
+    for rollout_values in results[1:]:
+        np.testing.assert_array_equal(rollout_values, results[0])
+
+
+@pytest.mark.parametrize("kwargs", [dict(), dict(parallel_rollouts=True)])
+def test_bitboard_backend_chooses_the_same_actions(visited_states, kwargs):
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    choices = {}
+    for board_backend in ("bool", "bitboard"):
+        agent = m_agent(board_backend=board_backend, **kwargs)
+        agent.policy_weights = BCTS_WEIGHTS * FEATURE_DIRECTORS
+        agent.generative_model.seed(5, 0)
+        seed_global(5)
+        choices[board_backend] = []
+        for current_state, tetromino_index in visited_states[100:130:3]:
+            env.generative_model.current_tetromino = tetromino_index
+            child_state, child_index, action_features = agent.choose_action(current_state, env.generative_model)
+            assert isinstance(child_state, tetris.state.State)
+            choices[board_backend].append((child_index, action_features, child_state.get_features_pure(False),
+                                           child_state.n_cleared_lines))
+    for bool_choice, bitboard_choice in zip(choices["bool"], choices["bitboard"]):
+        assert bool_choice[0] == bitboard_choice[0]
+        for bool_value, bitboard_value in zip(bool_choice[1:], bitboard_choice[1:]):
+            np.testing.assert_array_equal(bitboard_value, bool_value)
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+from tetris import hashing, population, state
+from tetris.utils import Bunch
+from run.utils_run import load_rollout_state_population, calc_lowest_free_rows
+
+
+def text_population_line(representation, num_rows, num_columns):
+    # One integer per row, bottom row first; the binary digits after the leading 1 are the cells of columns 0, 1, ...
+    return " ".join(str(int("1" + "".join("1" if cell else "0" for cell in representation[row_ix]), 2))
+                    for row_ix in range(num_rows))
+
+
+def load_text_population(path, num_columns):
+    # The original text loader: one State per line, built from its cells.
+    states = []
+    with open(path, "r") as ins:
+        for line in ins:
+            representation = np.vstack((np.array([[int(z) for z in bin(int(y))[3:3 + num_columns]]
+                                                  for y in line.split()]),
+                                        np.zeros((state.NUM_HIDDEN_ROWS, num_columns)))).astype(np.bool_)
+            lowest_free_rows = calc_lowest_free_rows(representation)
+            column_masks = state.column_masks_from_representation(representation, lowest_free_rows)
+            states.append((representation, lowest_free_rows, hashing.board_hash(column_masks, lowest_free_rows)))
+    return states
+
+
+def test_binary_population_matches_text_population(visited_states, tmp_path):
+    text_path = tmp_path / "population.txt"
+    with open(text_path, "w") as f:
+        for current_state, _ in visited_states[::7]:
+            f.write(text_population_line(current_state.representation, 10, 10) + "\n")
+    expected = load_text_population(text_path, 10)
+
+    p = Bunch(dict(rollout_population_path=str(text_path), num_columns=10))
+    rollout_population = load_rollout_state_population(p, max_samples=None)
+    # Converted once, atomically (no temporary file is left behind).
+    assert sorted(os.listdir(tmp_path)) == ["population.bin", "population.txt"]
+    assert population.is_population_file(tmp_path / "population.bin")
+    assert len(rollout_population) == len(expected)
+    for ix, (representation, lowest_free_rows, board_hash) in enumerate(expected):
+        rollout_state = rollout_population[ix]
+        np.testing.assert_array_equal(rollout_state.representation, representation)
+        np.testing.assert_array_equal(rollout_state.lowest_free_rows, lowest_free_rows)
+        assert rollout_state.board_hash == board_hash
+
+    # The binary file is reused, and can be loaded directly.
+    modified = os.path.getmtime(tmp_path / "population.bin")
+    load_rollout_state_population(p, max_samples=5)
+    assert os.path.getmtime(tmp_path / "population.bin") == modified
+    direct = population.open_population(tmp_path / "population.bin", max_samples=5)
+    assert len(direct) == 5
+    np.testing.assert_array_equal(direct[4].representation, expected[4][0])
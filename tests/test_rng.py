@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from tetris.rng import philox4x32, CounterRNG
+
+# Known-answer vectors of Philox4x32-10 from the Random123 distribution (kat_vectors):
+# counter (c0, c1, c2, c3), key (k0, k1), output.
+PHILOX_KAT = [
+    ((0x00000000, 0x00000000, 0x00000000, 0x00000000), (0x00000000, 0x00000000),
+     (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+    ((0xffffffff, 0xffffffff, 0xffffffff, 0xffffffff), (0xffffffff, 0xffffffff),
+     (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+    ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344), (0xa4093822, 0x299f31d0),
+     (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1)),
+]
+
+
+@pytest.mark.parametrize("counter, key, expected", PHILOX_KAT)
+def test_philox_known_answers(counter, key, expected):
+    assert tuple(philox4x32(*counter, *key)) == expected
+
+
+def draws(rng, size):
+    return np.array([rng.randint(1 << 30) for _ in range(size)])
+
+
+def test_split_does_not_depend_on_draws():
+    rng = CounterRNG(42, 3)
+    before = draws(rng.split(5), 100)
+    draws(rng, 1000)
+    np.testing.assert_array_equal(draws(rng.split(5), 100), before)
+    np.testing.assert_array_equal(draws(CounterRNG(42, 3).split(5), 100), before)
+
+
+def test_split_streams_are_independent():
+    size = 4000
+    rng = CounterRNG(42, 3)
+    streams = [draws(rng.split(stream_ix), size) / (1 << 30) for stream_ix in range(8)]
+    streams.append(draws(rng, size) / (1 << 30))
+    correlations = np.corrcoef(np.array(streams))
+    # |r| of independent uniforms is about 1 / sqrt(size) ~ 0.016.
+    assert np.max(np.abs(correlations - np.eye(len(streams)))) < 0.06
+    for stream in streams:
+        assert abs(np.mean(stream) - 0.5) < 0.02
+
+
+def test_randint_is_uniform():
+    rng = CounterRNG(7, 0)
+    counts = np.bincount([rng.randint(7) for _ in range(7000)], minlength=7)
+    assert len(counts) == 7
+    # Chi-square with 6 degrees of freedom; 22.46 is its 0.999 quantile.
+    assert np.sum((counts - 1000) ** 2 / 1000) < 22.46
+
+
+def test_random_is_in_unit_interval():
+    rng = CounterRNG(7, 1)
+    values = np.array([rng.random() for _ in range(2000)])
+    assert np.all(values >= 0.0) and np.all(values < 1.0)
+    assert abs(np.mean(values) - 0.5) < 0.02
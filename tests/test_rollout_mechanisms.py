@@ -0,0 +1,189 @@
+import numpy as np
+import pytest
+import tetris
+from agents import rollout_mechanisms
+from conftest import BCTS_WEIGHTS, FEATURE_DIRECTORS
+
+
+def test_sample_sequences_are_reproducible():
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    env.seed(11, 0)
+    sequences = env.generative_model.sample_sequences(6, 20)
+    assert sequences.dtype == np.int8 and sequences.shape == (6, 20)
+    assert np.all((sequences >= 0) & (sequences < 7))
+    # Consecutive calls give new sequences, a reseeded generator the same ones.
+    assert not np.array_equal(env.generative_model.sample_sequences(6, 20), sequences)
+    env.seed(11, 0)
+    np.testing.assert_array_equal(env.generative_model.sample_sequences(6, 20), sequences)
+
+
+def test_common_random_numbers_give_every_child_the_same_pieces(visited_states):
+    rollout_length, rollouts_per_action = 6, 4
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    for current_state, tetromino_index in visited_states[10:100:30]:
+        env.seed(5, 0)
+        env.generative_model.current_tetromino = tetromino_index
+        values, _ = rollout_mechanisms.general_action_value_rollout(
+            False, False, current_state, rollout_length, rollouts_per_action, 0.9, env.generative_model,
+            BCTS_WEIGHTS, np.zeros(9), 8, False, False, False, False, FEATURE_DIRECTORS, True, "uniform", 0)
+
+        # Replay: every child is rolled out on the same rollouts_per_action pre-sampled sequences.
+        env.seed(5, 0)
+        env.generative_model.current_tetromino = tetromino_index
+        children = env.generative_model.get_after_states(current_state)
+        piece_sequences = env.generative_model.sample_sequences(rollouts_per_action, rollout_length + 1)
+        buffer = env.generative_model.get_after_states_buffer(current_state.num_rows)
+        expected = np.zeros(len(children))
+        for child_ix, child in enumerate(children):
+            for rollout_ix in range(rollouts_per_action):
+                expected[child_ix] += rollout_mechanisms.action_value_roll_out_once(
+                    child, rollout_length, 0.9, env.generative_model, BCTS_WEIGHTS, np.zeros(9), False, False,
+                    False, False, FEATURE_DIRECTORS, buffer, piece_sequences[rollout_ix])
+        np.testing.assert_allclose(values, expected / rollouts_per_action)
+
+
+def batch_rollout(visited_states, num_workers, **kwargs):
+    return rollout_mechanisms.BatchRollout([state for state, _ in visited_states[::10]], 3, 2, 12, 8, 13, False,
+                                           FEATURE_DIRECTORS, gamma=0.9, num_workers=num_workers, **kwargs)
+
+
+def test_batch_rollout_results_match_per_state_rollouts(visited_states):
+    rollout_handler = batch_rollout(visited_states, 1)
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    env.seed(8, 0)
+    np.random.seed(2)
+    results = rollout_handler.perform_rollouts(BCTS_WEIGHTS, np.zeros(14), env.generative_model, False)
+
+    # Baseline: one (values, features) pair of arrays per rollout state; state ix uses sub-stream ix of the
+    # iteration's generator (a copy of env.generative_model).
+    env.seed(8, 0)
+    iteration_sampler = env.generative_model.copy_with_same_current_tetromino().sampler
+    base_model = rollout_mechanisms.seeded_generative_model((iteration_sampler.sampler_type, 0,
+                                                             iteration_sampler.rng.seed, iteration_sampler.rng.stream,
+                                                             8, 10))
+    values, features = [], []
+    for ix, population_ix in enumerate(rollout_handler.rollout_set):
+        generative_model = base_model.split(ix)
+        generative_model.next_tetromino()
+        state_values, state_features = rollout_mechanisms.general_action_value_rollout(
+            False, False, rollout_handler.rollout_state_population[population_ix], 3, 2, 0.9,
+            generative_model.copy_with_same_current_tetromino(), BCTS_WEIGHTS, np.zeros(14), 8, False, False, False,
+            False, FEATURE_DIRECTORS, False, "uniform", 0)
+        values.append(state_values)
+        features.append(state_features.reshape(len(state_values), 8))
+
+    offsets = results["state_action_offsets"]
+    # Exact-size (unpadded) CSR arrays.
+    assert results["state_action_values"].shape == (offsets[-1],)
+    assert results["state_action_features"].shape == (offsets[-1], 8)
+    np.testing.assert_array_equal(results["num_available_actions"], [len(v) for v in values])
+    np.testing.assert_array_equal(results["did_rollout"], [len(v) > 0 for v in values])
+    np.testing.assert_array_equal(offsets, np.concatenate(([0], np.cumsum([len(v) for v in values]))))
+    for ix in range(len(values)):
+        np.testing.assert_array_equal(results["state_action_values"][offsets[ix]:offsets[ix + 1]], values[ix])
+        np.testing.assert_array_equal(results["state_action_features"][offsets[ix]:offsets[ix + 1]], features[ix])
+
+
+@pytest.mark.parametrize("use_filters_before_rollout", [False, True])
+def test_pooled_batch_rollouts_match_in_process_rollouts(visited_states, use_filters_before_rollout):
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    expected_and_pooled = []
+    for num_workers in (1, 2):
+        rollout_handler = batch_rollout(visited_states, num_workers, use_dom=use_filters_before_rollout,
+                                        use_filters_before_rollout=use_filters_before_rollout)
+        try:
+            # Twice, so the pool reuses its shared population.
+            for seed in (8, 9):
+                env.seed(seed, 0)
+                np.random.seed(seed)
+                expected_and_pooled.append(rollout_handler.perform_rollouts(BCTS_WEIGHTS, np.zeros(14),
+                                                                            env.generative_model, False))
+        finally:
+            rollout_handler.close()
+    for expected, pooled in zip(expected_and_pooled[:2], expected_and_pooled[2:]):
+        assert expected.keys() == pooled.keys()
+        for name in expected:
+            np.testing.assert_array_equal(pooled[name], expected[name])
+
+
+def test_batch_rollout_feature_cache_does_not_change_results(visited_states):
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    results = []
+    for feature_cache_size in (0, 1 << 12):
+        rollout_handler = batch_rollout(visited_states, 1, feature_cache_size=feature_cache_size)
+        env.seed(8, 0)
+        np.random.seed(8)
+        results.append(rollout_handler.perform_rollouts(BCTS_WEIGHTS, np.zeros(14), env.generative_model, False))
+    for name in results[0]:
+        np.testing.assert_array_equal(results[1][name], results[0][name])
+    assert rollout_handler.feature_cache_hit_rate() > 0
+
+
+def replay_rollouts(child, piece_sequences, rollout_length, gamma, chained):
+    # Pure-Python replay of the (CRN) rollouts of one child under the greedy BCTS rollout policy. With chained=True
+    # rollout r + 1 continues from where rollout r ended (the bug fixed in general_action_value_rollout()).
+    generative_model = tetris.tetromino.make_tetromino("bcts", 8, 10, "uniform", 0, 0, 0)
+    values = []
+    state = child
+    for piece_sequence in piece_sequences:
+        if not chained:
+            state = child
+        value = child.n_cleared_lines
+        for count in range(rollout_length):
+            generative_model.current_tetromino = piece_sequence[count]
+            after_states = generative_model.get_after_states(state)
+            if len(after_states) == 0:
+                break
+            utilities = [after_state.get_features_pure(False).dot(BCTS_WEIGHTS) for after_state in after_states]
+            state = after_states[int(np.argmax(utilities))]
+            value += gamma ** count * state.n_cleared_lines
+        values.append(value)
+    return np.mean(values)
+
+
+def test_every_rollout_starts_at_the_child(visited_states):
+    rollout_length, rollouts_per_action = 4, 3
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    differs_from_chained = False
+    for current_state, tetromino_index in visited_states[5:300:25]:
+        env.seed(6, 0)
+        env.generative_model.current_tetromino = tetromino_index
+        values, _ = rollout_mechanisms.general_action_value_rollout(
+            False, False, current_state, rollout_length, rollouts_per_action, 1.0, env.generative_model,
+            BCTS_WEIGHTS, np.zeros(9), 8, False, False, False, False, FEATURE_DIRECTORS, True, "uniform", 0)
+
+        env.seed(6, 0)
+        env.generative_model.current_tetromino = tetromino_index
+        children = env.generative_model.get_after_states(current_state)
+        piece_sequences = env.generative_model.sample_sequences(rollouts_per_action, rollout_length + 1)
+        for child_ix, child in enumerate(children):
+            assert values[child_ix] == pytest.approx(replay_rollouts(child, piece_sequences, rollout_length, 1.0,
+                                                                     False))
+            chained_value = replay_rollouts(child, piece_sequences, rollout_length, 1.0, True)
+            differs_from_chained |= values[child_ix] != pytest.approx(chained_value)
+    # Otherwise the states are too easy to tell the two apart.
+    assert differs_from_chained
+
+
+def test_rollout_budget_caps_the_uniform_allocation(visited_states):
+    rollout_length, rollouts_per_action = 4, 3
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    current_state, tetromino_index = visited_states[40]
+    env.generative_model.current_tetromino = tetromino_index
+    num_children = len(env.generative_model.get_after_states(current_state))
+
+    def action_values(rollouts, budget):
+        env.seed(6, 0)
+        env.generative_model.current_tetromino = tetromino_index
+        values, _ = rollout_mechanisms.general_action_value_rollout(
+            False, False, current_state, rollout_length, rollouts, 0.9, env.generative_model, BCTS_WEIGHTS,
+            np.zeros(9), 8, False, False, False, False, FEATURE_DIRECTORS, True, "uniform", budget)
+        return values
+
+    # A budget above the uniform one changes nothing; a budget of one round gives every child one rollout (on the
+    # first CRN sequence).
+    np.testing.assert_allclose(action_values(rollouts_per_action, 1000), action_values(rollouts_per_action, 0))
+    np.testing.assert_array_equal(action_values(rollouts_per_action, num_children), action_values(1, 0))
+    # Smaller budgets still give every child one rollout (no -inf values reach the policy fit).
+    np.testing.assert_array_equal(action_values(rollouts_per_action, num_children - 2), action_values(1, 0))
+    np.testing.assert_array_equal(action_values(rollouts_per_action, 1), action_values(1, 0))
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from numba import njit
+from tetris import samplers
+from tetris.rng import seed_global
+from tetris.tetromino import make_tetromino
+
+
+def pieces(sampler, num_pieces):
+    return np.array([sampler.current()] + [sampler.next() for _ in range(num_pieces - 1)])
+
+
+@njit
+def global_random():
+    return np.random.random()
+
+
+def test_uniform_sampler_is_uniform():
+    counts = np.bincount(pieces(samplers.make_sampler("uniform", 0, 1, 0), 7000), minlength=7)
+    # Chi-square with 6 degrees of freedom; 22.46 is its 0.999 quantile.
+    assert np.sum((counts - 1000) ** 2 / 1000) < 22.46
+
+
+def test_7bag_sampler_deals_complete_bags():
+    sequence = pieces(samplers.make_sampler("7bag", 0, 1, 0), 7 * 200)
+    bags = np.sort(sequence.reshape(200, 7), axis=1)
+    assert np.all(bags == np.arange(7))
+    # The bags are shuffled.
+    assert len({tuple(bag) for bag in sequence.reshape(200, 7)}) > 150
+
+
+def test_history_sampler_avoids_recent_pieces():
+    sequence = pieces(samplers.make_sampler("history", 0, 1, 0), 7000)
+    assert set(np.unique(sequence)) == set(range(7))
+    # A uniform sampler repeats the previous piece with probability 1/7.
+    assert np.mean(sequence[1:] == sequence[:-1]) < 0.05
+
+
+@pytest.mark.parametrize("sampler_type", samplers.SAMPLER_TYPES)
+def test_preview_shows_the_next_pieces(sampler_type):
+    sampler = samplers.make_sampler(sampler_type, 3, 5, 0)
+    for _ in range(50):
+        preview = sampler.preview()
+        np.testing.assert_array_equal([sampler.next() for _ in range(3)], preview)
+
+
+@pytest.mark.parametrize("sampler_type", samplers.SAMPLER_TYPES)
+def test_reseeding_reproduces_the_sequence(sampler_type):
+    sampler = samplers.make_sampler(sampler_type, 2, 5, 1)
+    first = pieces(sampler, 30)
+    sampler.seed(5, 1)
+    np.testing.assert_array_equal(pieces(sampler, 30), first)
+
+
+@pytest.mark.parametrize("sampler_type", samplers.SAMPLER_TYPES)
+def test_clone_into_equals_split(sampler_type):
+    generative_model = make_tetromino("bcts", 8, 10, sampler_type, 2, 9, 0)
+    for _ in range(5):
+        generative_model.next_tetromino()
+    reused = generative_model.split(0)
+    for stream_ix in (3, 11, 3):
+        split = generative_model.split(stream_ix)
+        pieces(reused.sampler, 17)  # state left over from the previous stream
+        generative_model.clone_into(reused, stream_ix)
+        assert reused.current_tetromino == split.current_tetromino == generative_model.current_tetromino
+        np.testing.assert_array_equal(pieces(reused.sampler, 20), pieces(split.sampler, 20))
+
+
+def test_make_tetromino_does_not_use_the_global_generator():
+    seed_global(4)
+    expected = global_random()
+    seed_global(4)
+    make_tetromino("bcts", 8, 10, "7bag", 1, 2, 0)
+    assert global_random() == expected
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+from numba import njit
+import tetris
+from tetris import placements, serialization, state
+from tetris.rng import seed_global
+from agents.constant_agent import ConstantAgent, encode_constant_agent, decode_constant_agent
+from conftest import BCTS_WEIGHTS, FEATURE_DIRECTORS, play_greedy
+
+
+def terminal_after_state():
+    # Stacks pieces in the leftmost placement until one ends the game; it sticks out into the hidden rows.
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "uniform", 0)
+    env.seed(4, 0)
+    current_state = env.current_state
+    while not current_state.terminal_state:
+        placement = placements.get_placements(current_state.lowest_free_rows, env.generative_model.current_tetromino)[0]
+        current_state = env.generative_model.get_after_state(current_state, placement)
+        env.generative_model.next_tetromino()
+    return current_state
+
+
+def test_state_round_trip_includes_hidden_rows():
+    terminal_state = terminal_after_state()
+    assert terminal_state.representation[terminal_state.num_rows:].any()
+    data = serialization.encode_state(terminal_state, 3)
+    assert len(data) == serialization.encoded_state_size(terminal_state.num_rows, terminal_state.num_columns,
+                                                         len(terminal_state.pieces_per_changed_row))
+    decoded_state, piece = serialization.decode_state(data)
+    assert piece == 3
+    assert decoded_state.representation.shape == (terminal_state.num_rows + state.NUM_HIDDEN_ROWS,
+                                                  terminal_state.num_columns)
+    np.testing.assert_array_equal(decoded_state.representation, terminal_state.representation)
+    np.testing.assert_array_equal(decoded_state.lowest_free_rows, terminal_state.lowest_free_rows)
+    assert decoded_state.terminal_state
+    assert decoded_state.board_hash == terminal_state.board_hash
+
+
+def assert_same_generative_model(decoded, generative_model):
+    assert decoded.current_tetromino == generative_model.current_tetromino
+    assert decoded.num_copies == generative_model.num_copies
+    assert decoded.num_features == generative_model.num_features and decoded.num_columns == generative_model.num_columns
+    decoded_sampler, sampler = decoded.sampler, generative_model.sampler
+    assert decoded_sampler.sampler_type == sampler.sampler_type and decoded_sampler.preview_size == sampler.preview_size
+    assert decoded_sampler.head == sampler.head and decoded_sampler.bag_position == sampler.bag_position
+    np.testing.assert_array_equal(decoded_sampler.queue, sampler.queue)
+    np.testing.assert_array_equal(decoded_sampler.bag, sampler.bag)
+    np.testing.assert_array_equal(decoded_sampler.history, sampler.history)
+    assert (decoded_sampler.rng.seed, decoded_sampler.rng.stream, decoded_sampler.rng.counter) == \
+        (sampler.rng.seed, sampler.rng.stream, sampler.rng.counter)
+
+
+@pytest.mark.parametrize("sampler_type, preview_size", [("uniform", 0), ("7bag", 2), ("history", 1)])
+def test_tetromino_round_trip_continues_the_same_pieces(sampler_type, preview_size):
+    generative_model = tetris.tetromino.make_tetromino("bcts", 8, 10, sampler_type, preview_size, 6, 2)
+    for _ in range(10):
+        generative_model.next_tetromino()
+    generative_model.sample_sequences(3, 5)
+    decoded = serialization.decode_tetromino(serialization.encode_tetromino(generative_model))
+    assert_same_generative_model(decoded, generative_model)
+    assert not decoded.feature_cache.enabled
+
+    # Same pieces, previews and copies afterwards.
+    np.testing.assert_array_equal(decoded.sample_sequences(2, 8), generative_model.sample_sequences(2, 8))
+    decoded_copy, copy = decoded.copy_with_same_current_tetromino(), generative_model.copy_with_same_current_tetromino()
+    for _ in range(30):
+        decoded.next_tetromino()
+        generative_model.next_tetromino()
+        decoded_copy.next_tetromino()
+        copy.next_tetromino()
+        assert decoded.current_tetromino == generative_model.current_tetromino
+        assert decoded_copy.current_tetromino == copy.current_tetromino
+        np.testing.assert_array_equal(decoded.preview(), generative_model.preview())
+
+
+@njit(cache=False)
+def global_draw():
+    return np.random.randint(0, 2 ** 62)
+
+
+def test_tetris_round_trip_continues_the_same_game():
+    env = tetris.Tetris(10, 10, 5, 4, "bcts", 8, "7bag", 1)
+    env.seed(3, 1)
+    env.reset()
+    play_greedy(env, 40)
+    data = serialization.encode_tetris(env)
+
+    # Decoding does not draw from (advance) the caller's random stream.
+    seed_global(7)
+    expected_draw = global_draw()
+    seed_global(7)
+    decoded = serialization.decode_tetris(data)
+    assert global_draw() == expected_draw
+
+    assert (decoded.num_rows, decoded.num_columns) == (env.num_rows, env.num_columns)
+    assert decoded.cleared_lines == env.cleared_lines and decoded.game_over == env.game_over
+    assert decoded.max_cleared_test_lines == env.max_cleared_test_lines
+    assert decoded.tetromino_size == env.tetromino_size
+    assert_same_generative_model(decoded.generative_model, env.generative_model)
+    np.testing.assert_array_equal(decoded.current_state.representation, env.current_state.representation)
+    np.testing.assert_array_equal(decoded.current_state.get_features_pure(False), env.current_state.get_features_pure(False))
+    assert decoded.current_state.board_hash == env.current_state.board_hash
+
+    # Both continue with the same pieces and moves.
+    continued, decoded_continued = play_greedy(env, 60), play_greedy(decoded, 60)
+    assert decoded.cleared_lines == env.cleared_lines
+    for (current_state, piece), (decoded_state, decoded_piece) in zip(continued, decoded_continued):
+        assert decoded_piece == piece
+        np.testing.assert_array_equal(decoded_state.representation, current_state.representation)
+
+
+@pytest.mark.parametrize("use_dom_filter, use_cumul_dom_filter", [(False, False), (True, False), (False, True)])
+def test_constant_agent_round_trip(use_dom_filter, use_cumul_dom_filter):
+    use_filter_in_eval = use_dom_filter or use_cumul_dom_filter
+    agent = ConstantAgent(BCTS_WEIGHTS / 3, "bcts", FEATURE_DIRECTORS.copy(), use_filter_in_eval, use_dom_filter,
+                          use_cumul_dom_filter)
+    decoded = decode_constant_agent(encode_constant_agent(agent))
+    np.testing.assert_array_equal(decoded.policy_weights, agent.policy_weights)
+    np.testing.assert_array_equal(decoded.feature_directors, agent.feature_directors)
+    assert decoded.num_features == agent.num_features
+    assert (decoded.use_filter_in_eval, decoded.use_dom_filter, decoded.use_cumul_dom_filter) == \
+        (use_filter_in_eval, use_dom_filter, use_cumul_dom_filter)
@@ -0,0 +1,188 @@
+"""
+Struct-of-arrays container for the after-states of one board and tetromino.
+
+All children are written into fixed-capacity arrays (capacity = maximum number of placements on the board width,
+i.e., 34 for 10 columns) that are allocated once and reused by every call to fill(). Only the first
+`num_after_states` entries are valid. Terminal placements are dropped.
+"""
+
+import numpy as np
+import numba
+from numba import float64, bool_, int64
+from numba.experimental import jitclass
+from tetris import state, placements, features, hashing
+
+specAfterStates = [
+    ('num_rows', int64),
+    ('num_columns', int64),
+    ('num_features', int64),
+    ('feature_type', numba.types.string),
+    ('capacity', int64),
+    ('num_after_states', int64),
+    ('representations', bool_[:, :, :]),
+    ('lowest_free_rows', int64[:, :]),
+    ('column_masks', int64[:, :]),
+    ('board_hashes', int64[:]),
+    ('n_cleared_lines', int64[:]),
+    ('features', float64[:, :]),
+    ('placements', int64[:, :]),
+    ('landing_height_bonus', float64[:]),
+    # Scratch space
+    ('candidate_placements', int64[:, :]),
+    ('board', bool_[:, :]),
+    ('board_lowest_free_rows', int64[:]),
+    ('board_column_masks', int64[:]),
+    ('cleared_board', bool_[:, :]),
+    ('cleared_lowest_free_rows', int64[:]),
+    ('cleared_column_masks', int64[:]),
+    ('parent_contributions', features.BctsContributions.class_type.instance_type)
+]
+
+
+@jitclass(specAfterStates)
+class AfterStates:
+    def __init__(self, num_rows, num_columns, num_features, feature_type="bcts"):
+        self.num_rows = num_rows
+        self.num_columns = num_columns
+        self.num_features = num_features
+        self.feature_type = feature_type
+        self.capacity = placements.max_num_placements(num_columns)
+        self.num_after_states = 0
+        self.representations = np.zeros((self.capacity, num_rows + state.NUM_HIDDEN_ROWS, num_columns), dtype=np.bool_)
+        self.lowest_free_rows = np.zeros((self.capacity, num_columns), dtype=np.int64)
+        self.column_masks = np.zeros((self.capacity, num_columns), dtype=np.int64)
+        self.board_hashes = np.zeros(self.capacity, dtype=np.int64)
+        self.n_cleared_lines = np.zeros(self.capacity, dtype=np.int64)
+        self.features = np.zeros((self.capacity, num_features), dtype=np.float64)
+        self.placements = np.zeros((self.capacity, 3), dtype=np.int64)
+        self.landing_height_bonus = np.zeros(self.capacity, dtype=np.float64)
+        self.candidate_placements = np.zeros((self.capacity, 3), dtype=np.int64)
+        self.board = np.zeros((num_rows + state.NUM_HIDDEN_ROWS, num_columns), dtype=np.bool_)
+        self.board_lowest_free_rows = np.zeros(num_columns, dtype=np.int64)
+        self.board_column_masks = np.zeros(num_columns, dtype=np.int64)
+        self.cleared_board = np.zeros((num_rows + state.NUM_HIDDEN_ROWS, num_columns), dtype=np.bool_)
+        self.cleared_lowest_free_rows = np.zeros(num_columns, dtype=np.int64)
+        self.cleared_column_masks = np.zeros(num_columns, dtype=np.int64)
+        self.parent_contributions = features.BctsContributions(self.board, self.board_lowest_free_rows, num_rows)
+
+    def fill(self, current_state, tetromino_index, feature_cache):
+        # Overwrites the buffer with the non-terminal after-states of current_state and returns their number.
+        # Results found in the hashing.FeatureCache are reused (terminal placements are then skipped without
+        # stamping); new results are inserted.
+        if current_state.num_rows != self.num_rows or current_state.num_columns != self.num_columns:
+            raise ValueError("Board size does not match the AfterStates buffer.")
+        return self.fill_from_arrays(current_state.representation, current_state.lowest_free_rows,
+                                     current_state.column_masks, current_state.board_hash,
+                                     tetromino_index, feature_cache)
+
+    def fill_from_arrays(self, representation, lowest_free_rows_parent, column_masks_parent, board_hash,
+                         tetromino_index, feature_cache):
+        # Same as fill() for a board given by its arrays (e.g., one game of a vec_game.VecTetris).
+        if tetromino_index < 0 or tetromino_index >= len(placements.PIECE_NUM_ROTATIONS):
+            raise ValueError("wrong current tetromino!")
+
+        num_rows = self.num_rows
+        board = self.board
+        lowest_free_rows = self.board_lowest_free_rows
+        cleared_board = self.cleared_board
+        cleared_lowest_free_rows = self.cleared_lowest_free_rows
+        column_masks = self.board_column_masks
+        cleared_column_masks = self.cleared_column_masks
+        board[:] = representation
+        lowest_free_rows[:] = lowest_free_rows_parent
+        column_masks[:] = column_masks_parent
+        # Placements without line clears are evaluated incrementally from the parent's contributions.
+        self.parent_contributions.update(board, lowest_free_rows)
+        num_placements = placements.fill_placements(lowest_free_rows_parent, tetromino_index,
+                                                    self.candidate_placements)
+        num_legal = 0
+        for ix in range(num_placements):
+            col_ix, rot, anchor_row = self.candidate_placements[ix]
+            pre_clear_hash = board_hash ^ hashing.piece_hash(tetromino_index, rot, col_ix, anchor_row)
+            cache_key = pre_clear_hash ^ hashing.PLACEMENT_KEYS[tetromino_index, rot, col_ix]
+            slot = -1
+            if feature_cache.enabled:
+                slot = feature_cache.lookup(cache_key)
+                if slot >= 0 and feature_cache.terminal[slot]:
+                    continue
+
+            placements.stamp_piece(board, lowest_free_rows, column_masks, tetromino_index, rot, col_ix, anchor_row)
+            num_changed_lines = placements.PIECE_NUM_CHANGED_LINES[tetromino_index, rot]
+            landing_height = anchor_row + placements.PIECE_LANDING_HEIGHT_BONUS[tetromino_index, rot]
+            full_rows = ((1 << num_changed_lines) - 1) << anchor_row
+            for col in range(self.num_columns):
+                full_rows &= column_masks[col]
+            if full_rows != 0:
+                cleared_board[:] = board
+                cleared_lowest_free_rows[:] = lowest_free_rows
+                cleared_column_masks[:] = column_masks
+                is_full = state.clear_lines_in_place(cleared_board, cleared_lowest_free_rows, cleared_column_masks,
+                                                     np.arange(anchor_row, anchor_row + num_changed_lines, 1, np.int64))
+                is_terminal = state.check_terminal(cleared_board, num_rows)
+                if not is_terminal:
+                    n_cleared_lines = 0
+                    eroded_pieces = 0
+                    for line_ix in range(num_changed_lines):
+                        if is_full[line_ix]:
+                            n_cleared_lines += 1
+                            eroded_pieces += placements.PIECE_PIECES_PER_CHANGED_ROW[tetromino_index, rot, line_ix]
+                    if slot >= 0:
+                        self.features[num_legal] = feature_cache.features[slot]
+                        self.board_hashes[num_legal] = feature_cache.child_hashes[slot]
+                    else:
+                        self.features[num_legal] = state.bcts_features(cleared_board, cleared_lowest_free_rows, num_rows,
+                                                                       landing_height, eroded_pieces * n_cleared_lines)
+                        self.board_hashes[num_legal] = hashing.board_hash(cleared_column_masks, cleared_lowest_free_rows)
+                    self.representations[num_legal] = cleared_board
+                    self.lowest_free_rows[num_legal] = cleared_lowest_free_rows
+                    self.column_masks[num_legal] = cleared_column_masks
+                    self.n_cleared_lines[num_legal] = n_cleared_lines
+            else:
+                height = placements.PIECE_HEIGHTS[tetromino_index, rot]
+                is_terminal = anchor_row + height > num_rows
+                if not is_terminal:
+                    if slot >= 0:
+                        self.features[num_legal] = feature_cache.features[slot]
+                    else:
+                        self.features[num_legal] = self.parent_contributions.after_placement_features(
+                            board, lowest_free_rows, col_ix, placements.PIECE_WIDTHS[tetromino_index, rot],
+                            anchor_row, height, landing_height)
+                    self.board_hashes[num_legal] = pre_clear_hash
+                    self.representations[num_legal] = board
+                    self.lowest_free_rows[num_legal] = lowest_free_rows
+                    self.column_masks[num_legal] = column_masks
+                    self.n_cleared_lines[num_legal] = 0
+            if feature_cache.enabled and slot < 0:
+                if is_terminal:
+                    feature_cache.insert(cache_key, self.features[num_legal], 0, True, 0)
+                else:
+                    feature_cache.insert(cache_key, self.features[num_legal], self.n_cleared_lines[num_legal],
+                                         False, self.board_hashes[num_legal])
+            if not is_terminal:
+                self.placements[num_legal, 0] = col_ix
+                self.placements[num_legal, 1] = rot
+                self.placements[num_legal, 2] = anchor_row
+                self.landing_height_bonus[num_legal] = placements.PIECE_LANDING_HEIGHT_BONUS[tetromino_index, rot]
+                num_legal += 1
+            placements.unstamp_piece(board, column_masks, tetromino_index, rot, col_ix, anchor_row)
+            lowest_free_rows[:] = lowest_free_rows_parent
+        self.num_after_states = num_legal
+        return num_legal
+
+    def get_state(self, ix):
+        # Materializes after-state `ix` as a State (copying its arrays out of the buffer).
+        # The board is already cleared and the features are known, so they are set directly.
+        new_state = state.State(self.representations[ix].copy(),
+                                self.lowest_free_rows[ix].copy(),
+                                self.column_masks[ix].copy(),
+                                self.board_hashes[ix],
+                                np.array([self.placements[ix, 2]], dtype=np.int64),
+                                np.zeros(1, dtype=np.int64),
+                                self.landing_height_bonus[ix],
+                                self.num_features,
+                                self.feature_type,
+                                False)
+        new_state.n_cleared_lines = self.n_cleared_lines[ix]
+        new_state.features = self.features[ix].copy()
+        new_state.features_are_calculated = True
+        return new_state
@@ -0,0 +1,401 @@
+"""
+Packed row bitmasks of Tetris boards, and a bitboard backend for Tetris states.
+
+Each row of a board is stored as a uint16 bitmask (bit `col_ix` is set if the cell in column `col_ix` is full), so
+copying a board is a single small-array memcpy and line clears / piece stamping are done with shifts and masks.
+Boards carry NUM_HIDDEN_ROWS rows on top of the `num_rows` visible rows, like tetris.state.State.
+
+BitboardState mirrors the interface of tetris.state.State (lowest_free_rows, board_hash, n_cleared_lines,
+terminal_state, get_features_pure(), ...) and computes the same BCTS features and hashes.
+Tetromino.get_after_states() returns BitboardStates for a BitboardState; agents.m_learning.MLearning selects the
+backend with board_backend="bitboard". The row helpers are also used by the binary rollout state populations
+(tetris.population) and the byte encodings (tetris.serialization).
+"""
+
+import numpy as np
+import numba
+from numba import njit, float64, bool_, int64, uint16
+from numba.experimental import jitclass
+from tetris.state import State, NUM_HIDDEN_ROWS
+from tetris.hashing import ZOBRIST_KEYS, piece_hash
+from tetris.placements import (get_placements, PIECE_HEIGHTS, PIECE_ROW_MASKS, PIECE_TOPS, PIECE_WIDTHS,
+                               PIECE_NUM_CHANGED_LINES, PIECE_PIECES_PER_CHANGED_ROW, PIECE_LANDING_HEIGHT_BONUS)
+
+MAX_NUM_COLUMNS = 16  # Rows are stored as uint16
+BOARD_BACKENDS = ("bool", "bitboard")
+
+spec = [
+    ('rows', uint16[:]),
+    ('lowest_free_rows', int64[:]),
+    ('board_hash', int64),
+    ('pieces_per_changed_row', int64[:]),
+    ('landing_height_bonus', float64),
+    ('num_features', int64),
+    ('feature_type', numba.types.string),
+    ('num_rows', int64),
+    ('num_columns', int64),
+    ('n_cleared_lines', int64),
+    ('anchor_row', int64),
+    ('cleared_rows_relative_to_anchor', bool_[:]),
+    ('features_are_calculated', bool_),
+    ('features', float64[:]),
+    ('terminal_state', bool_)
+]
+
+
+@jitclass(spec)
+class BitboardState(object):
+    def __init__(self,
+                 rows,  # uint16 array of length num_rows + NUM_HIDDEN_ROWS
+                 lowest_free_rows,
+                 board_hash,  # Zobrist hash of `rows` (as passed, i.e., before clearing lines)
+                 changed_lines,
+                 pieces_per_changed_row,
+                 landing_height_bonus,
+                 num_features,
+                 feature_type,
+                 terminal_state):
+        self.terminal_state = terminal_state
+
+        if not terminal_state:
+            self.rows = rows
+            self.lowest_free_rows = lowest_free_rows
+            self.board_hash = board_hash
+            self.num_rows = len(rows) - NUM_HIDDEN_ROWS
+            self.num_columns = len(lowest_free_rows)
+            self.pieces_per_changed_row = pieces_per_changed_row
+            self.landing_height_bonus = landing_height_bonus
+            self.num_features = num_features
+            self.feature_type = feature_type
+            self.n_cleared_lines = 0  # Gets updated in self.clear_lines()
+            self.anchor_row = changed_lines[0]
+            self.cleared_rows_relative_to_anchor = self.clear_lines(changed_lines)
+            if self.n_cleared_lines > 0:
+                self.board_hash = rows_board_hash(self.rows, self.lowest_free_rows)
+            self.features_are_calculated = False
+            self.features = np.zeros(self.num_features, dtype=np.float64)
+            self.terminal_state = check_terminal_rows(self.rows, self.num_rows)
+
+    @property
+    def representation(self):
+        return representation_from_rows(self.rows, self.num_rows, self.num_columns)
+
+    def get_features_and_direct(self, direct_by, addRBF=False):
+        if not self.features_are_calculated:
+            if self.feature_type == "bcts":
+                self.calc_bcts_features()
+                self.features_are_calculated = True
+            else:
+                raise ValueError("Feature type must be either bcts or standardized_bcts or simple or super_simple")
+        out = self.features * direct_by
+        if addRBF:
+            out = np.concatenate((
+                out,
+                np.exp(-(np.mean(self.lowest_free_rows) - np.arange(5) * self.num_rows / 4) ** 2 / (2 * (self.num_rows / 5) ** 2))
+                ))
+        return out
+
+    def get_features_pure(self, addRBFandIntercept=False):
+        if not self.features_are_calculated:
+            if self.feature_type == "bcts":
+                self.calc_bcts_features()
+                self.features_are_calculated = True
+            else:
+                raise ValueError("Feature type must be either bcts or standardized_bcts or simple or super_simple")
+        features = self.features
+        if addRBFandIntercept:
+            features = np.concatenate((
+                np.array([1.]),
+                features,
+                np.exp(-(np.mean(self.lowest_free_rows) - np.arange(5) * self.num_rows / 4) ** 2 / (2 * (self.num_rows / 5) ** 2))
+                ))
+        return features
+
+    def clear_lines(self, changed_lines):
+        rows = self.rows
+        full_row = (1 << self.num_columns) - 1
+        num_changed_lines = len(changed_lines)
+        is_full = np.zeros(num_changed_lines, dtype=np.bool_)
+        n_cleared_lines = 0
+        for ix in range(num_changed_lines):
+            if rows[changed_lines[ix]] == full_row:
+                is_full[ix] = True
+                n_cleared_lines += 1
+
+        if n_cleared_lines > 0:
+            # changed_lines is always a contiguous range starting at the anchor row.
+            first_changed_line = changed_lines[0]
+            lowest_cleared_row = -1
+            highest_cleared_row = -1
+            for ix in range(num_changed_lines):
+                if is_full[ix]:
+                    if lowest_cleared_row < 0:
+                        lowest_cleared_row = first_changed_line + ix
+                    highest_cleared_row = first_changed_line + ix
+
+            # Compact rows in place.
+            write_ix = lowest_cleared_row
+            for read_ix in range(lowest_cleared_row, len(rows)):
+                relative_ix = read_ix - first_changed_line
+                if relative_ix < num_changed_lines and is_full[relative_ix]:
+                    continue
+                rows[write_ix] = rows[read_ix]
+                write_ix += 1
+            for row_ix in range(write_ix, len(rows)):
+                rows[row_ix] = 0
+
+            # Columns that reach above the highest cleared row simply drop by n_cleared_lines. All others had
+            # their top cell in the highest cleared row; their new top is searched for all of them at once.
+            lowest_free_rows = self.lowest_free_rows
+            search_mask = 0
+            for col_ix in range(self.num_columns):
+                if lowest_free_rows[col_ix] > highest_cleared_row + 1:
+                    lowest_free_rows[col_ix] -= n_cleared_lines
+                else:
+                    lowest_free_rows[col_ix] = 0
+                    search_mask |= 1 << col_ix
+            row_ix = highest_cleared_row - n_cleared_lines
+            while search_mask and row_ix >= 0:
+                hit_mask = np.int64(rows[row_ix]) & search_mask
+                if hit_mask:
+                    for col_ix in range(self.num_columns):
+                        if (hit_mask >> col_ix) & 1:
+                            lowest_free_rows[col_ix] = row_ix + 1
+                    search_mask &= ~hit_mask
+                row_ix -= 1
+
+        self.n_cleared_lines = n_cleared_lines
+        return is_full
+
+    def calc_bcts_features(self):
+        rows = self.rows
+        num_rows = self.num_rows
+        num_columns = self.num_columns
+        lowest_free_rows = self.lowest_free_rows
+        full_row = (1 << num_columns) - 1
+        right_wall = 1 << num_columns  # Bit right of the last column (used for row transitions).
+        last_column = 1 << (num_columns - 1)
+        row_transition_mask = (1 << (num_columns + 1)) - 1
+
+        max_height = 0
+        height_ends = np.zeros(num_rows + NUM_HIDDEN_ROWS + 1, dtype=np.int64)
+        for col_ix in range(num_columns):
+            height = lowest_free_rows[col_ix]
+            height_ends[height] |= 1 << col_ix
+            if height > max_height:
+                max_height = height
+
+        rows_with_holes = 0
+        # Each column has a transition from its highest full cell (or the floor) to "the top".
+        col_transitions = num_columns
+        holes = 0
+        cumulative_wells = 0
+        # Empty rows above the stack only have transitions at the borders.
+        row_transitions = 2 * (num_rows - max_height)
+        hole_depths = 0
+        covered = full_row & ~height_ends[0]  # Columns whose stack reaches above the current row.
+        cells_below = full_row  # The floor counts as full.
+        columns_with_holes = 0
+        holes_below = np.zeros(num_columns, dtype=np.int64)
+        previous_wells = 0
+        well_streaks = np.zeros(num_columns, dtype=np.int64)
+        for row_ix in range(max_height):
+            cells = np.int64(rows[row_ix])
+
+            # Hole depths: every full cell adds the number of holes below it (in its column).
+            hole_depth_cells = cells & columns_with_holes
+            if hole_depth_cells:
+                for col_ix in range(num_columns):
+                    if (hole_depth_cells >> col_ix) & 1:
+                        hole_depths += holes_below[col_ix]
+
+            hole_mask = ~cells & covered
+            if hole_mask:
+                rows_with_holes += 1
+                for col_ix in range(num_columns):
+                    if (hole_mask >> col_ix) & 1:
+                        holes += 1
+                        holes_below[col_ix] += 1
+                columns_with_holes |= hole_mask
+
+            col_transitions += popcount((cells ^ cells_below) & covered)
+            cells_below = cells
+
+            bordered = ((cells | right_wall) << 1) | 1
+            row_transitions += popcount((bordered ^ (bordered >> 1)) & row_transition_mask)
+
+            wells = ~cells & ((cells << 1) | 1) & ((cells >> 1) | last_column) & full_row
+            if wells:
+                for col_ix in range(num_columns):
+                    if (wells >> col_ix) & 1:
+                        if (previous_wells >> col_ix) & 1:
+                            well_streaks[col_ix] += 1
+                        else:
+                            well_streaks[col_ix] = 1
+                        cumulative_wells += well_streaks[col_ix]
+            previous_wells = wells
+
+            covered &= ~height_ends[row_ix + 1]
+
+        eroded_pieces = 0
+        for ix in range(len(self.cleared_rows_relative_to_anchor)):
+            if self.cleared_rows_relative_to_anchor[ix]:
+                eroded_pieces += self.pieces_per_changed_row[ix]
+        eroded_piece_cells = eroded_pieces * self.n_cleared_lines
+        landing_height = self.anchor_row + self.landing_height_bonus
+        self.features = np.array([rows_with_holes, col_transitions, holes, landing_height,
+                                  cumulative_wells, row_transitions, eroded_piece_cells, hole_depths], dtype=np.float64)
+
+
+@njit(cache=True)
+def popcount(x):
+    count = 0
+    while x:
+        x &= x - 1
+        count += 1
+    return count
+
+
+@njit(cache=True)
+def check_terminal_rows(rows, num_rows):
+    is_terminal = False
+    for row_ix in range(num_rows, len(rows)):
+        if rows[row_ix]:
+            is_terminal = True
+            break
+    return is_terminal
+
+
+@njit(cache=True)
+def rows_board_hash(rows, lowest_free_rows):
+    # Same as hashing.board_hash() of the column masks of `rows`.
+    hash_value = 0
+    for col_ix in range(len(lowest_free_rows)):
+        for row_ix in range(lowest_free_rows[col_ix]):
+            if (np.int64(rows[row_ix]) >> col_ix) & 1:
+                hash_value ^= ZOBRIST_KEYS[row_ix, col_ix]
+    return hash_value
+
+
+@njit(cache=True)
+def column_masks_from_rows(rows, num_columns):
+    column_masks = np.zeros(num_columns, dtype=np.int64)
+    for row_ix in range(len(rows)):
+        row = np.int64(rows[row_ix])
+        for col_ix in range(num_columns):
+            if (row >> col_ix) & 1:
+                column_masks[col_ix] |= 1 << row_ix
+    return column_masks
+
+
+@njit(cache=True)
+def rows_from_representation(representation, num_rows):
+    # All num_rows + NUM_HIDDEN_ROWS rows (terminal states can have full cells in the hidden rows).
+    num_columns = representation.shape[1]
+    assert num_columns <= MAX_NUM_COLUMNS
+    rows = np.zeros(num_rows + NUM_HIDDEN_ROWS, dtype=np.uint16)
+    for row_ix in range(min(num_rows + NUM_HIDDEN_ROWS, representation.shape[0])):
+        row = 0
+        for col_ix in range(num_columns):
+            if representation[row_ix, col_ix]:
+                row |= 1 << col_ix
+        rows[row_ix] = row
+    return rows
+
+
+@njit(cache=True)
+def representation_from_rows(rows, num_rows, num_columns):
+    representation = np.zeros((num_rows + NUM_HIDDEN_ROWS, num_columns), dtype=np.bool_)
+    for row_ix in range(min(len(rows), num_rows + NUM_HIDDEN_ROWS)):
+        row = np.int64(rows[row_ix])
+        for col_ix in range(num_columns):
+            if (row >> col_ix) & 1:
+                representation[row_ix, col_ix] = True
+    return representation
+
+
+@njit(cache=False)
+def bitboard_state_from_state(state):
+    """ Converts a (non-terminal) tetris.state.State into a BitboardState with the same board and features. """
+    bitboard_state = BitboardState(rows_from_representation(state.representation, state.num_rows),
+                                   state.lowest_free_rows.copy(),
+                                   state.board_hash,
+                                   np.array([state.anchor_row], dtype=np.int64),
+                                   np.array([0], dtype=np.int64),
+                                   0.0,
+                                   state.num_features,
+                                   state.feature_type,
+                                   False)
+    copy_placement_fields(state, bitboard_state)
+    return bitboard_state
+
+
+@njit(cache=False)
+def state_from_bitboard_state(bitboard_state):
+    """ Converts a (non-terminal) BitboardState back into a tetris.state.State. """
+    rows = bitboard_state.rows
+    state = State(representation_from_rows(rows, bitboard_state.num_rows, bitboard_state.num_columns),
+                  bitboard_state.lowest_free_rows.copy(),
+                  column_masks_from_rows(rows, bitboard_state.num_columns),
+                  bitboard_state.board_hash,
+                  np.array([bitboard_state.anchor_row], dtype=np.int64),
+                  np.array([0], dtype=np.int64),
+                  0.0,
+                  bitboard_state.num_features,
+                  bitboard_state.feature_type,
+                  False)
+    copy_placement_fields(bitboard_state, state)
+    return state
+
+
+@njit(cache=False)
+def copy_placement_fields(source, target):
+    # The lines cleared by the placement that led to `source` (and its landing height) are not part of the board.
+    target.n_cleared_lines = source.n_cleared_lines
+    target.cleared_rows_relative_to_anchor = source.cleared_rows_relative_to_anchor.copy()
+    target.pieces_per_changed_row = source.pieces_per_changed_row.copy()
+    target.landing_height_bonus = source.landing_height_bonus
+
+
+@njit(cache=False)
+def get_bitboard_after_state(current_state, tetromino_index, placement):
+    """ Bitboard version of Tetromino.get_after_state(). """
+    col_ix, rot, anchor_row = placement
+    new_rows = current_state.rows.copy()
+    new_lowest_free_rows = current_state.lowest_free_rows.copy()
+    stamp_piece_rows(new_rows, new_lowest_free_rows, tetromino_index, rot, col_ix, anchor_row)
+    num_changed_lines = PIECE_NUM_CHANGED_LINES[tetromino_index, rot]
+    return BitboardState(new_rows,
+                         new_lowest_free_rows,
+                         current_state.board_hash ^ piece_hash(tetromino_index, rot, col_ix, anchor_row),
+                         np.arange(anchor_row, anchor_row + num_changed_lines, 1, np.int64),
+                         PIECE_PIECES_PER_CHANGED_ROW[tetromino_index, rot, :num_changed_lines].copy(),
+                         PIECE_LANDING_HEIGHT_BONUS[tetromino_index, rot],
+                         current_state.num_features,
+                         current_state.feature_type,
+                         False)
+
+
+@njit(cache=False)
+def get_bitboard_after_states(current_state, tetromino_index):
+    """
+    Generates all legal after-states of a BitboardState for a given tetromino. Placements (and their order)
+    are the same as in Tetromino.get_after_states().
+    """
+    after_states = []
+    current_placements = get_placements(current_state.lowest_free_rows, tetromino_index)
+    for ix in range(len(current_placements)):
+        new_state = get_bitboard_after_state(current_state, tetromino_index, current_placements[ix])
+        if not new_state.terminal_state:
+            after_states.append(new_state)
+    return after_states
+
+
+@njit(cache=True)
+def stamp_piece_rows(rows, lowest_free_rows, tetromino_index, rot, col_ix, anchor_row):
+    """ Bitboard version of placements.stamp_piece(). """
+    for row_offset in range(PIECE_HEIGHTS[tetromino_index, rot]):
+        row_mask = PIECE_ROW_MASKS[tetromino_index, rot, row_offset] << col_ix
+        rows[anchor_row + row_offset] = np.int64(rows[anchor_row + row_offset]) | row_mask
+    for col_offset in range(PIECE_WIDTHS[tetromino_index, rot]):
+        lowest_free_rows[col_ix + col_offset] = anchor_row + PIECE_TOPS[tetromino_index, rot, col_offset]
@@ -0,0 +1,236 @@
+"""
+Incremental BCTS features.
+
+A placement that does not clear lines only changes the piece's columns and the rows covered by the piece.
+BctsContributions caches the per-column and per-row contributions of a parent board once, so that the features
+of each of its after-states follow from the parent totals plus the delta of the placed piece.
+Placements that clear lines have to fall back to state.bcts_features().
+
+bcts_features_batch() (and its prange version bcts_features_batch_parallel()) evaluate stacks of boards at once.
+"""
+
+import numpy as np
+from numba import njit, prange, int64, bool_
+from numba.experimental import jitclass
+from tetris.state import bcts_features
+
+specContributions = [
+    ('num_rows', int64),
+    ('num_columns', int64),
+    ('lowest_free_rows', int64[:]),
+    ('col_holes', int64[:]),
+    ('col_transitions', int64[:]),
+    ('col_wells', int64[:]),
+    ('row_transitions', int64[:]),
+    ('row_holes', int64[:]),
+    ('well_run_down', int64[:, :]),  # length of the well run ending at (row, col)
+    ('well_run_up', int64[:, :]),    # length of the well run starting at (row, col)
+    ('rows_with_holes', int64),
+    ('holes', int64),
+    ('hole_depths', int64),
+    ('col_transitions_total', int64),
+    ('cumulative_wells', int64),
+    ('row_transitions_total', int64),
+    ('new_hole_rows', bool_[:])
+]
+
+
+@jitclass(specContributions)
+class BctsContributions:
+    def __init__(self, representation, lowest_free_rows, num_rows):
+        self.num_rows = num_rows
+        self.num_columns = representation.shape[1]
+        num_columns = self.num_columns
+        self.lowest_free_rows = np.zeros(num_columns, dtype=np.int64)
+        self.col_holes = np.zeros(num_columns, dtype=np.int64)
+        self.col_transitions = np.zeros(num_columns, dtype=np.int64)
+        self.col_wells = np.zeros(num_columns, dtype=np.int64)
+        self.row_transitions = np.zeros(num_rows, dtype=np.int64)
+        self.row_holes = np.zeros(num_rows, dtype=np.int64)
+        self.well_run_down = np.zeros((num_rows, num_columns), dtype=np.int64)
+        self.well_run_up = np.zeros((num_rows + 1, num_columns), dtype=np.int64)
+        self.new_hole_rows = np.zeros(num_rows, dtype=np.bool_)
+        self.update(representation, lowest_free_rows)
+
+    def update(self, representation, lowest_free_rows):
+        # Recomputes all contributions for a new parent board (of the same size), reusing the arrays.
+        num_rows = self.num_rows
+        num_columns = self.num_columns
+        self.lowest_free_rows[:] = lowest_free_rows
+        self.col_holes[:] = 0
+        self.col_wells[:] = 0
+        self.row_holes[:] = 0
+        self.well_run_down[:] = 0
+        self.well_run_up[:] = 0
+        self.hole_depths = 0
+
+        for col_ix in range(num_columns):
+            lowest_free_row = lowest_free_rows[col_ix]
+            number_of_full_cells_above = 0
+            for row_ix in range(lowest_free_row):
+                number_of_full_cells_above += representation[row_ix, col_ix]
+            cell_below = True
+            transitions = 1  # From the highest full cell (or the floor) to the top.
+            for row_ix in range(lowest_free_row):
+                cell = representation[row_ix, col_ix]
+                if cell:
+                    number_of_full_cells_above -= 1
+                else:
+                    self.col_holes[col_ix] += 1
+                    self.row_holes[row_ix] += 1
+                    self.hole_depths += number_of_full_cells_above
+                if cell != cell_below:
+                    transitions += 1
+                cell_below = cell
+            self.col_transitions[col_ix] = transitions
+
+            for row_ix in range(num_rows):
+                if is_well_cell(representation, row_ix, col_ix, num_columns):
+                    self.well_run_down[row_ix, col_ix] = 1
+                    if row_ix > 0:
+                        self.well_run_down[row_ix, col_ix] += self.well_run_down[row_ix - 1, col_ix]
+                    self.col_wells[col_ix] += self.well_run_down[row_ix, col_ix]
+            for row_ix in range(num_rows - 1, -1, -1):
+                if self.well_run_down[row_ix, col_ix] > 0:
+                    self.well_run_up[row_ix, col_ix] = self.well_run_up[row_ix + 1, col_ix] + 1
+
+        for row_ix in range(num_rows):
+            self.row_transitions[row_ix] = row_transitions_of_row(representation, row_ix, num_columns)
+
+        self.rows_with_holes = 0
+        for row_ix in range(num_rows):
+            if self.row_holes[row_ix] > 0:
+                self.rows_with_holes += 1
+        self.holes = np.sum(self.col_holes)
+        self.col_transitions_total = np.sum(self.col_transitions)
+        self.cumulative_wells = np.sum(self.col_wells)
+        self.row_transitions_total = np.sum(self.row_transitions)
+
+    def after_placement_features(self, representation, lowest_free_rows, col_ix, width, anchor_row, height,
+                                 landing_height):
+        """
+        BCTS features after placing a piece (without line clears) that covers the columns
+        col_ix, ..., col_ix + width - 1 and the rows anchor_row, ..., anchor_row + height - 1.
+        `representation` and `lowest_free_rows` describe the board after the placement.
+        """
+        num_rows = self.num_rows
+        num_columns = self.num_columns
+        rows_with_holes = self.rows_with_holes
+        holes = self.holes
+        hole_depths = self.hole_depths
+        col_transitions = self.col_transitions_total
+
+        # Columns covered by the piece: only the cells between the old and the new column height change.
+        for col in range(col_ix, col_ix + width):
+            old_lowest_free_row = self.lowest_free_rows[col]
+            new_lowest_free_row = lowest_free_rows[col]
+            full_cells_above = 0
+            for row_ix in range(new_lowest_free_row - 1, old_lowest_free_row - 1, -1):
+                if representation[row_ix, col]:
+                    full_cells_above += 1
+                else:
+                    holes += 1
+                    hole_depths += full_cells_above
+                    if self.row_holes[row_ix] == 0 and not self.new_hole_rows[row_ix]:
+                        self.new_hole_rows[row_ix] = True
+                        rows_with_holes += 1
+            # Every old hole in this column is now covered by the new full cells as well.
+            hole_depths += self.col_holes[col] * full_cells_above
+            cell_below = True
+            for row_ix in range(old_lowest_free_row, new_lowest_free_row):
+                cell = representation[row_ix, col]
+                if cell != cell_below:
+                    col_transitions += 1
+                cell_below = cell
+        for col in range(col_ix, col_ix + width):
+            for row_ix in range(self.lowest_free_rows[col], lowest_free_rows[col]):
+                self.new_hole_rows[row_ix] = False
+
+        # Rows covered by the piece.
+        top_row = min(anchor_row + height, num_rows)
+        row_transitions = self.row_transitions_total
+        for row_ix in range(anchor_row, top_row):
+            row_transitions += row_transitions_of_row(representation, row_ix, num_columns) - self.row_transitions[row_ix]
+
+        # Wells can only change in the piece's columns and their direct neighbours, within the piece's rows.
+        cumulative_wells = self.cumulative_wells
+        for col in range(max(col_ix - 1, 0), min(col_ix + width + 1, num_columns)):
+            if anchor_row > 0:
+                run_below = self.well_run_down[anchor_row - 1, col]
+            else:
+                run_below = 0
+            run_above = self.well_run_up[top_row, col]
+            old_run = run_below
+            new_run = run_below
+            for row_ix in range(anchor_row, top_row):
+                old_run = self.well_run_down[row_ix, col]
+                cumulative_wells -= old_run
+                if is_well_cell(representation, row_ix, col, num_columns):
+                    new_run += 1
+                    cumulative_wells += new_run
+                else:
+                    new_run = 0
+            # The run continuing above the piece's rows is extended or cut accordingly.
+            cumulative_wells += run_above * (new_run - old_run)
+
+        return np.array([rows_with_holes, col_transitions, holes, landing_height,
+                         cumulative_wells, row_transitions, 0, hole_depths], dtype=np.float64)
+
+
+@njit(cache=True)
+def is_well_cell(representation, row_ix, col_ix, num_columns):
+    # An empty cell whose left and right neighbours are full (walls count as full).
+    if representation[row_ix, col_ix]:
+        return False
+    if col_ix > 0 and not representation[row_ix, col_ix - 1]:
+        return False
+    if col_ix < num_columns - 1 and not representation[row_ix, col_ix + 1]:
+        return False
+    return True
+
+
+@njit(cache=True)
+def row_transitions_of_row(representation, row_ix, num_columns):
+    # Transitions between empty and full cells along a row (walls count as full).
+    transitions = 0
+    cell_left = True
+    for col_ix in range(num_columns):
+        cell = representation[row_ix, col_ix]
+        if cell != cell_left:
+            transitions += 1
+        cell_left = cell
+    if not cell_left:
+        transitions += 1
+    return transitions
+
+
+def _bcts_features_batch(representations, lowest_free_rows, num_rows, landing_heights, eroded_piece_cells):
+    num_boards = representations.shape[0]
+    out = np.empty((num_boards, 8), dtype=np.float64)
+    for ix in prange(num_boards):
+        out[ix] = bcts_features(representations[ix], lowest_free_rows[ix], num_rows,
+                                landing_heights[ix], eroded_piece_cells[ix])
+    return out
+
+
+# BCTS features of an (N x rows x cols) stack of boards with (N x cols) lowest_free_rows. Only the first
+# `num_rows` rows are evaluated. Landing heights and eroded piece cells (both of length N) describe the placement
+# that led to each board.
+bcts_features_batch = njit(cache=True)(_bcts_features_batch)
+bcts_features_batch_parallel = njit(cache=True, parallel=True)(_bcts_features_batch)
+
+
+def stack_states(states):
+    """
+    Stacks State objects into the arrays expected by bcts_features_batch().
+    Returns (representations, lowest_free_rows, landing_heights, eroded_piece_cells).
+    """
+    num_states = len(states)
+    representations = np.stack([s.representation for s in states])
+    lowest_free_rows = np.stack([s.lowest_free_rows for s in states])
+    landing_heights = np.zeros(num_states, dtype=np.float64)
+    eroded_piece_cells = np.zeros(num_states, dtype=np.float64)
+    for ix, s in enumerate(states):
+        landing_heights[ix] = s.anchor_row + s.landing_height_bonus
+        eroded_piece_cells[ix] = np.sum(s.cleared_rows_relative_to_anchor * s.pieces_per_changed_row) * s.n_cleared_lines
+    return representations, lowest_free_rows, landing_heights, eroded_piece_cells
@@ -42,50 +42,67 @@ class Tetris:
                  max_cleared_test_lines=10e9,
                  tetromino_size=4,
                  feature_type="bcts",
-                 num_features=8
+                 num_features=8,
+                 sampler_type="uniform",
+                 preview_size=0,
+                 seed=-1
                  ):
         """
         :param num_columns: 
         :param num_rows:
         :param tetromino_size:
         :param max_cleared_test_lines:
+        :param sampler_type: "uniform", "7bag" or "history" (see tetris.samplers)
+        :param preview_size: number of known upcoming tetrominos
+        :param seed: tetrominos come from stream 0 of this seed (see seed()); -1: a seed drawn from np.random
         """
         self.num_columns = num_columns
         self.num_rows = num_rows
+        assert num_rows + state.NUM_HIDDEN_ROWS <= state.MAX_NUM_ROWS_TOTAL, "Too many rows."
         self.tetromino_size = tetromino_size
         self.num_features = num_features
         self.feature_type = feature_type
         self.max_cleared_test_lines = max_cleared_test_lines
         self.game_over = False
-        self.current_state = state.State(np.zeros((self.num_rows, self.num_columns), dtype=np.bool_),  # representation=
+        self.current_state = state.State(np.zeros((self.num_rows + state.NUM_HIDDEN_ROWS, self.num_columns), dtype=np.bool_),  # representation=
                                          np.zeros(self.num_columns, dtype=np.int64),  # lowest_free_rows=
+                                         np.zeros(self.num_columns, dtype=np.int64),  # column_masks=
+                                         0,  # board_hash=
                                          np.array([0], dtype=np.int64),  # changed_lines=
                                          np.array([0], dtype=np.int64),  # pieces_per_changed_row=
                                          0.0,  # landing_height_bonus=
                                          self.num_features,  # num_features=
                                          "bcts",  # feature_type=
-                                         False,  # terminal_state=
-                                         False  # has_overlapping_fields=
+                                         False  # terminal_state=
                                          )
-        self.generative_model = tetromino.Tetromino(self.feature_type, self.num_features, self.num_columns)
+        # Random stream until seed() is called (unless a seed is given).
+        if seed < 0:
+            seed = np.random.randint(0, 2 ** 62)
+        self.generative_model = tetromino.make_tetromino(self.feature_type, self.num_features, self.num_columns,
+                                                         sampler_type, preview_size, seed, 0)
         self.cleared_lines = 0
 
     def reset(self):
         self.game_over = False
-        self.current_state = state.State(np.zeros((self.num_rows, self.num_columns), dtype=np.bool_),  # representation=
+        self.current_state = state.State(np.zeros((self.num_rows + state.NUM_HIDDEN_ROWS, self.num_columns), dtype=np.bool_),  # representation=
                                          np.zeros(self.num_columns, dtype=np.int64),  # lowest_free_rows=
+                                         np.zeros(self.num_columns, dtype=np.int64),  # column_masks=
+                                         0,  # board_hash=
                                          np.array([0], dtype=np.int64),  # changed_lines=
                                          np.array([0], dtype=np.int64),  # pieces_per_changed_row=
                                          0.0,  # landing_height_bonus=
                                          self.num_features,  # num_features=
                                          "bcts",  # feature_type=
-                                         False,  # terminal_state=
-                                         False  # has_overlapping_fields=
+                                         False  # terminal_state=
                                          )
         self.current_state.calc_bcts_features()
         self.cleared_lines = 0
         self.generative_model.next_tetromino()
 
+    def seed(self, seed, stream):
+        # Tetrominos of this environment come from stream `stream` of the counter-based generator keyed by `seed`.
+        self.generative_model.seed(seed, stream)
+
     def make_step(self, after_state):
         self.game_over = after_state.terminal_state
         if not self.game_over:
@@ -0,0 +1,262 @@
+"""
+Zobrist hashing of boards and a bounded cache for after-state results.
+
+The hash of a board is the XOR of the keys of its full cells, so placing a piece XORs in the keys of the piece's
+cells. After line clears the rows move, and the hash is recomputed from the column occupancy masks.
+
+FeatureCache maps (pre-clear board hash, placement) to the BCTS features, the number of cleared lines, the terminal
+flag and the hash of the resulting board. It is set-associative with clock (second chance) eviction per set and
+counts hits and misses, so that its capacity can be tuned.
+
+RolloutValueCache maps (board hash of an after-state, first rollout piece) to the count, sum and sum of squares of
+rollout returns from that after-state (not including the lines cleared by the placement that led to it). Entries
+belong to a version of the rollout policy; invalidate() starts a new version, which makes all entries stale at once.
+The key assumes that the later rollout pieces are independent of everything else (a uniform sampler without common
+random numbers).
+"""
+
+import numpy as np
+from numba import njit, float64, bool_, int64
+from numba.experimental import jitclass
+from tetris.placements import PIECE_HEIGHTS, PIECE_ROW_MASKS, PIECE_WIDTHS
+
+MAX_HASHED_ROWS = 64
+MAX_HASHED_COLUMNS = 64
+
+_key_generator = np.random.RandomState(20200113)
+ZOBRIST_KEYS = _key_generator.randint(np.iinfo(np.int64).min, np.iinfo(np.int64).max,
+                                      size=(MAX_HASHED_ROWS, MAX_HASHED_COLUMNS), dtype=np.int64)
+# Distinguishes placements that lead to the same board (landing height and eroded cells differ).
+PLACEMENT_KEYS = _key_generator.randint(np.iinfo(np.int64).min, np.iinfo(np.int64).max,
+                                        size=(len(PIECE_WIDTHS), 4, MAX_HASHED_COLUMNS), dtype=np.int64)
+# Distinguishes rollouts by their first piece (index 0: first piece unknown).
+ROLLOUT_PIECE_KEYS = _key_generator.randint(np.iinfo(np.int64).min, np.iinfo(np.int64).max,
+                                            size=len(PIECE_WIDTHS) + 1, dtype=np.int64)
+
+
+@njit(cache=True)
+def board_hash(column_masks, lowest_free_rows):
+    hash_value = 0
+    for col_ix in range(len(column_masks)):
+        mask = column_masks[col_ix]
+        for row_ix in range(lowest_free_rows[col_ix]):
+            if (mask >> row_ix) & 1:
+                hash_value ^= ZOBRIST_KEYS[row_ix, col_ix]
+    return hash_value
+
+
+@njit(cache=True)
+def piece_hash(tetromino_index, rot, col_ix, anchor_row):
+    # XOR of the keys of the cells covered by a placement.
+    hash_value = 0
+    width = PIECE_WIDTHS[tetromino_index, rot]
+    for row_offset in range(PIECE_HEIGHTS[tetromino_index, rot]):
+        row_mask = PIECE_ROW_MASKS[tetromino_index, rot, row_offset]
+        for col_offset in range(width):
+            if (row_mask >> col_offset) & 1:
+                hash_value ^= ZOBRIST_KEYS[anchor_row + row_offset, col_ix + col_offset]
+    return hash_value
+
+
+specFeatureCache = [
+    ('enabled', bool_),
+    ('num_features', int64),
+    ('num_sets', int64),
+    ('num_ways', int64),
+    ('keys', int64[:]),
+    ('valid', bool_[:]),
+    ('referenced', bool_[:]),
+    ('hands', int64[:]),
+    ('features', float64[:, :]),
+    ('n_cleared_lines', int64[:]),
+    ('terminal', bool_[:]),
+    ('child_hashes', int64[:]),
+    ('hits', int64),
+    ('misses', int64),
+    ('evictions', int64)
+]
+
+
+@jitclass(specFeatureCache)
+class FeatureCache:
+    def __init__(self, capacity, num_features, num_ways=4):
+        # capacity == 0 disables the cache. Otherwise the capacity is rounded up to num_ways times a power of two.
+        self.enabled = capacity > 0
+        self.num_features = num_features
+        self.num_ways = num_ways
+        num_sets = 0
+        if self.enabled:
+            num_sets = 1
+            while num_sets * num_ways < capacity:
+                num_sets *= 2
+        self.num_sets = num_sets
+        num_slots = num_sets * num_ways
+        self.keys = np.zeros(num_slots, dtype=np.int64)
+        self.valid = np.zeros(num_slots, dtype=np.bool_)
+        self.referenced = np.zeros(num_slots, dtype=np.bool_)
+        self.hands = np.zeros(num_sets, dtype=np.int64)
+        self.features = np.zeros((num_slots, num_features), dtype=np.float64)
+        self.n_cleared_lines = np.zeros(num_slots, dtype=np.int64)
+        self.terminal = np.zeros(num_slots, dtype=np.bool_)
+        self.child_hashes = np.zeros(num_slots, dtype=np.int64)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        # Returns the slot holding `key`, or -1.
+        first_slot = (key & (self.num_sets - 1)) * self.num_ways
+        for slot in range(first_slot, first_slot + self.num_ways):
+            if self.valid[slot] and self.keys[slot] == key:
+                self.referenced[slot] = True
+                self.hits += 1
+                return slot
+        self.misses += 1
+        return -1
+
+    def insert(self, key, features, n_cleared_lines, terminal, child_hash):
+        set_ix = key & (self.num_sets - 1)
+        first_slot = set_ix * self.num_ways
+        # Clock: advance the hand over referenced slots (clearing their bit) until an unreferenced one is found.
+        while True:
+            slot = first_slot + self.hands[set_ix]
+            self.hands[set_ix] = (self.hands[set_ix] + 1) % self.num_ways
+            if not self.valid[slot]:
+                break
+            if not self.referenced[slot]:
+                self.evictions += 1
+                break
+            self.referenced[slot] = False
+        self.keys[slot] = key
+        self.valid[slot] = True
+        self.referenced[slot] = False
+        self.n_cleared_lines[slot] = n_cleared_lines
+        self.terminal[slot] = terminal
+        self.child_hashes[slot] = child_hash
+        if not terminal:
+            self.features[slot] = features
+        return slot
+
+    def hit_rate(self):
+        num_lookups = self.hits + self.misses
+        if num_lookups == 0:
+            return 0.0
+        return self.hits / num_lookups
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        self.valid[:] = False
+        self.referenced[:] = False
+        self.reset_statistics()
+
+
+@njit(cache=True)
+def rollout_key(board_hash, first_piece):
+    # first_piece == -1 if the first piece of the rollouts is not known yet (no preview).
+    return board_hash ^ ROLLOUT_PIECE_KEYS[first_piece + 1]
+
+
+specRolloutValueCache = [
+    ('enabled', bool_),
+    ('num_sets', int64),
+    ('num_ways', int64),
+    ('version', int64),
+    ('keys', int64[:]),
+    ('versions', int64[:]),
+    ('referenced', bool_[:]),
+    ('hands', int64[:]),
+    ('counts', int64[:]),
+    ('sums', float64[:]),
+    ('sums_of_squares', float64[:]),
+    ('hits', int64),
+    ('misses', int64),
+    ('evictions', int64)
+]
+
+
+@jitclass(specRolloutValueCache)
+class RolloutValueCache:
+    def __init__(self, capacity, num_ways):
+        # capacity == 0 disables the cache. Otherwise the capacity is rounded up to num_ways times a power of two.
+        self.enabled = capacity > 0
+        self.num_ways = num_ways
+        num_sets = 0
+        if self.enabled:
+            num_sets = 1
+            while num_sets * num_ways < capacity:
+                num_sets *= 2
+        self.num_sets = num_sets
+        num_slots = num_sets * num_ways
+        self.version = 0
+        self.keys = np.zeros(num_slots, dtype=np.int64)
+        self.versions = np.full(num_slots, -1, dtype=np.int64)
+        self.referenced = np.zeros(num_slots, dtype=np.bool_)
+        self.hands = np.zeros(num_sets, dtype=np.int64)
+        self.counts = np.zeros(num_slots, dtype=np.int64)
+        self.sums = np.zeros(num_slots, dtype=np.float64)
+        self.sums_of_squares = np.zeros(num_slots, dtype=np.float64)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def find(self, key):
+        first_slot = (key & (self.num_sets - 1)) * self.num_ways
+        for slot in range(first_slot, first_slot + self.num_ways):
+            if self.versions[slot] == self.version and self.keys[slot] == key:
+                return slot
+        return -1
+
+    def lookup(self, key):
+        # Returns the slot holding `key` for the current policy version, or -1.
+        slot = self.find(key)
+        if slot >= 0:
+            self.referenced[slot] = True
+            self.hits += 1
+        else:
+            self.misses += 1
+        return slot
+
+    def add(self, key, count, value_sum, value_sum_of_squares):
+        # Adds the statistics of `count` new rollouts to the entry of `key` (which is created if necessary).
+        slot = self.find(key)
+        if slot < 0:
+            set_ix = key & (self.num_sets - 1)
+            first_slot = set_ix * self.num_ways
+            # Clock: advance the hand over referenced slots (clearing their bit) until an unreferenced one is found.
+            while True:
+                slot = first_slot + self.hands[set_ix]
+                self.hands[set_ix] = (self.hands[set_ix] + 1) % self.num_ways
+                if self.versions[slot] != self.version:
+                    break
+                if not self.referenced[slot]:
+                    self.evictions += 1
+                    break
+                self.referenced[slot] = False
+            self.keys[slot] = key
+            self.versions[slot] = self.version
+            self.referenced[slot] = False
+            self.counts[slot] = 0
+            self.sums[slot] = 0.0
+            self.sums_of_squares[slot] = 0.0
+        self.counts[slot] += count
+        self.sums[slot] += value_sum
+        self.sums_of_squares[slot] += value_sum_of_squares
+
+    def invalidate(self):
+        # To be called whenever the rollout policy changes.
+        self.version += 1
+
+    def hit_rate(self):
+        num_lookups = self.hits + self.misses
+        if num_lookups == 0:
+            return 0.0
+        return self.hits / num_lookups
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
@@ -0,0 +1,164 @@
+"""
+Table-driven placement generation.
+
+Every tetromino rotation is described by precomputed tables (see build_piece_tables()), so that a single
+compiled loop generates the placements of any piece on any board width. Alternative piece sets only require
+a different PIECE_CELLS list.
+
+A placement is described by the triple (col_ix, rotation, anchor_row), where the anchor is the lowest row and
+leftmost column of the rotation's bounding box.
+"""
+
+import numpy as np
+from numba import njit
+
+# Cells (row offset, column offset) of every tetromino rotation, relative to the anchor (= lowest row, leftmost column).
+# The order of rotations is the order in which Tetromino.get_after_states() generates placements.
+PIECE_CELLS = [
+    # 0: STRAIGHT
+    [[(0, 0), (1, 0), (2, 0), (3, 0)],   # vertical
+     [(0, 0), (0, 1), (0, 2), (0, 3)]],  # horizontal
+    # 1: SQUARE
+    [[(0, 0), (0, 1), (1, 0), (1, 1)]],
+    # 2: SNAKER
+    [[(1, 0), (2, 0), (0, 1), (1, 1)],   # vertical
+     [(0, 0), (0, 1), (1, 1), (1, 2)]],  # horizontal
+    # 3: SNAKEL
+    [[(0, 0), (1, 0), (1, 1), (2, 1)],   # vertical
+     [(0, 1), (0, 2), (1, 0), (1, 1)]],  # horizontal
+    # 4: T
+    [[(1, 0), (0, 1), (1, 1), (2, 1)],   # single cell on left
+     [(0, 0), (1, 0), (2, 0), (1, 1)],   # single cell on right
+     [(0, 0), (0, 1), (0, 2), (1, 1)],   # upside-down T
+     [(1, 0), (1, 1), (1, 2), (0, 1)]],  # T
+    # 5: RCORNER
+    [[(2, 0), (0, 1), (1, 1), (2, 1)],   # top-right corner
+     [(0, 0), (1, 0), (2, 0), (0, 1)],   # bottom-left corner
+     [(0, 0), (0, 1), (0, 2), (1, 2)],   # bottom-right corner
+     [(0, 0), (1, 0), (1, 1), (1, 2)]],  # top-left corner
+    # 6: LCORNER
+    [[(0, 0), (1, 0), (2, 0), (2, 1)],   # top-left corner
+     [(0, 0), (0, 1), (1, 1), (2, 1)],   # bottom-right corner
+     [(0, 0), (1, 0), (0, 1), (0, 2)],   # bottom-left corner
+     [(1, 0), (1, 1), (0, 2), (1, 2)]]   # top-right corner
+]
+
+
+def build_piece_tables(piece_cells):
+    """
+    Precomputes the per-piece, per-rotation tables that drive the placement kernels.
+    Only the cell lists are specified by hand; everything else is derived from them.
+
+    Per piece and rotation:
+        widths, heights         -- bounding box of the rotation
+        bottoms, tops           -- per column offset: lowest full cell / one above the highest full cell
+        row_masks               -- per row offset: bitmask of full cells (bit j = column offset j)
+        column_masks            -- per column offset: bitmask of full cells (bit i = row offset i)
+        num_changed_lines       -- number of rows (from the anchor) that can become full lines
+        pieces_per_changed_row  -- number of piece cells in each of these rows
+        landing_height_bonus    -- added to the anchor row to obtain the BCTS landing height
+    """
+    num_pieces = len(piece_cells)
+    num_rotations = np.zeros(num_pieces, dtype=np.int64)
+    widths = np.zeros((num_pieces, 4), dtype=np.int64)
+    heights = np.zeros((num_pieces, 4), dtype=np.int64)
+    bottoms = np.zeros((num_pieces, 4, 4), dtype=np.int64)
+    tops = np.zeros((num_pieces, 4, 4), dtype=np.int64)
+    row_masks = np.zeros((num_pieces, 4, 4), dtype=np.int64)
+    column_masks = np.zeros((num_pieces, 4, 4), dtype=np.int64)
+    num_changed_lines = np.zeros((num_pieces, 4), dtype=np.int64)
+    pieces_per_changed_row = np.zeros((num_pieces, 4, 4), dtype=np.int64)
+    landing_height_bonus = np.zeros((num_pieces, 4), dtype=np.float64)
+    for piece, rotations in enumerate(piece_cells):
+        num_rotations[piece] = len(rotations)
+        for rot, cells in enumerate(rotations):
+            width = max(c for _, c in cells) + 1
+            height = max(r for r, _ in cells) + 1
+            widths[piece, rot] = width
+            heights[piece, rot] = height
+            for col in range(width):
+                col_rows = [r for r, c in cells if c == col]
+                bottoms[piece, rot, col] = min(col_rows)
+                tops[piece, rot, col] = max(col_rows) + 1
+            for r, c in cells:
+                row_masks[piece, rot, r] |= 1 << c
+                column_masks[piece, rot, c] |= 1 << r
+                pieces_per_changed_row[piece, rot, r] += 1
+            # Only rows below the lowest top of the piece can become full lines.
+            num_changed_lines[piece, rot] = min(tops[piece, rot, :width])
+            landing_height_bonus[piece, rot] = (height - 1) / 2
+    return (num_rotations, widths, heights, bottoms, tops, row_masks, column_masks,
+            num_changed_lines, pieces_per_changed_row, landing_height_bonus)
+
+
+(PIECE_NUM_ROTATIONS, PIECE_WIDTHS, PIECE_HEIGHTS, PIECE_BOTTOMS, PIECE_TOPS, PIECE_ROW_MASKS, PIECE_COLUMN_MASKS,
+ PIECE_NUM_CHANGED_LINES, PIECE_PIECES_PER_CHANGED_ROW, PIECE_LANDING_HEIGHT_BONUS) = build_piece_tables(PIECE_CELLS)
+
+
+@njit(cache=True)
+def max_num_placements(num_columns):
+    """ Upper bound on the number of placements of any piece (34 for the standard pieces and 10 columns). """
+    max_num = 0
+    for tetromino_index in range(len(PIECE_NUM_ROTATIONS)):
+        num = 0
+        for rot in range(PIECE_NUM_ROTATIONS[tetromino_index]):
+            num += max(num_columns - PIECE_WIDTHS[tetromino_index, rot] + 1, 0)
+        max_num = max(max_num, num)
+    return max_num
+
+
+@njit(cache=True)
+def fill_placements(lowest_free_rows, tetromino_index, placements):
+    """
+    Writes all placements (col_ix, rotation, anchor_row) of a tetromino into the rows of `placements`
+    and returns their number. Placements that overlap the top of the board are included.
+    """
+    num_columns = len(lowest_free_rows)
+    num_placements = 0
+    for col_ix in range(num_columns):
+        for rot in range(PIECE_NUM_ROTATIONS[tetromino_index]):
+            width = PIECE_WIDTHS[tetromino_index, rot]
+            if col_ix + width > num_columns:
+                continue
+            anchor_row = lowest_free_rows[col_ix] - PIECE_BOTTOMS[tetromino_index, rot, 0]
+            for offset in range(1, width):
+                anchor_row = max(anchor_row, lowest_free_rows[col_ix + offset] - PIECE_BOTTOMS[tetromino_index, rot, offset])
+            placements[num_placements, 0] = col_ix
+            placements[num_placements, 1] = rot
+            placements[num_placements, 2] = anchor_row
+            num_placements += 1
+    return num_placements
+
+
+@njit(cache=True)
+def get_placements(lowest_free_rows, tetromino_index):
+    placements = np.empty((max_num_placements(len(lowest_free_rows)), 3), dtype=np.int64)
+    num_placements = fill_placements(lowest_free_rows, tetromino_index, placements)
+    return placements[:num_placements]
+
+
+@njit(cache=True)
+def stamp_piece(representation, lowest_free_rows, column_masks, tetromino_index, rot, col_ix, anchor_row):
+    """ Places a tetromino on a boolean board and updates lowest_free_rows and column_masks (all in place). """
+    width = PIECE_WIDTHS[tetromino_index, rot]
+    for row_offset in range(PIECE_HEIGHTS[tetromino_index, rot]):
+        row_mask = PIECE_ROW_MASKS[tetromino_index, rot, row_offset]
+        for col_offset in range(width):
+            if (row_mask >> col_offset) & 1:
+                representation[anchor_row + row_offset, col_ix + col_offset] = 1
+    for col_offset in range(width):
+        lowest_free_rows[col_ix + col_offset] = anchor_row + PIECE_TOPS[tetromino_index, rot, col_offset]
+        column_masks[col_ix + col_offset] |= PIECE_COLUMN_MASKS[tetromino_index, rot, col_offset] << anchor_row
+
+
+@njit(cache=True)
+def unstamp_piece(representation, column_masks, tetromino_index, rot, col_ix, anchor_row):
+    """ Removes a tetromino previously placed by stamp_piece() (lowest_free_rows have to be restored by the caller). """
+    width = PIECE_WIDTHS[tetromino_index, rot]
+    for row_offset in range(PIECE_HEIGHTS[tetromino_index, rot]):
+        row_mask = PIECE_ROW_MASKS[tetromino_index, rot, row_offset]
+        for col_offset in range(width):
+            if (row_mask >> col_offset) & 1:
+                representation[anchor_row + row_offset, col_ix + col_offset] = 0
+    for col_offset in range(width):
+        column_masks[col_ix + col_offset] &= ~(PIECE_COLUMN_MASKS[tetromino_index, rot, col_offset] << anchor_row)
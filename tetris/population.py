@@ -0,0 +1,153 @@
+"""
+Binary, memory-mapped rollout state populations.
+
+File layout (little endian):
+    header   HEADER_DTYPE (32 bytes): magic, format version, number of states, number of rows and columns
+    rows     uint16[num_states, num_rows]     bit col_ix of rows[s, row_ix] is set if that cell of state s is full
+    heights  uint8[num_states, num_columns]   lowest free row per column
+
+open_population() memory-maps such a file into a RolloutStatePopulation, which builds a State only when one is indexed,
+so opening a population of any size takes milliseconds and only the states actually used are materialized.
+"""
+
+import os
+import numpy as np
+from numba import njit
+from tetris import state, hashing
+from tetris.bitboard import representation_from_rows, rows_from_representation, MAX_NUM_COLUMNS
+
+MAGIC = b"TETRSPOP"
+FORMAT_VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('num_rows', '<u4'), ('num_columns', '<u4'),
+                         ('padding', '<u4'), ('num_states', '<u8')])
+
+
+def write_population(path, rows, heights):
+    num_states, num_rows = rows.shape
+    num_columns = heights.shape[1]
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = FORMAT_VERSION
+    header['num_rows'] = num_rows
+    header['num_columns'] = num_columns
+    header['num_states'] = num_states
+    # Written to a temporary file next to `path` and renamed, so that readers (e.g., other runs converting the same
+    # text population) never see a partially written file.
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(header.tobytes())
+            f.write(np.ascontiguousarray(rows, dtype='<u2').tobytes())
+            f.write(np.ascontiguousarray(heights, dtype=np.uint8).tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def is_population_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def convert_text_population(text_path, binary_path, num_columns, max_samples=None):
+    """
+    Converts the text format (one state per line; one integer per row, bottom row first, whose binary digits after
+    the leading 1 are the cells of columns 0, 1, ...) to the binary format and returns the number of states.
+    """
+    cells = np.loadtxt(text_path, dtype=np.int64, ndmin=2, max_rows=max_samples)
+    num_states, num_rows = cells.shape
+    assert num_columns <= MAX_NUM_COLUMNS
+    rows = np.zeros((num_states, num_rows), dtype=np.uint16)
+    for col_ix in range(num_columns):
+        rows |= (((cells >> (num_columns - 1 - col_ix)) & 1) << col_ix).astype(np.uint16)
+    write_population(binary_path, rows, heights_from_rows(rows, num_columns))
+    return num_states
+
+
+def heights_from_rows(rows, num_columns):
+    num_states, num_rows = rows.shape
+    heights = np.zeros((num_states, num_columns), dtype=np.uint8)
+    for col_ix in range(num_columns):
+        is_full = (rows >> col_ix) & 1 == 1
+        # Index of the highest full cell + 1 (0 for empty columns).
+        heights[:, col_ix] = np.where(is_full.any(axis=1), num_rows - np.argmax(is_full[:, ::-1], axis=1), 0)
+    return heights
+
+
+def open_population(path, max_samples=None, num_features=8):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    if header['magic'] != MAGIC or header['version'] != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a rollout state population file (version {FORMAT_VERSION}).")
+    num_states, num_rows, num_columns = int(header['num_states']), int(header['num_rows']), int(header['num_columns'])
+    rows = np.memmap(path, dtype='<u2', mode='r', offset=HEADER_DTYPE.itemsize, shape=(num_states, num_rows))
+    heights = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_DTYPE.itemsize + rows.nbytes,
+                        shape=(num_states, num_columns))
+    if max_samples is not None:
+        rows = rows[:max_samples]
+        heights = heights[:max_samples]
+    return RolloutStatePopulation(rows, heights, num_features)
+
+
+def population_from_states(states, num_features=8):
+    rows = np.stack([rows_from_representation(s.representation, s.num_rows)[:s.num_rows] for s in states]).astype(np.uint16)
+    heights = np.stack([s.lowest_free_rows for s in states]).astype(np.uint8)
+    return RolloutStatePopulation(rows, heights, num_features)
+
+
+class RolloutStatePopulation:
+    """
+    Array store of rollout start states: rows[ix] and heights[ix] describe state ix (see the file layout above).
+    The arrays can be memory-mapped or in (shared) memory; States are only built when indexed.
+    """
+    def __init__(self, rows, heights, num_features=8):
+        self.rows = rows
+        self.heights = heights
+        self.num_rows = rows.shape[1]
+        self.num_columns = heights.shape[1]
+        self.num_features = num_features
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, ix):
+        return state_from_rows(np.asarray(self.rows[ix], dtype=np.uint16), np.asarray(self.heights[ix], dtype=np.int64),
+                               self.num_rows, self.num_columns, self.num_features)
+
+    def sample(self, size):
+        # Index vector of `size` states (without replacement if the population is large enough).
+        return np.random.choice(a=len(self), size=size, replace=False if len(self) > size else True)
+
+    def boards(self, ixs):
+        # Stacked (representations, lowest_free_rows) of states ixs.
+        return boards_from_rows(np.asarray(self.rows), np.asarray(self.heights), ixs, self.num_rows, self.num_columns)
+
+    def average_height(self):
+        return np.mean(self.heights)
+
+
+@njit(cache=True)
+def boards_from_rows(rows, heights, ixs, num_rows, num_columns):
+    representations = np.zeros((len(ixs), num_rows + state.NUM_HIDDEN_ROWS, num_columns), dtype=np.bool_)
+    lowest_free_rows = np.zeros((len(ixs), num_columns), dtype=np.int64)
+    for i in range(len(ixs)):
+        representations[i] = representation_from_rows(rows[ixs[i]], num_rows, num_columns)
+        lowest_free_rows[i] = heights[ixs[i]]
+    return representations, lowest_free_rows
+
+
+@njit(cache=False)
+def state_from_rows(rows, lowest_free_rows, num_rows, num_columns, num_features):
+    representation = representation_from_rows(rows, num_rows, num_columns)
+    column_masks = state.column_masks_from_representation(representation, lowest_free_rows)
+    return state.State(representation,
+                       lowest_free_rows,
+                       column_masks,
+                       hashing.board_hash(column_masks, lowest_free_rows),
+                       np.array([0], dtype=np.int64),  # changed_lines=
+                       np.array([0], dtype=np.int64),  # pieces_per_changed_row=
+                       0.0,  # landing_height_bonus=
+                       num_features,
+                       "bcts",
+                       False)
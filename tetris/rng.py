@@ -0,0 +1,102 @@
+"""
+Counter-based random numbers (Philox4x32-10, Salmon et al. 2011).
+
+The i-th draw of a CounterRNG is a pure function of (seed, stream, i), so generators can be copied and split into
+independent streams (per worker, per rollout, per child) deterministically, and serial and parallel runs produce
+identical numbers. All arithmetic is done on int64 with explicit 32-bit masks.
+"""
+
+import numpy as np
+from numba import njit, int64
+from numba.experimental import jitclass
+
+MASK32 = 0xFFFFFFFF
+PHILOX_M0 = 0xD2511F53
+PHILOX_M1 = 0xCD9E8D57
+PHILOX_W0 = 0x9E3779B9
+PHILOX_W1 = 0xBB67AE85
+SPLIT_KEY = 0x5851F42D
+
+
+@njit(cache=True)
+def philox4x32(c0, c1, c2, c3, k0, k1):
+    # Ten rounds of Philox4x32 on the 128-bit counter (c0, c1, c2, c3) with the 64-bit key (k0, k1).
+    for _ in range(10):
+        product0 = PHILOX_M0 * c0
+        product1 = PHILOX_M1 * c2
+        hi0 = (product0 >> 32) & MASK32
+        lo0 = product0 & MASK32
+        hi1 = (product1 >> 32) & MASK32
+        lo1 = product1 & MASK32
+        c0, c1, c2, c3 = hi1 ^ c1 ^ k0, lo1, hi0 ^ c3 ^ k1, lo0
+        k0 = (k0 + PHILOX_W0) & MASK32
+        k1 = (k1 + PHILOX_W1) & MASK32
+    return c0, c1, c2, c3
+
+
+@njit(cache=False)
+def seed_global(seed):
+    # numba's np.random state is separate from NumPy's; this seeds the one used by compiled code.
+    np.random.seed(seed)
+
+
+specRNG = [
+    ('seed', int64),
+    ('stream', int64),
+    ('counter', int64)
+]
+
+
+@jitclass(specRNG)
+class CounterRNG:
+    def __init__(self, seed, stream):
+        self.seed = seed
+        self.stream = stream
+        self.counter = 0
+
+    def next_block(self):
+        block = philox4x32(self.counter & MASK32, (self.counter >> 32) & MASK32,
+                           self.stream & MASK32, (self.stream >> 32) & MASK32,
+                           self.seed & MASK32, (self.seed >> 32) & MASK32)
+        self.counter += 1
+        return block
+
+    def randint(self, n):
+        # Uniform integer in [0, n) for 0 < n < 2**31 (Lemire's multiply-and-reject method, unbiased).
+        product = self.next_block()[0] * n
+        low = product & MASK32
+        if low < n:
+            threshold = (MASK32 + 1 - n) % n
+            while low < threshold:
+                product = self.next_block()[0] * n
+                low = product & MASK32
+        return product >> 32
+
+    def random(self):
+        # Uniform float in [0, 1) with 53 random bits.
+        block = self.next_block()
+        return ((block[0] >> 5) * 67108864 + (block[1] >> 6)) / 9007199254740992.0
+
+    def reseed(self, seed, stream):
+        self.seed = seed
+        self.stream = stream
+        self.counter = 0
+
+    def split(self, stream_ix):
+        # Independent generator for sub-stream `stream_ix` of this stream (starting at counter 0).
+        # Depends only on (seed, stream, stream_ix), not on how many numbers have been drawn.
+        new_rng = CounterRNG(self.seed, self.stream)
+        self.clone_into(new_rng, stream_ix)
+        return new_rng
+
+    def clone_into(self, other, stream_ix):
+        # Turns `other` into split(stream_ix) without allocating.
+        block = philox4x32(stream_ix & MASK32, (stream_ix >> 32) & MASK32,
+                           self.stream & MASK32, (self.stream >> 32) & MASK32,
+                           (self.seed & MASK32) ^ SPLIT_KEY, (self.seed >> 32) & MASK32)
+        other.reseed(self.seed, block[0] | (block[1] << 32))
+
+    def copy(self):
+        new_rng = CounterRNG(self.seed, self.stream)
+        new_rng.counter = self.counter
+        return new_rng
@@ -0,0 +1,125 @@
+"""
+Compiled tetromino generators with a preview queue.
+
+    "uniform":  i.i.d. uniform pieces.
+    "7bag":     the seven pieces in random order, then the next shuffled bag, ...
+    "history":  up to NUM_HISTORY_ROLLS draws that avoid the last four pieces (as in Tetris: The Grand Master).
+
+The sampler always knows the current piece and the next `preview_size` pieces (queue[head] is the current piece,
+the queue is a ring buffer). Pieces are drawn from an rng.CounterRNG, so split() clones a sampler (queue, bag and
+history included) onto an independent, deterministic stream.
+"""
+
+import numpy as np
+from numba import njit, int64
+from numba.experimental import jitclass
+from tetris import rng
+
+NUM_TETROMINOS = 7
+SAMPLER_TYPES = ("uniform", "7bag", "history")
+NUM_HISTORY_ROLLS = 4
+
+specSampler = [
+    ('sampler_type', int64),  # index into SAMPLER_TYPES
+    ('preview_size', int64),
+    ('rng', rng.CounterRNG.class_type.instance_type),
+    ('queue', int64[:]),
+    ('head', int64),
+    ('bag', int64[:]),
+    ('bag_position', int64),
+    ('history', int64[:])
+]
+
+
+@jitclass(specSampler)
+class TetrominoSampler:
+    def __init__(self, sampler_type, preview_size, generator):
+        # Only allocates; use seed() (or make_sampler()) to fill the queue.
+        self.sampler_type = sampler_type
+        self.preview_size = preview_size
+        self.rng = generator
+        self.queue = np.zeros(preview_size + 1, dtype=np.int64)
+        self.head = 0
+        self.bag = np.arange(NUM_TETROMINOS)
+        self.bag_position = NUM_TETROMINOS
+        self.history = np.zeros(4, dtype=np.int64)
+
+    def seed(self, seed, stream):
+        self.rng.reseed(seed, stream)
+        self.bag[:] = np.arange(NUM_TETROMINOS)
+        self.bag_position = NUM_TETROMINOS
+        self.history[:] = np.array([2, 3, 2, 3])  # snaker, snakel, snaker, snakel
+        self.head = 0
+        for ix in range(len(self.queue)):
+            self.queue[ix] = self.draw()
+
+    def draw(self):
+        if self.sampler_type == 0:
+            return self.rng.randint(NUM_TETROMINOS)
+        elif self.sampler_type == 1:
+            if self.bag_position == NUM_TETROMINOS:
+                # Fisher-Yates shuffle
+                for ix in range(NUM_TETROMINOS - 1, 0, -1):
+                    swap_ix = self.rng.randint(ix + 1)
+                    self.bag[ix], self.bag[swap_ix] = self.bag[swap_ix], self.bag[ix]
+                self.bag_position = 0
+            piece = self.bag[self.bag_position]
+            self.bag_position += 1
+            return piece
+        else:
+            piece = self.rng.randint(NUM_TETROMINOS)
+            for _ in range(NUM_HISTORY_ROLLS - 1):
+                if not np.any(self.history == piece):
+                    break
+                piece = self.rng.randint(NUM_TETROMINOS)
+            self.history[1:] = self.history[:-1].copy()
+            self.history[0] = piece
+            return piece
+
+    def current(self):
+        return self.queue[self.head]
+
+    def next(self):
+        # Advances the queue by one piece and returns the new current piece.
+        self.queue[self.head] = self.draw()
+        self.head = (self.head + 1) % len(self.queue)
+        return self.queue[self.head]
+
+    def preview(self):
+        # The next preview_size pieces (after the current one), in order.
+        pieces = np.empty(self.preview_size, dtype=np.int64)
+        for ix in range(self.preview_size):
+            pieces[ix] = self.queue[(self.head + 1 + ix) % len(self.queue)]
+        return pieces
+
+    def split(self, stream_ix):
+        # Clone with the same queue, bag and history whose future pieces come from sub-stream `stream_ix`.
+        new_sampler = TetrominoSampler(self.sampler_type, self.preview_size, rng.CounterRNG(0, 0))
+        self.clone_into(new_sampler, stream_ix)
+        return new_sampler
+
+    def clone_into(self, other, stream_ix):
+        # Turns `other` into split(stream_ix) without allocating (unless the preview sizes differ).
+        other.sampler_type = self.sampler_type
+        if other.preview_size != self.preview_size:
+            other.preview_size = self.preview_size
+            other.queue = np.zeros(self.preview_size + 1, dtype=np.int64)
+        self.rng.clone_into(other.rng, stream_ix)
+        other.queue[:] = self.queue
+        other.head = self.head
+        other.bag[:] = self.bag
+        other.bag_position = self.bag_position
+        other.history[:] = self.history
+
+
+@njit(cache=False)
+def make_sampler(sampler_type, preview_size, seed, stream):
+    sampler_index = -1
+    for ix in range(len(SAMPLER_TYPES)):
+        if SAMPLER_TYPES[ix] == sampler_type:
+            sampler_index = ix
+    if sampler_index < 0:
+        raise ValueError("sampler_type has to be 'uniform', '7bag' or 'history'.")
+    sampler = TetrominoSampler(sampler_index, preview_size, rng.CounterRNG(seed, stream))
+    sampler.seed(seed, stream)
+    return sampler
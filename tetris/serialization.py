@@ -0,0 +1,271 @@
+"""
+Compact byte encodings of States, generative models (Tetromino) and environments (Tetris); ConstantAgents are
+encoded in agents.constant_agent with the same helpers.
+
+jitclass instances cannot be pickled; these encodings can (as bytes), e.g., to send rollout work items, game
+snapshots or evaluation jobs to worker processes. All integers are little endian.
+
+    State (32 + 2 * (num_rows + NUM_HIDDEN_ROWS) + num_columns + 2 * num_changed_lines bytes, e.g., 72 to 78 bytes
+    on a 10 x 10 board):
+        kind, piece + 1, num_rows, num_columns, num_features, anchor_row, num_changed_lines, n_cleared_lines,
+        terminal_state (1 byte each), 7 padding bytes, landing_height_bonus (float64), board_hash (int64),
+        rows (uint16 bitmasks, hidden rows included), heights (1 byte per column),
+        cleared_rows_relative_to_anchor and pieces_per_changed_row (1 byte per changed line)
+    Tetromino: kind, current piece, num_features, num_columns, sampler type, preview size, head, bag position
+        (1 byte each), seed, stream, counter and num_copies (int64), queue (preview size + 1 bytes), bag (7 bytes),
+        history (4 bytes)
+    Tetris: kind, game_over, tetromino_size (1 byte each), 5 padding bytes, cleared_lines and max_cleared_test_lines
+        (int64), then the encoded generative model and current state
+
+States are assumed to be "bcts" (the only feature type). Feature caches are not encoded; decoded
+generative models start with a disabled cache (see Tetromino.use_feature_cache()).
+"""
+
+import numpy as np
+from numba import njit
+from tetris import state, hashing, samplers, tetromino, rng
+from tetris.bitboard import rows_from_representation
+from tetris.game import Tetris
+
+STATE_KIND = 1
+TETROMINO_KIND = 2
+TETRIS_KIND = 3
+STATE_HEADER_SIZE = 32
+TETROMINO_HEADER_SIZE = 40
+TETRIS_HEADER_SIZE = 24
+
+
+@njit(cache=True)
+def put_int(buffer, position, value, num_bytes):
+    for byte_ix in range(num_bytes):
+        buffer[position + byte_ix] = (value >> (8 * byte_ix)) & 0xFF
+    return position + num_bytes
+
+
+@njit(cache=True)
+def get_int(buffer, position, num_bytes):
+    value = np.int64(0)
+    for byte_ix in range(num_bytes):
+        value |= np.int64(buffer[position + byte_ix]) << (8 * byte_ix)
+    return value
+
+
+@njit(cache=True)
+def put_float(buffer, position, value):
+    return put_int(buffer, position, np.array([value], dtype=np.float64).view(np.int64)[0], 8)
+
+
+@njit(cache=True)
+def get_float(buffer, position):
+    return np.array([get_int(buffer, position, 8)], dtype=np.int64).view(np.float64)[0]
+
+
+@njit(cache=True)
+def encoded_state_size(num_rows, num_columns, num_changed_lines):
+    return STATE_HEADER_SIZE + 2 * (num_rows + state.NUM_HIDDEN_ROWS) + num_columns + 2 * num_changed_lines
+
+
+@njit(cache=False)
+def encode_state_into(buffer, position, current_state, piece):
+    num_changed_lines = len(current_state.pieces_per_changed_row)
+    put_int(buffer, position, STATE_KIND, 1)
+    put_int(buffer, position + 1, piece + 1, 1)
+    put_int(buffer, position + 2, current_state.num_rows, 1)
+    put_int(buffer, position + 3, current_state.num_columns, 1)
+    put_int(buffer, position + 4, current_state.num_features, 1)
+    put_int(buffer, position + 5, current_state.anchor_row, 1)
+    put_int(buffer, position + 6, num_changed_lines, 1)
+    put_int(buffer, position + 7, current_state.n_cleared_lines, 1)
+    put_int(buffer, position + 8, np.int64(current_state.terminal_state), 1)
+    put_float(buffer, position + 16, current_state.landing_height_bonus)
+    put_int(buffer, position + 24, current_state.board_hash, 8)
+    position += STATE_HEADER_SIZE
+    rows = rows_from_representation(current_state.representation, current_state.num_rows)
+    for row_ix in range(len(rows)):
+        position = put_int(buffer, position, rows[row_ix], 2)
+    for col_ix in range(current_state.num_columns):
+        position = put_int(buffer, position, current_state.lowest_free_rows[col_ix], 1)
+    for line_ix in range(num_changed_lines):
+        position = put_int(buffer, position, np.int64(current_state.cleared_rows_relative_to_anchor[line_ix]), 1)
+    for line_ix in range(num_changed_lines):
+        position = put_int(buffer, position, current_state.pieces_per_changed_row[line_ix], 1)
+    return position
+
+
+@njit(cache=False)
+def decode_state_from(buffer, position):
+    # Returns (state, piece, position after the state); piece is -1 if none was encoded.
+    assert get_int(buffer, position, 1) == STATE_KIND, "Not an encoded State."
+    piece = get_int(buffer, position + 1, 1) - 1
+    num_rows = get_int(buffer, position + 2, 1)
+    num_columns = get_int(buffer, position + 3, 1)
+    num_features = get_int(buffer, position + 4, 1)
+    anchor_row = get_int(buffer, position + 5, 1)
+    num_changed_lines = get_int(buffer, position + 6, 1)
+    n_cleared_lines = get_int(buffer, position + 7, 1)
+    terminal_state = get_int(buffer, position + 8, 1) == 1
+    landing_height_bonus = get_float(buffer, position + 16)
+    board_hash = get_int(buffer, position + 24, 8)
+    position += STATE_HEADER_SIZE
+    # Hidden rows are part of the encoding (terminal states can have full cells there).
+    representation = np.zeros((num_rows + state.NUM_HIDDEN_ROWS, num_columns), dtype=np.bool_)
+    for row_ix in range(num_rows + state.NUM_HIDDEN_ROWS):
+        row = get_int(buffer, position, 2)
+        position += 2
+        for col_ix in range(num_columns):
+            representation[row_ix, col_ix] = (row >> col_ix) & 1 == 1
+    lowest_free_rows = np.zeros(num_columns, dtype=np.int64)
+    for col_ix in range(num_columns):
+        lowest_free_rows[col_ix] = get_int(buffer, position, 1)
+        position += 1
+    cleared_rows_relative_to_anchor = np.zeros(num_changed_lines, dtype=np.bool_)
+    for line_ix in range(num_changed_lines):
+        cleared_rows_relative_to_anchor[line_ix] = get_int(buffer, position, 1) == 1
+        position += 1
+    pieces_per_changed_row = np.zeros(num_changed_lines, dtype=np.int64)
+    for line_ix in range(num_changed_lines):
+        pieces_per_changed_row[line_ix] = get_int(buffer, position, 1)
+        position += 1
+    column_masks = state.column_masks_from_representation(representation, lowest_free_rows)
+    # The board is stored after clearing lines, so the constructor is given copies (it clears lines in place) and
+    # everything it derives from the placement is restored afterwards.
+    decoded_state = state.State(representation.copy(), lowest_free_rows.copy(), column_masks.copy(), board_hash,
+                                np.array([anchor_row], dtype=np.int64), pieces_per_changed_row,
+                                landing_height_bonus, num_features, "bcts", False)
+    decoded_state.representation = representation
+    decoded_state.lowest_free_rows = lowest_free_rows
+    decoded_state.column_masks = column_masks
+    decoded_state.board_hash = board_hash
+    decoded_state.n_cleared_lines = n_cleared_lines
+    decoded_state.cleared_rows_relative_to_anchor = cleared_rows_relative_to_anchor
+    decoded_state.terminal_state = terminal_state
+    return decoded_state, piece, position
+
+
+@njit(cache=False)
+def encoded_tetromino_size(generative_model):
+    return TETROMINO_HEADER_SIZE + generative_model.sampler.preview_size + 1 + samplers.NUM_TETROMINOS + 4
+
+
+@njit(cache=False)
+def encode_tetromino_into(buffer, position, generative_model):
+    sampler = generative_model.sampler
+    put_int(buffer, position, TETROMINO_KIND, 1)
+    put_int(buffer, position + 1, generative_model.current_tetromino, 1)
+    put_int(buffer, position + 2, generative_model.num_features, 1)
+    put_int(buffer, position + 3, generative_model.num_columns, 1)
+    put_int(buffer, position + 4, sampler.sampler_type, 1)
+    put_int(buffer, position + 5, sampler.preview_size, 1)
+    put_int(buffer, position + 6, sampler.head, 1)
+    put_int(buffer, position + 7, sampler.bag_position, 1)
+    put_int(buffer, position + 8, sampler.rng.seed, 8)
+    put_int(buffer, position + 16, sampler.rng.stream, 8)
+    put_int(buffer, position + 24, sampler.rng.counter, 8)
+    put_int(buffer, position + 32, generative_model.num_copies, 8)
+    position += TETROMINO_HEADER_SIZE
+    for ix in range(len(sampler.queue)):
+        position = put_int(buffer, position, sampler.queue[ix], 1)
+    for ix in range(len(sampler.bag)):
+        position = put_int(buffer, position, sampler.bag[ix], 1)
+    for ix in range(len(sampler.history)):
+        position = put_int(buffer, position, sampler.history[ix], 1)
+    return position
+
+
+@njit(cache=False)
+def decode_tetromino_from(buffer, position):
+    assert get_int(buffer, position, 1) == TETROMINO_KIND, "Not an encoded Tetromino."
+    num_features = get_int(buffer, position + 2, 1)
+    generator = rng.CounterRNG(get_int(buffer, position + 8, 8), get_int(buffer, position + 16, 8))
+    generator.counter = get_int(buffer, position + 24, 8)
+    sampler = samplers.TetrominoSampler(get_int(buffer, position + 4, 1), get_int(buffer, position + 5, 1), generator)
+    sampler.head = get_int(buffer, position + 6, 1)
+    sampler.bag_position = get_int(buffer, position + 7, 1)
+    generative_model = tetromino.Tetromino("bcts", num_features, get_int(buffer, position + 3, 1), sampler,
+                                           hashing.FeatureCache(0, num_features, 4))
+    generative_model.current_tetromino = get_int(buffer, position + 1, 1)
+    generative_model.num_copies = get_int(buffer, position + 32, 8)
+    position += TETROMINO_HEADER_SIZE
+    for ix in range(len(sampler.queue)):
+        sampler.queue[ix] = get_int(buffer, position, 1)
+        position += 1
+    for ix in range(len(sampler.bag)):
+        sampler.bag[ix] = get_int(buffer, position, 1)
+        position += 1
+    for ix in range(len(sampler.history)):
+        sampler.history[ix] = get_int(buffer, position, 1)
+        position += 1
+    return generative_model, position
+
+
+@njit(cache=False)
+def encode_state_array(current_state, piece):
+    buffer = np.zeros(encoded_state_size(current_state.num_rows, current_state.num_columns,
+                                 len(current_state.pieces_per_changed_row)), dtype=np.uint8)
+    encode_state_into(buffer, 0, current_state, piece)
+    return buffer
+
+
+@njit(cache=False)
+def encode_tetromino_array(generative_model):
+    buffer = np.zeros(encoded_tetromino_size(generative_model), dtype=np.uint8)
+    encode_tetromino_into(buffer, 0, generative_model)
+    return buffer
+
+
+@njit(cache=False)
+def encode_tetris_array(env):
+    current_state = env.current_state
+    buffer = np.zeros(TETRIS_HEADER_SIZE + encoded_tetromino_size(env.generative_model)
+                      + encoded_state_size(current_state.num_rows, current_state.num_columns,
+                                   len(current_state.pieces_per_changed_row)), dtype=np.uint8)
+    put_int(buffer, 0, TETRIS_KIND, 1)
+    put_int(buffer, 1, np.int64(env.game_over), 1)
+    put_int(buffer, 2, env.tetromino_size, 1)
+    put_int(buffer, 8, env.cleared_lines, 8)
+    put_int(buffer, 16, env.max_cleared_test_lines, 8)
+    position = encode_tetromino_into(buffer, TETRIS_HEADER_SIZE, env.generative_model)
+    encode_state_into(buffer, position, current_state, env.generative_model.current_tetromino)
+    return buffer
+
+
+@njit(cache=False)
+def decode_tetris_array(buffer):
+    assert get_int(buffer, 0, 1) == TETRIS_KIND, "Not an encoded Tetris."
+    generative_model, position = decode_tetromino_from(buffer, TETRIS_HEADER_SIZE)
+    current_state, _, _ = decode_state_from(buffer, position)
+    # With a seed, the constructor does not draw one from (and advance) the caller's np.random stream.
+    env = Tetris(current_state.num_columns, current_state.num_rows, get_int(buffer, 16, 8), get_int(buffer, 2, 1),
+                 "bcts", generative_model.num_features, samplers.SAMPLER_TYPES[generative_model.sampler.sampler_type],
+                 generative_model.sampler.preview_size, 0)
+    env.game_over = get_int(buffer, 1, 1) == 1
+    env.cleared_lines = get_int(buffer, 8, 8)
+    env.generative_model = generative_model
+    env.current_state = current_state
+    return env
+
+
+def encode_state(current_state, piece=-1):
+    return encode_state_array(current_state, piece).tobytes()
+
+
+def decode_state(data):
+    # Returns (state, piece).
+    decoded_state, piece, _ = decode_state_from(np.frombuffer(data, dtype=np.uint8), 0)
+    return decoded_state, piece
+
+
+def encode_tetromino(generative_model):
+    return encode_tetromino_array(generative_model).tobytes()
+
+
+def decode_tetromino(data):
+    return decode_tetromino_from(np.frombuffer(data, dtype=np.uint8), 0)[0]
+
+
+def encode_tetris(env):
+    return encode_tetris_array(env).tobytes()
+
+
+def decode_tetris(data):
+    return decode_tetris_array(np.frombuffer(data, dtype=np.uint8))
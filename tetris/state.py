@@ -2,11 +2,19 @@ import numpy as np
 import numba
 from numba import njit, float64, bool_, int64
 from numba.experimental import jitclass
+from tetris import hashing
 
+# Every board carries this many (empty) rows on top of the `num_rows` visible rows, so that placements
+# overlapping the top need no reallocation. A state is terminal iff a cell in these rows is full after clearing lines.
+NUM_HIDDEN_ROWS = 4
+# Column occupancy masks are int64 (bit `row_ix` is set if the cell is full), so boards can have up to 63 rows in total.
+MAX_NUM_ROWS_TOTAL = 63
 
 spec = [
     ('representation', bool_[:, :]),
     ('lowest_free_rows', int64[:]),
+    ('column_masks', int64[:]),
+    ('board_hash', int64),
     ('changed_lines', int64[:]),
     ('pieces_per_changed_row', int64[:]),
     ('landing_height_bonus', float64),
@@ -28,22 +36,24 @@ class State(object):
     def __init__(self,
                  representation,
                  lowest_free_rows,
+                 column_masks,  # per column: bitmask of full cells
+                 board_hash,  # Zobrist hash of `representation` (as passed, i.e., before clearing lines)
                  changed_lines,  #=np.array([0], dtype=np.int64),
                  pieces_per_changed_row,  #=np.array([0], dtype=np.int64),
                  landing_height_bonus,  # =0.0,
                  num_features,  #=8,
                  feature_type,  #="bcts",
-                 terminal_state,  # this is useful to generate a "terminal state"
-                 has_overlapping_fields=False
+                 terminal_state  # this is useful to generate a "terminal state"
                  ):
         self.terminal_state = terminal_state
 
         if not terminal_state:
-            self.representation = representation
+            self.representation = representation  # num_rows + NUM_HIDDEN_ROWS rows, e.g., 14 rows for a 10x10 board
             self.lowest_free_rows = lowest_free_rows
+            self.column_masks = column_masks
+            self.board_hash = board_hash
             self.num_rows, self.num_columns = representation.shape
-            if has_overlapping_fields:
-                self.num_rows -= 4  # representation received in this case has e.g., 14 rows (for a 10x10 board)
+            self.num_rows -= NUM_HIDDEN_ROWS
             self.pieces_per_changed_row = pieces_per_changed_row
             self.landing_height_bonus = landing_height_bonus
             self.num_features = num_features
@@ -51,11 +61,11 @@ class State(object):
             self.n_cleared_lines = 0  # Gets updated in self.clear_lines()
             self.anchor_row = changed_lines[0]
             self.cleared_rows_relative_to_anchor = self.clear_lines(changed_lines)
+            if self.n_cleared_lines > 0:
+                self.board_hash = hashing.board_hash(self.column_masks, self.lowest_free_rows)
             self.features_are_calculated = False
             self.features = np.zeros(self.num_features, dtype=np.float64)
-            if has_overlapping_fields:
-                self.terminal_state = check_terminal(self.representation, self.num_rows)
-                self.representation = self.representation[:self.num_rows, ]
+            self.terminal_state = check_terminal(self.representation, self.num_rows)
 
     def get_features_order_and_direct(self, direct_by, order_by, addRBF=False):
         if not self.features_are_calculated:
@@ -107,231 +117,190 @@ class State(object):
         return features
 
     def clear_lines(self, changed_lines):
-        num_columns = self.num_columns
-        row_sums = np.sum(self.representation[changed_lines, :], axis=1)
-        is_full = (row_sums == num_columns)
-        full_lines = np.where(is_full)[0]
-        n_cleared_lines = len(full_lines)
-        if n_cleared_lines > 0:
-            # print(self)
-            representation = self.representation
-            lowest_free_rows = self.lowest_free_rows
-            lines_to_clear = changed_lines[full_lines].astype(np.int64)
-            mask_keep = np.ones(len(representation), dtype=np.bool_)
-            mask_keep[lines_to_clear] = False
-            new_cols = np.zeros((n_cleared_lines, num_columns), dtype=np.bool_)
-            representation = np.vstack((representation[mask_keep], new_cols))
-            for col_ix in range(num_columns):  # col_ix = 0
-                old_lowest_free_row = lowest_free_rows[col_ix]
-                if old_lowest_free_row > lines_to_clear[-1] + 1:
-                    lowest_free_rows[col_ix] -= n_cleared_lines
-                else:
-                    lowest = 0
-                    for row_ix in range(old_lowest_free_row - n_cleared_lines - 1, -1, -1):
-                        if representation[row_ix, col_ix] == 1:
-                            lowest = row_ix + 1
-                            break
-                    lowest_free_rows[col_ix] = lowest
-            self.lowest_free_rows = lowest_free_rows
-            self.representation = representation
-
-        self.n_cleared_lines = n_cleared_lines
+        # Lines are cleared in place; the hidden rows on top absorb the shift.
+        is_full = clear_lines_in_place(self.representation, self.lowest_free_rows, self.column_masks, changed_lines)
+        self.n_cleared_lines = numba_sum_int(is_full)
         return is_full  # , n_cleared_lines, representation, lowest_free_rows
 
     # TODO: Optimization ideas: representation to bools -- seemes to work!
     # TODO:                     only count hole depth first time when an actual hole is found
 
     def calc_bcts_features(self):
-        rows_with_holes_set = {1000}
-        representation = self.representation
-        num_rows, num_columns = representation.shape
-        lowest_free_rows = self.lowest_free_rows
-        col_transitions = 0
-        row_transitions = 0
-        holes = 0
-        hole_depths = 0
-        cumulative_wells = 0
-        # row_transitions = 0
-        for col_ix, lowest_free_row in enumerate(lowest_free_rows):
-            # There is at least one column_transition from the highest full cell (or the bottom which is assumed to be full) to "the top".
-            col_transitions += 1
-            if col_ix == 0:
-                local_well_streak = 0
-                if lowest_free_row > 0:
-                    col = representation[:lowest_free_row, col_ix]
-                    cell_below = 1
-
-                    # Needed for hole_depth
-                    # TODO: Optimize... only count the first time when an actual hole is found
-                    number_of_full_cells_above = numba_sum_int(col)
-
-                    for row_ix, cell in enumerate(col):
-                        if cell == 0:
-                            # Holes
-                            holes += 1
-                            rows_with_holes_set.add(row_ix)
-                            hole_depths += number_of_full_cells_above
-
-                            # Column transitions
-                            if cell_below:
-                                col_transitions += 1
-
-                            # Row transitions and wells
-                            # Because col_ix == 0, all left_cells are 1
-                            # row_transitions += 1
-                            row_transitions += 1
-                            if representation[row_ix, col_ix + 1]:  # if cell to the right is full
-                                local_well_streak += 1
-                                cumulative_wells += local_well_streak
-                            else:
-                                local_well_streak = 0
+        eroded_pieces = numba_sum_int(self.cleared_rows_relative_to_anchor * self.pieces_per_changed_row)
+        # n_cleared_lines = numba_sum_int(self.cleared_rows_relative_to_anchor)
+        eroded_piece_cells = eroded_pieces * self.n_cleared_lines
+        landing_height = self.anchor_row + self.landing_height_bonus
+        self.features = bcts_features(self.representation, self.lowest_free_rows, self.num_rows,
+                                      landing_height, eroded_piece_cells)
 
-                        else:  # cell is 1!
-                            local_well_streak = 0
 
-                            # Keep track of full cells above for hole_depth-feature
-                            number_of_full_cells_above -= 1
+specTerm = [
+    ('terminal_state', bool_),
+]
+
 
-                            # Column transitions
-                            if not cell_below:
-                                col_transitions += 1
+@jitclass(specTerm)
+class TerminalState:
+    def __init__(self):
+        self.terminal_state = True
 
-                        # Define 'cell_below' for next (higher!) cell.
-                        cell_below = cell
 
-                # Check wells until lowest_free_row_right
-                # Check transitions until lowest_free_row_left
-                max_well_possibility = lowest_free_rows[col_ix + 1]
-                if max_well_possibility > lowest_free_row:
-                    for row_ix in range(lowest_free_row, max_well_possibility):
+@njit(cache=True)
+def bcts_features(representation, lowest_free_rows, num_rows, landing_height, eroded_piece_cells):
+    """
+    BCTS features of a board. Only the first `num_rows` rows of `representation` are considered
+    (boards may carry extra rows on top).
+    """
+    rows_with_holes_set = {1000}
+    num_columns = representation.shape[1]
+    col_transitions = 0
+    row_transitions = 0
+    holes = 0
+    hole_depths = 0
+    cumulative_wells = 0
+    # row_transitions = 0
+    for col_ix, lowest_free_row in enumerate(lowest_free_rows):
+        # There is at least one column_transition from the highest full cell (or the bottom which is assumed to be full) to "the top".
+        col_transitions += 1
+        if col_ix == 0:
+            local_well_streak = 0
+            if lowest_free_row > 0:
+                col = representation[:lowest_free_row, col_ix]
+                cell_below = 1
+
+                # Needed for hole_depth
+                # TODO: Optimize... only count the first time when an actual hole is found
+                number_of_full_cells_above = numba_sum_int(col)
+
+                for row_ix, cell in enumerate(col):
+                    if cell == 0:
+                        # Holes
+                        holes += 1
+                        rows_with_holes_set.add(row_ix)
+                        hole_depths += number_of_full_cells_above
+
+                        # Column transitions
+                        if cell_below:
+                            col_transitions += 1
+
+                        # Row transitions and wells
+                        # Because col_ix == 0, all left_cells are 1
+                        # row_transitions += 1
+                        row_transitions += 1
                         if representation[row_ix, col_ix + 1]:  # if cell to the right is full
                             local_well_streak += 1
                             cumulative_wells += local_well_streak
                         else:
                             local_well_streak = 0
-                # # Add row transitions for each empty cell above lowest_free_row
-                row_transitions += (num_rows - lowest_free_row)
-
-            elif col_ix == num_columns - 1:
-                local_well_streak = 0
-                if lowest_free_row > 0:
-                    col = representation[:lowest_free_row, col_ix]
-                    cell_below = 1
-
-                    # Needed for hole_depth
-                    number_of_full_cells_above = numba_sum_int(col)
-
-                    for row_ix, cell in enumerate(col):
-                        if cell == 0:
-                            # Holes
-                            holes += 1
-                            rows_with_holes_set.add(row_ix)
-                            hole_depths += number_of_full_cells_above
-
-                            # Column transitions
-                            if cell_below:
-                                col_transitions += 1
-
-                            # Wells and row transitions
-                            # Because this is the last column (the right border is "full") and cell == 0:
-                            row_transitions += 1
-                            if representation[row_ix, col_ix - 1]:  # if cell to the left is full
-                                row_transitions += 1
-                                local_well_streak += 1
-                                cumulative_wells += local_well_streak
-                            else:
-                                local_well_streak = 0
 
-                        else:  # cell is 1!
-                            local_well_streak = 0
-
-                            # Keep track of full cells above for hole_depth-feature
-                            number_of_full_cells_above -= 1
-
-                            # Column transitions
-                            if not cell_below:
-                                col_transitions += 1
-
-                            # Row transitions
-                            cell_left = representation[row_ix, col_ix - 1]
-                            if not cell_left:
-                                row_transitions += 1
-
-                        # Define 'cell_below' for next (higher!) cell.
-                        cell_below = cell
-
-                # Check wells until minimum(lowest_free_row_left, lowest_free_row_right)
-                # Check transitions until lowest_free_row_left
-                max_well_possibility = lowest_free_rows[col_ix - 1]
-                if max_well_possibility > lowest_free_row:
-                    for row_ix in range(lowest_free_row, max_well_possibility):
+                    else:  # cell is 1!
+                        local_well_streak = 0
+
+                        # Keep track of full cells above for hole_depth-feature
+                        number_of_full_cells_above -= 1
+
+                        # Column transitions
+                        if not cell_below:
+                            col_transitions += 1
+
+                    # Define 'cell_below' for next (higher!) cell.
+                    cell_below = cell
+
+            # Check wells until lowest_free_row_right
+            # Check transitions until lowest_free_row_left
+            max_well_possibility = lowest_free_rows[col_ix + 1]
+            if max_well_possibility > lowest_free_row:
+                for row_ix in range(lowest_free_row, max_well_possibility):
+                    if representation[row_ix, col_ix + 1]:  # if cell to the right is full
+                        local_well_streak += 1
+                        cumulative_wells += local_well_streak
+                    else:
+                        local_well_streak = 0
+            # # Add row transitions for each empty cell above lowest_free_row
+            row_transitions += (num_rows - lowest_free_row)
+
+        elif col_ix == num_columns - 1:
+            local_well_streak = 0
+            if lowest_free_row > 0:
+                col = representation[:lowest_free_row, col_ix]
+                cell_below = 1
+
+                # Needed for hole_depth
+                number_of_full_cells_above = numba_sum_int(col)
+
+                for row_ix, cell in enumerate(col):
+                    if cell == 0:
+                        # Holes
+                        holes += 1
+                        rows_with_holes_set.add(row_ix)
+                        hole_depths += number_of_full_cells_above
+
+                        # Column transitions
+                        if cell_below:
+                            col_transitions += 1
+
+                        # Wells and row transitions
+                        # Because this is the last column (the right border is "full") and cell == 0:
+                        row_transitions += 1
                         if representation[row_ix, col_ix - 1]:  # if cell to the left is full
                             row_transitions += 1
                             local_well_streak += 1
                             cumulative_wells += local_well_streak
                         else:
                             local_well_streak = 0
-                # # Add row transitions from last column to border
-                row_transitions += (num_rows - lowest_free_row)
-            else:
-                local_well_streak = 0
-                if lowest_free_row > 0:
-                    col = representation[:lowest_free_row, col_ix]
-                    cell_below = 1
-
-                    # Needed for hole_depth
-                    number_of_full_cells_above = numba_sum_int(col)
-
-                    for row_ix, cell in enumerate(col):
-                        if cell == 0:
-                            # Holes
-                            holes += 1
-                            rows_with_holes_set.add(row_ix)
-                            hole_depths += number_of_full_cells_above
-
-                            # Column transitions
-                            if cell_below:
-                                col_transitions += 1
-
-                            # Wells and row transitions
-                            cell_left = representation[row_ix, col_ix - 1]
-                            if cell_left:
-                                row_transitions += 1
-                                cell_right = representation[row_ix, col_ix + 1]
-                                if cell_right:
-                                    local_well_streak += 1
-                                    cumulative_wells += local_well_streak
-                                else:
-                                    local_well_streak = 0
-                            else:
-                                local_well_streak = 0
 
-                        else:  # cell is 1!
-                            local_well_streak = 0
-                            # Keep track of full cells above for hole_depth-feature
-                            number_of_full_cells_above -= 1
-
-                            # Column transitions
-                            if not cell_below:
-                                col_transitions += 1
-
-                            # Row transitions
-                            cell_left = representation[row_ix, col_ix - 1]
-                            if not cell_left:
-                                row_transitions += 1
-
-                        # Define 'cell_below' for next (higher!) cell.
-                        cell_below = cell
-                # Check wells until minimum(lowest_free_row_left, lowest_free_row_right)
-                # Check transitions until lowest_free_row_left
-                lowest_free_row_left = lowest_free_rows[col_ix - 1]
-                lowest_free_row_right = lowest_free_rows[col_ix + 1]
-                max_well_possibility = np.minimum(lowest_free_row_left, lowest_free_row_right)
-
-                # Weird case distinction because max_well_possibility always "includes" lowest_free_row_left
-                #  but lowest_free_row_left can be higher than max_well_possibility. Don't want to double count.
-                if max_well_possibility > lowest_free_row:
-                    for row_ix in range(lowest_free_row, max_well_possibility):
+                    else:  # cell is 1!
+                        local_well_streak = 0
+
+                        # Keep track of full cells above for hole_depth-feature
+                        number_of_full_cells_above -= 1
+
+                        # Column transitions
+                        if not cell_below:
+                            col_transitions += 1
+
+                        # Row transitions
+                        cell_left = representation[row_ix, col_ix - 1]
+                        if not cell_left:
+                            row_transitions += 1
+
+                    # Define 'cell_below' for next (higher!) cell.
+                    cell_below = cell
+
+            # Check wells until minimum(lowest_free_row_left, lowest_free_row_right)
+            # Check transitions until lowest_free_row_left
+            max_well_possibility = lowest_free_rows[col_ix - 1]
+            if max_well_possibility > lowest_free_row:
+                for row_ix in range(lowest_free_row, max_well_possibility):
+                    if representation[row_ix, col_ix - 1]:  # if cell to the left is full
+                        row_transitions += 1
+                        local_well_streak += 1
+                        cumulative_wells += local_well_streak
+                    else:
+                        local_well_streak = 0
+            # # Add row transitions from last column to border
+            row_transitions += (num_rows - lowest_free_row)
+        else:
+            local_well_streak = 0
+            if lowest_free_row > 0:
+                col = representation[:lowest_free_row, col_ix]
+                cell_below = 1
+
+                # Needed for hole_depth
+                number_of_full_cells_above = numba_sum_int(col)
+
+                for row_ix, cell in enumerate(col):
+                    if cell == 0:
+                        # Holes
+                        holes += 1
+                        rows_with_holes_set.add(row_ix)
+                        hole_depths += number_of_full_cells_above
+
+                        # Column transitions
+                        if cell_below:
+                            col_transitions += 1
+
+                        # Wells and row transitions
                         cell_left = representation[row_ix, col_ix - 1]
                         if cell_left:
                             row_transitions += 1
@@ -343,56 +312,140 @@ class State(object):
                                 local_well_streak = 0
                         else:
                             local_well_streak = 0
-                    if lowest_free_row_left > max_well_possibility:
-                        for row_ix in range(max_well_possibility, lowest_free_row_left):
-                            cell_left = representation[row_ix, col_ix - 1]
-                            if cell_left:
-                                row_transitions += 1
-                elif lowest_free_row_left > lowest_free_row:
-                    for row_ix in range(lowest_free_row, lowest_free_row_left):
-                        cell_left = representation[row_ix, col_ix - 1]
-                        if cell_left:
-                            row_transitions += 1
 
-        rows_with_holes_set.remove(1000)
-        rows_with_holes = len(rows_with_holes_set)
-        eroded_pieces = numba_sum_int(self.cleared_rows_relative_to_anchor * self.pieces_per_changed_row)
-        # n_cleared_lines = numba_sum_int(self.cleared_rows_relative_to_anchor)
-        eroded_piece_cells = eroded_pieces * self.n_cleared_lines
-        landing_height = self.anchor_row + self.landing_height_bonus
-        self.features = np.array([rows_with_holes, col_transitions, holes, landing_height,
-                                  cumulative_wells, row_transitions, eroded_piece_cells, hole_depths])
+                    else:  # cell is 1!
+                        local_well_streak = 0
+                        # Keep track of full cells above for hole_depth-feature
+                        number_of_full_cells_above -= 1
 
+                        # Column transitions
+                        if not cell_below:
+                            col_transitions += 1
 
-specTerm = [
-    ('terminal_state', bool_),
-]
-
-
-@jitclass(specTerm)
-class TerminalState:
-    def __init__(self):
-        self.terminal_state = True
-
+                        # Row transitions
+                        cell_left = representation[row_ix, col_ix - 1]
+                        if not cell_left:
+                            row_transitions += 1
 
-@njit(cache=False)
+                    # Define 'cell_below' for next (higher!) cell.
+                    cell_below = cell
+            # Check wells until minimum(lowest_free_row_left, lowest_free_row_right)
+            # Check transitions until lowest_free_row_left
+            lowest_free_row_left = lowest_free_rows[col_ix - 1]
+            lowest_free_row_right = lowest_free_rows[col_ix + 1]
+            max_well_possibility = np.minimum(lowest_free_row_left, lowest_free_row_right)
+
+            # Weird case distinction because max_well_possibility always "includes" lowest_free_row_left
+            #  but lowest_free_row_left can be higher than max_well_possibility. Don't want to double count.
+            if max_well_possibility > lowest_free_row:
+                for row_ix in range(lowest_free_row, max_well_possibility):
+                    cell_left = representation[row_ix, col_ix - 1]
+                    if cell_left:
+                        row_transitions += 1
+                        cell_right = representation[row_ix, col_ix + 1]
+                        if cell_right:
+                            local_well_streak += 1
+                            cumulative_wells += local_well_streak
+                        else:
+                            local_well_streak = 0
+                    else:
+                        local_well_streak = 0
+                if lowest_free_row_left > max_well_possibility:
+                    for row_ix in range(max_well_possibility, lowest_free_row_left):
+                        cell_left = representation[row_ix, col_ix - 1]
+                        if cell_left:
+                            row_transitions += 1
+            elif lowest_free_row_left > lowest_free_row:
+                for row_ix in range(lowest_free_row, lowest_free_row_left):
+                    cell_left = representation[row_ix, col_ix - 1]
+                    if cell_left:
+                        row_transitions += 1
+
+    rows_with_holes_set.remove(1000)
+    rows_with_holes = len(rows_with_holes_set)
+    return np.array([rows_with_holes, col_transitions, holes, landing_height,
+                     cumulative_wells, row_transitions, eroded_piece_cells, hole_depths], dtype=np.float64)
+
+
+@njit(cache=True)
+def clear_lines_in_place(representation, lowest_free_rows, column_masks, changed_lines):
+    """
+    Removes full lines among `changed_lines` (a contiguous range of rows) by moving the rows above down
+    within `representation`. Updates `lowest_free_rows` and `column_masks` in place and returns the boolean
+    full-line indicator.
+    """
+    num_columns = representation.shape[1]
+    num_changed_lines = len(changed_lines)
+    first_changed_line = changed_lines[0]
+    is_full = np.zeros(num_changed_lines, dtype=np.bool_)
+
+    # A row is full iff its bit is set in every column mask.
+    full_rows = ((1 << num_changed_lines) - 1) << first_changed_line
+    for col_ix in range(num_columns):
+        full_rows &= column_masks[col_ix]
+    if full_rows == 0:
+        return is_full
+
+    n_cleared_lines = 0
+    lowest_cleared_row = -1
+    for ix in range(num_changed_lines):
+        if (full_rows >> (first_changed_line + ix)) & 1:
+            is_full[ix] = True
+            n_cleared_lines += 1
+            if lowest_cleared_row < 0:
+                lowest_cleared_row = first_changed_line + ix
+
+    # Compact rows in place (rows above the highest column are empty).
+    max_height = 0
+    for col_ix in range(num_columns):
+        max_height = max(max_height, lowest_free_rows[col_ix])
+    write_ix = lowest_cleared_row
+    for read_ix in range(lowest_cleared_row + 1, max_height):
+        if not (full_rows >> read_ix) & 1:
+            representation[write_ix] = representation[read_ix]
+            write_ix += 1
+    representation[write_ix:max_height] = False
+
+    for col_ix in range(num_columns):
+        mask = column_masks[col_ix]
+        for ix in range(num_changed_lines - 1, -1, -1):
+            if is_full[ix]:
+                row_ix = first_changed_line + ix
+                mask = (mask & ((1 << row_ix) - 1)) | ((mask >> (row_ix + 1)) << row_ix)
+        column_masks[col_ix] = mask
+        # Every cleared row was full in this column, so the column loses at least n_cleared_lines of height.
+        lowest_free_row = lowest_free_rows[col_ix] - n_cleared_lines
+        while lowest_free_row > 0 and not (mask >> (lowest_free_row - 1)) & 1:
+            lowest_free_row -= 1
+        lowest_free_rows[col_ix] = lowest_free_row
+    return is_full
+
+
+@njit(cache=True)
+def column_masks_from_representation(representation, lowest_free_rows):
+    num_columns = representation.shape[1]
+    column_masks = np.zeros(num_columns, dtype=np.int64)
+    for col_ix in range(num_columns):
+        for row_ix in range(lowest_free_rows[col_ix]):
+            if representation[row_ix, col_ix]:
+                column_masks[col_ix] |= 1 << row_ix
+    return column_masks
+
+
+@njit(cache=True)
 def check_terminal(representation, num_rows):
-    is_terminal = False
-    for ix in representation[num_rows]:
-        if ix:
-            is_terminal = True
-            break
-    return is_terminal
+    # Any full cell in the hidden rows.
+    return np.any(representation[num_rows:])
 
 
-@njit(fastmath=True, cache=False)
+@njit(fastmath=True, cache=True)
 def numba_sum_int(int_arr):
     acc = 0
     for i in int_arr:
         acc += i
     return acc
 
-@njit(fastmath=True, cache=False)
+@njit(fastmath=True, cache=True)
 def numba_sum(arr):
     acc = 0.
     for i in arr:
@@ -2,1364 +2,165 @@ import numpy as np
 import numba
 from numba import njit, float64, int64, bool_, int64
 from numba.experimental import jitclass
-from tetris import state
+from tetris import state, bitboard, placements, after_states, hashing, samplers
 from numba.typed import List
 
 
-# TODO: introduce typed list
-
-
 specT = [
     ('current_tetromino', int64),
-    ('tetromino_names', int64[:]),  # numba.types.string[:]
     ('feature_type', numba.types.string),
     ('num_features', int64),
-    ('num_columns', int64)
+    ('num_columns', int64),
+    ('feature_cache', hashing.FeatureCache.class_type.instance_type),
+    ('sampler', samplers.TetrominoSampler.class_type.instance_type),
+    ('num_copies', int64),
+    ('after_states_buffer', after_states.AfterStates.class_type.instance_type)
 ]
 
-
-class TetrominoSamplerRandom:
-    def __init__(self, tetrominos):
-        self.tetrominos = tetrominos
-
-    def next_tetromino(self):
-        return np.random.choice(a=self.tetrominos, size=1)[0]
+# Tetromino indices: 0 "straight", 1 "square", 2 "snaker", 3 "snakel", 4 "t", 5 "rcorner", 6 "lcorner"
 
 
 @jitclass(specT)
 class Tetromino:
-    def __init__(self, feature_type, num_features, num_columns):
+    def __init__(self, feature_type, num_features, num_columns, sampler, feature_cache):
+        # Use make_tetromino() to create a Tetromino with a fresh sampler and a disabled cache.
         assert(feature_type == "bcts")
         self.feature_type = feature_type
         self.num_features = num_features
         self.num_columns = num_columns
-        self.tetromino_names = np.array([0,   # "straight",
-                                         1,   # "square
-                                         2,   # "snaker"
-                                         3,   # "snakel"
-                                         4,   # "t"
-                                         5,   # "rcorner"
-                                         6])  # "lcorner"
-        self.current_tetromino = 0
-        self.next_tetromino()
+        self.feature_cache = feature_cache
+        self.sampler = sampler
+        self.current_tetromino = sampler.current()
+        self.num_copies = 0
+        self.after_states_buffer = after_states.AfterStates(0, num_columns, num_features, feature_type)
+
+    def seed(self, seed, stream):
+        self.sampler.seed(seed, stream)
+        self.current_tetromino = self.sampler.current()
+        self.num_copies = 0
 
     def next_tetromino(self):
-        self.current_tetromino = np.random.choice(self.tetromino_names)
+        self.current_tetromino = self.sampler.next()
+
+    def preview(self):
+        # The next sampler.preview_size tetrominos.
+        return self.sampler.preview()
+
+    def sample_sequences(self, num_sequences, sequence_length):
+        # Pre-generated tetromino sequences (int8) that continue the current one (so they respect bags, histories
+        # and the preview queue), e.g., to reuse the same pieces for every child of a decision.
+        sequences = np.empty((num_sequences, sequence_length), dtype=np.int8)
+        sequence_sampler = self.sampler.split(0)
+        for sequence_ix in range(num_sequences):
+            self.sampler.clone_into(sequence_sampler, self.num_copies)
+            self.num_copies += 1
+            for step in range(sequence_length):
+                sequences[sequence_ix, step] = sequence_sampler.next()
+        return sequences
 
     def copy_with_same_current_tetromino(self):
-        current_tetromino = self.current_tetromino
-        new_tetromino_object = Tetromino(self.feature_type, self.num_features, self.num_columns)
-        new_tetromino_object.current_tetromino = current_tetromino
+        # The n-th copy draws from sub-stream n of this generator.
+        new_tetromino_object = self.split(self.num_copies)
+        self.num_copies += 1
+        return new_tetromino_object
+
+    def copy_into(self, other):
+        # copy_with_same_current_tetromino() into an existing Tetromino (see clone_into()).
+        self.clone_into(other, self.num_copies)
+        self.num_copies += 1
+
+    def split(self, stream_ix):
+        # Copy with the same current tetromino (and preview queue) whose future pieces come from sub-stream
+        # `stream_ix` of this generator (independent of how many pieces have been drawn), e.g., one stream per
+        # child and rollout. The feature cache is shared (it is not thread-safe: copies used by parallel threads need
+        # their own, or a disabled one).
+        new_tetromino_object = Tetromino(self.feature_type, self.num_features, self.num_columns,
+                                         self.sampler.split(stream_ix), self.feature_cache)
+        new_tetromino_object.current_tetromino = self.current_tetromino
         return new_tetromino_object
 
+    def clone_into(self, other, stream_ix):
+        # Turns `other` into split(stream_ix) in place, keeping its AfterStates buffer, so that a worker or thread
+        # can reuse one Tetromino for all of its rollouts.
+        self.sampler.clone_into(other.sampler, stream_ix)
+        other.current_tetromino = self.current_tetromino
+        other.feature_cache = self.feature_cache
+        other.num_copies = 0
+
+    def use_feature_cache(self, capacity):
+        # After-state results are cached by board hash and placement (capacity 0 disables the cache).
+        # The cache is shared with all copies made by copy_with_same_current_tetromino(), split() and clone_into().
+        self.feature_cache = hashing.FeatureCache(capacity, self.num_features, 4)
+
+    def get_after_states_buffer(self, num_rows):
+        # Persistent after_states.AfterStates buffer of this Tetromino (not shared with its copies), reallocated only
+        # when the board height changes. Every fill() overwrites it.
+        if self.after_states_buffer.num_rows != num_rows:
+            self.after_states_buffer = after_states.AfterStates(num_rows, self.num_columns, self.num_features,
+                                                                self.feature_type)
+        return self.after_states_buffer
+
+    def fill_after_states(self, current_state, after_states_buffer):
+        # Writes the non-terminal after-states into a preallocated after_states.AfterStates buffer
+        # (reused across calls) and returns their number.
+        return after_states_buffer.fill(current_state, self.current_tetromino, self.feature_cache)
+
+    def get_after_state_features(self, current_state):
+        # Features of all non-terminal after-states, without constructing State objects.
+        # Returns (features, placements) where placements[i] = (col_ix, rot, anchor_row);
+        # use get_after_state() to materialize the chosen placement. Both are views into get_after_states_buffer(),
+        # valid until the next call.
+        after_states_buffer = self.get_after_states_buffer(current_state.num_rows)
+        num_after_states = after_states_buffer.fill(current_state, self.current_tetromino, self.feature_cache)
+        return (after_states_buffer.features[:num_after_states],
+                after_states_buffer.placements[:num_after_states])
+
+    def get_after_state(self, current_state, placement):
+        # Materializes the after-state of a single placement (col_ix, rot, anchor_row).
+        tetromino_index = self.current_tetromino
+        if isinstance(current_state, bitboard.BitboardState):
+            return bitboard.get_bitboard_after_state(current_state, tetromino_index, placement)
+        col_ix, rot, anchor_row = placement
+        # Overlapping fields end up in the hidden rows (and could possibly be removed by clear_lines(), making it a legal move).
+        new_representation = current_state.representation.copy()
+        new_lowest_free_rows = current_state.lowest_free_rows.copy()
+        new_column_masks = current_state.column_masks.copy()
+        placements.stamp_piece(new_representation, new_lowest_free_rows, new_column_masks,
+                               tetromino_index, rot, col_ix, anchor_row)
+        num_changed_lines = placements.PIECE_NUM_CHANGED_LINES[tetromino_index, rot]
+        return state.State(new_representation,
+                           new_lowest_free_rows,
+                           new_column_masks,
+                           current_state.board_hash ^ hashing.piece_hash(tetromino_index, rot, col_ix, anchor_row),
+                           np.arange(anchor_row, anchor_row + num_changed_lines, 1, np.int64),
+                           placements.PIECE_PIECES_PER_CHANGED_ROW[tetromino_index, rot, :num_changed_lines].copy(),
+                           placements.PIECE_LANDING_HEIGHT_BONUS[tetromino_index, rot],
+                           self.num_features,
+                           self.feature_type,
+                           False)
+
     def get_after_states(self, current_state):
         # This version of get_after_states() reintroduces the possibility that
         # a tetromino is placed such it is legal AFTER lines are cleared (but not BEFORE).
-
-        after_states = []
-
-        if self.current_tetromino == 0:
-            # STRAIGHT
-            # Vertical placements
-            for col_ix, free_pos in enumerate(current_state.lowest_free_rows):
-                anchor_row = free_pos
-                if not anchor_row + 4 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] += 4
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row:(anchor_row + 4), col_ix] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 4, 1, np.int64),
-                                            np.array([1, 1, 1, 1], dtype=np.int64),
-                                            1.5,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:  # has overlapping fields
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] += 4
-                    # Add four lines to allow for overlapping fields (which could possibly be removed by clear_lines(), making it a legal move)
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row:(anchor_row + 4), col_ix] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 4, 1, np.int64),
-                                            np.array([1, 1, 1, 1], dtype=np.int64),
-                                            1.5,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True  # =
-                                            )
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-
-                # Horizontal placements
-                if col_ix < self.num_columns - 3:
-                    anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 4)])
-                    if not anchor_row + 1 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix:(col_ix + 4)] = anchor_row + 1
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row, col_ix:(col_ix + 4)] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([4], dtype=np.int64),
-                                                0,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix:(col_ix + 4)] = anchor_row + 1
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row, col_ix:(col_ix + 4)] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([4], dtype=np.int64),
-                                                0,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-        elif self.current_tetromino == 1:
-            # SQUARE
-            # Horizontal placements
-            max_col_index = self.num_columns - 1
-            for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-                anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)])
-                if not anchor_row + 2 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 2
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row:(anchor_row + 2), col_ix:(col_ix + 2)] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([2, 2], dtype=np.int64),
-                                            0.5,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 2
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row:(anchor_row + 2), col_ix:(col_ix + 2)] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([2, 2], dtype=np.int64),
-                                            0.5,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-        elif self.current_tetromino == 2:
-            # SNAKER
-            # Vertical placements
-            max_col_index = self.num_columns - 1
-            for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-                anchor_row = np.maximum(current_state.lowest_free_rows[col_ix] - 1, current_state.lowest_free_rows[col_ix + 1])
-                if not anchor_row + 3 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 3
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-                    new_representation = current_state.representation.copy()
-                    new_representation[(anchor_row + 1):(anchor_row + 3), col_ix] = 1
-                    new_representation[anchor_row:(anchor_row + 2), col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            # np.arange(col_ix, col_ix + 2, 1, np.int64),
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 3
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[(anchor_row + 1):(anchor_row + 3), col_ix] = 1
-                    new_representation[anchor_row:(anchor_row + 2), col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            # np.arange(col_ix, col_ix + 2, 1, np.int64),
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-                # Horizontal placements
-                # max_col_index = self.num_columns - 2
-                # for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-                if col_ix < self.num_columns - 2:
-                    anchor_row = np.maximum(np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)]),
-                                            current_state.lowest_free_rows[col_ix + 2] - 1)
-                    if not anchor_row + 2 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix] = anchor_row + 1
-                        new_lowest_free_rows[(col_ix + 1):(col_ix + 3)] = anchor_row + 2
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row, col_ix:(col_ix + 2)] = 1
-                        new_representation[anchor_row + 1, (col_ix + 1):(col_ix + 3)] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([2], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix] = anchor_row + 1
-                        new_lowest_free_rows[(col_ix + 1):(col_ix + 3)] = anchor_row + 2
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row, col_ix:(col_ix + 2)] = 1
-                        new_representation[anchor_row + 1, (col_ix + 1):(col_ix + 3)] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([2], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-
-        elif self.current_tetromino == 3:
-            # SNAKEL
-            # Vertical placements
-            max_col_index = self.num_columns - 1
-            for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-                anchor_row = np.maximum(current_state.lowest_free_rows[col_ix], current_state.lowest_free_rows[col_ix + 1] - 1)
-                if not anchor_row + 3 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 2
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row:(anchor_row + 2), col_ix] = 1
-                    new_representation[(anchor_row + 1):(anchor_row + 3), col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 2
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row:(anchor_row + 2), col_ix] = 1
-                    new_representation[(anchor_row + 1):(anchor_row + 3), col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-                ## Horizontal placements
-                if col_ix < self.num_columns - 2:
-                    anchor_row = np.maximum(current_state.lowest_free_rows[col_ix] - 1,
-                                            np.max(current_state.lowest_free_rows[(col_ix + 1):(col_ix + 3)]))
-                    if not anchor_row + 2 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 2
-                        new_lowest_free_rows[col_ix + 2] = anchor_row + 1
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row, (col_ix + 1):(col_ix + 3)] = 1
-                        new_representation[anchor_row + 1, col_ix:(col_ix + 2)] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([2], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 2
-                        new_lowest_free_rows[col_ix + 2] = anchor_row + 1
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row, (col_ix + 1):(col_ix + 3)] = 1
-                        new_representation[anchor_row + 1, col_ix:(col_ix + 2)] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([2], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-        elif self.current_tetromino == 4:
-            # T
-
-            # Vertical placements.
-            max_col_index = self.num_columns - 1
-            for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-                # Single cell on left
-                anchor_row = np.maximum(current_state.lowest_free_rows[col_ix] - 1, current_state.lowest_free_rows[col_ix + 1])
-                if not anchor_row + 3 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 2
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row + 1, col_ix] = 1
-                    new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 2
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row + 1, col_ix] = 1
-                    new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-                # Single cell on right
-                anchor_row = np.maximum(current_state.lowest_free_rows[col_ix], current_state.lowest_free_rows[col_ix + 1] - 1)
-                if not anchor_row + 3 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 3
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-                    new_representation[anchor_row + 1, col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 3
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-                    new_representation[anchor_row + 1, col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                            np.array([1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-                if col_ix < self.num_columns - 2:
-                    # upside-down T
-                    anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 3)])
-                    if not anchor_row + 2 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix] = anchor_row + 1
-                        new_lowest_free_rows[col_ix + 2] = anchor_row + 1
-                        new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row + 1, col_ix + 1] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix] = anchor_row + 1
-                        new_lowest_free_rows[col_ix + 2] = anchor_row + 1
-                        new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row + 1, col_ix + 1] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-
-                    # T
-                    anchor_row = np.maximum(current_state.lowest_free_rows[col_ix + 1],
-                                            np.maximum(current_state.lowest_free_rows[col_ix],
-                                                       current_state.lowest_free_rows[col_ix + 2]) - 1)
-                    if not anchor_row + 2 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row, col_ix + 1] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                                np.array([1, 3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row, col_ix + 1] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                                np.array([1, 3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-        elif self.current_tetromino == 5:
-            # RCorner
-
-            # Vertical placements.
-            max_col_index = self.num_columns - 1
-            for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-                # Top-right corner
-                anchor_row = np.maximum(current_state.lowest_free_rows[col_ix] - 2, current_state.lowest_free_rows[col_ix + 1])
-                if not anchor_row + 3 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix: (col_ix + 2)] = anchor_row + 3
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row + 2, col_ix] = 1
-                    new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 3, 1, np.int64),
-                                            np.array([1, 1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix: (col_ix + 2)] = anchor_row + 3
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row + 2, col_ix] = 1
-                    new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 3, 1, np.int64),
-                                            np.array([1, 1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-                # Bottom-left corner
-                anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)])
-                if not anchor_row + 3 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 3
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 1
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-                    new_representation[anchor_row, col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                            np.array([2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix] = anchor_row + 3
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 1
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-                    new_representation[anchor_row, col_ix + 1] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                            np.array([2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-                if col_ix < self.num_columns - 2:
-                    # Bottom-right corner
-                    anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 3)])
-                    if not anchor_row + 2 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 1
-                        new_lowest_free_rows[col_ix + 2] = anchor_row + 2
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row + 1, col_ix + 2] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 1
-                        new_lowest_free_rows[col_ix + 2] = anchor_row + 2
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row + 1, col_ix + 2] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-
-                    # Top-left corner
-                    anchor_row = np.maximum(current_state.lowest_free_rows[col_ix],
-                                            np.max(current_state.lowest_free_rows[(col_ix + 1):(col_ix + 3)]) - 1)
-                    if not anchor_row + 2 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row, col_ix] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                                np.array([1, 3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row, col_ix] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                                np.array([1, 3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-
-        elif self.current_tetromino == 6:
-            # LCorner
-            # Vertical placements. 'height' becomes 'width' :)
-            max_col_index = self.num_columns - 1
-            for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-                # Top-left corner
-                anchor_row = np.maximum(current_state.lowest_free_rows[col_ix], current_state.lowest_free_rows[col_ix + 1] - 2)
-                if not anchor_row + 3 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix: (col_ix + 2)] = anchor_row + 3
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row + 2, col_ix + 1] = 1
-                    new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 3, 1, np.int64),
-                                            np.array([1, 1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix: (col_ix + 2)] = anchor_row + 3
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row + 2, col_ix + 1] = 1
-                    new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 3, 1, np.int64),
-                                            np.array([1, 1, 2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-                # Bottom-right corner
-                anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)])
-                if not anchor_row + 3 > current_state.num_rows:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-                    new_lowest_free_rows[col_ix] = anchor_row + 1
-                    new_representation = current_state.representation.copy()
-                    new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-                    new_representation[anchor_row, col_ix] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                            np.array([2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            False)
-                    after_states.append(new_state)
-                else:
-                    new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                    new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-                    new_lowest_free_rows[col_ix] = anchor_row + 1
-                    new_representation = np.vstack((current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                    new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-                    new_representation[anchor_row, col_ix] = 1
-                    new_state = state.State(new_representation,
-                                            new_lowest_free_rows,
-                                            np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                            np.array([2], dtype=np.int64),
-                                            1,
-                                            self.num_features,
-                                            self.feature_type,
-                                            False,
-                                            True)
-                    if not new_state.terminal_state:
-                        after_states.append(new_state)
-
-                if col_ix < self.num_columns - 2:
-                    # Bottom-left corner (= 'hole' in top-right corner)
-                    anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 3)])
-                    if not anchor_row + 2 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix] = anchor_row + 2
-                        new_lowest_free_rows[(col_ix + 1):(col_ix + 3)] = anchor_row + 1
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row + 1, col_ix] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix] = anchor_row + 2
-                        new_lowest_free_rows[(col_ix + 1):(col_ix + 3)] = anchor_row + 1
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row + 1, col_ix] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-                                                np.array([3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-
-                    # Top-right corner
-                    anchor_row = np.maximum(np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)]) - 1,
-                                            current_state.lowest_free_rows[col_ix + 2])
-                    if not anchor_row + 2 > current_state.num_rows:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-                        new_representation = current_state.representation.copy()
-                        new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row, col_ix + 2] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                                np.array([1, 3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                False)
-                        after_states.append(new_state)
-                    else:
-                        new_lowest_free_rows = current_state.lowest_free_rows.copy()
-                        new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-                        new_representation = np.vstack(
-                            (current_state.representation.copy(), np.zeros((4, self.num_columns), dtype=np.bool_)))
-                        new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-                        new_representation[anchor_row, col_ix + 2] = 1
-                        new_state = state.State(new_representation,
-                                                new_lowest_free_rows,
-                                                np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-                                                np.array([1, 3], dtype=np.int64),
-                                                0.5,
-                                                self.num_features,
-                                                self.feature_type,
-                                                False,
-                                                True)
-                        if not new_state.terminal_state:
-                            after_states.append(new_state)
-        else:
+        # Placements are generated from the tables in tetris.placements. A bitboard.BitboardState has
+        # BitboardState children.
+        if self.current_tetromino < 0 or self.current_tetromino >= len(placements.PIECE_NUM_ROTATIONS):
             raise ValueError("wrong current tetromino!")
+        if isinstance(current_state, bitboard.BitboardState):
+            return bitboard.get_bitboard_after_states(current_state, self.current_tetromino)
 
+        after_states = []
+        current_placements = placements.get_placements(current_state.lowest_free_rows, self.current_tetromino)
+        for ix in range(len(current_placements)):
+            new_state = self.get_after_state(current_state, current_placements[ix])
+            if not new_state.terminal_state:
+                after_states.append(new_state)
         return after_states
 
-    # def get_after_states(self, current_state):
-    #     # after_states = List()
-    #     after_states = []
-    #
-    #     if self.current_tetromino == 0:
-    #         # STRAIGHT
-    #         # Vertical placements
-    #         for col_ix, free_pos in enumerate(current_state.lowest_free_rows):
-    #             anchor_row = free_pos
-    #             if not anchor_row + 4 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix] += 4
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row:(anchor_row + 4), col_ix] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         np.arange(anchor_row, anchor_row + 4, 1, np.int64),
-    #                                         np.array([1, 1, 1, 1], dtype=np.int64),
-    #                                         1.5,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #                 after_states.append(new_state)
-    #
-    #             # Horizontal placements
-    #             if col_ix < self.num_columns - 3:
-    #             # max_col_index = self.num_columns - 3
-    #             # for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #                 anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 4)])
-    #                 if not anchor_row + 1 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     new_lowest_free_rows[col_ix:(col_ix + 4)] = anchor_row + 1
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row, col_ix:(col_ix + 4)] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 4, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-    #                                             np.array([4], dtype=np.int64),
-    #                                             0,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #                                             # current_state.col_transitions_per_col,
-    #                                             # current_state.row_transitions_per_col,
-    #                                             # current_state.array_of_rows_with_holes,
-    #                                             # current_state.holes_per_col,
-    #                                             # current_state.hole_depths_per_col,
-    #                                             # current_state.cumulative_wells_per_col)
-    #                     after_states.append(new_state)
-    #     elif self.current_tetromino == 1:
-    #         # SQUARE
-    #         # Horizontal placements
-    #         max_col_index = self.num_columns - 1
-    #         for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #             anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)])
-    #             if not anchor_row + 2 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 2
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row:(anchor_row + 2), col_ix:(col_ix + 2)] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-    #                                         np.array([2, 2], dtype=np.int64),
-    #                                         0.5,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col
-    #                 # )
-    #                 after_states.append(new_state)
-    #     elif self.current_tetromino == 2:
-    #         # SNAKER
-    #         # Vertical placements
-    #         max_col_index = self.num_columns - 1
-    #         for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #             anchor_row = np.maximum(current_state.lowest_free_rows[col_ix] - 1, current_state.lowest_free_rows[col_ix + 1])
-    #             if not anchor_row + 3 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix] = anchor_row + 3
-    #                 new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[(anchor_row + 1):(anchor_row + 3), col_ix] = 1
-    #                 new_representation[anchor_row:(anchor_row + 2), col_ix + 1] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-    #                                         np.array([1, 2], dtype=np.int64),
-    #                                         1,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col)
-    #                 after_states.append(new_state)
-    #
-    #             # Horizontal placements
-    #             # max_col_index = self.num_columns - 2
-    #             # for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #             if col_ix < self.num_columns - 2:
-    #                 anchor_row = np.maximum(np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)]),
-    #                                         current_state.lowest_free_rows[col_ix + 2] - 1)
-    #                 if not anchor_row + 2 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     new_lowest_free_rows[col_ix] = anchor_row + 1
-    #                     new_lowest_free_rows[(col_ix + 1):(col_ix + 3)] = anchor_row + 2
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row, col_ix:(col_ix + 2)] = 1
-    #                     new_representation[anchor_row + 1, (col_ix + 1):(col_ix + 3)] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 3, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-    #                                             np.array([2], dtype=np.int64),
-    #                                             0.5,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #
-    #                     # current_state.col_transitions_per_col,
-    #                     # current_state.row_transitions_per_col,
-    #                     # current_state.array_of_rows_with_holes,
-    #                     # current_state.holes_per_col,
-    #                     # current_state.hole_depths_per_col,
-    #                     # current_state.cumulative_wells_per_col)
-    #                     after_states.append(new_state)
-    #     elif self.current_tetromino == 3:
-    #         # SNAKEL
-    #         # Vertical placements
-    #         max_col_index = self.num_columns - 1
-    #         for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #             anchor_row = np.maximum(current_state.lowest_free_rows[col_ix], current_state.lowest_free_rows[col_ix + 1] - 1)
-    #             if not anchor_row + 3 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix] = anchor_row + 2
-    #                 new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row:(anchor_row + 2), col_ix] = 1
-    #                 new_representation[(anchor_row + 1):(anchor_row + 3), col_ix + 1] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-    #                                         np.array([1, 2], dtype=np.int64),
-    #                                         1,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col)
-    #                 after_states.append(new_state)
-    #
-    #             ## Horizontal placements
-    #             # max_col_index = self.num_columns - 2
-    #             # for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #             if col_ix < self.num_columns - 2:
-    #                 anchor_row = np.maximum(current_state.lowest_free_rows[col_ix] - 1,
-    #                                         np.max(current_state.lowest_free_rows[(col_ix + 1):(col_ix + 3)]))
-    #                 if not anchor_row + 2 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 2
-    #                     new_lowest_free_rows[col_ix + 2] = anchor_row + 1
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row, (col_ix + 1):(col_ix + 3)] = 1
-    #                     new_representation[anchor_row + 1, col_ix:(col_ix + 2)] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 3, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-    #                                             np.array([2], dtype=np.int64),
-    #                                             0.5,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #
-    #                     # current_state.col_transitions_per_col,
-    #                     # current_state.row_transitions_per_col,
-    #                     # current_state.array_of_rows_with_holes,
-    #                     # current_state.holes_per_col,
-    #                     # current_state.hole_depths_per_col,
-    #                     # current_state.cumulative_wells_per_col)
-    #                     after_states.append(new_state)
-    #     elif self.current_tetromino == 4:
-    #         # T
-    #
-    #         # Vertical placements.
-    #         max_col_index = self.num_columns - 1
-    #         for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #             # Single cell on left
-    #             anchor_row = np.maximum(current_state.lowest_free_rows[col_ix] - 1, current_state.lowest_free_rows[col_ix + 1])
-    #             if not anchor_row + 3 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix] = anchor_row + 2
-    #                 new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row + 1, col_ix] = 1
-    #                 new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-    #                                         np.array([1, 2], dtype=np.int64),
-    #                                         1,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col)
-    #                 after_states.append(new_state)
-    #
-    #             # Single cell on right
-    #             anchor_row = np.maximum(current_state.lowest_free_rows[col_ix], current_state.lowest_free_rows[col_ix + 1] - 1)
-    #             if not anchor_row + 3 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix] = anchor_row + 3
-    #                 new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-    #                 new_representation[anchor_row + 1, col_ix + 1] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-    #                                         np.array([1, 2], dtype=np.int64),
-    #                                         1,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col)
-    #                 after_states.append(new_state)
-    #
-    #             if col_ix < self.num_columns - 2:
-    #                 # Horizontal placements
-    #                 # max_col_index = self.num_columns - 2
-    #                 # for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #                 # upside-down T
-    #                 anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 3)])
-    #                 if not anchor_row + 2 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     # new_lowest_free_rows[[col_ix, col_ix + 2]] = anchor_row + 1
-    #                     new_lowest_free_rows[col_ix] = anchor_row + 1
-    #                     new_lowest_free_rows[col_ix + 2] = anchor_row + 1
-    #                     new_lowest_free_rows[col_ix + 1] = anchor_row + 2
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-    #                     new_representation[anchor_row + 1, col_ix + 1] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 3, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-    #                                             np.array([3], dtype=np.int64),
-    #                                             0.5,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #
-    #                     # current_state.col_transitions_per_col,
-    #                     # current_state.row_transitions_per_col,
-    #                     # current_state.array_of_rows_with_holes,
-    #                     # current_state.holes_per_col,
-    #                     # current_state.hole_depths_per_col,
-    #                     # current_state.cumulative_wells_per_col)
-    #                     after_states.append(new_state)
-    #
-    #                 # T
-    #                 # anchor_row = np.maximum(current_state.lowest_free_rows[col_ix + 1], np.max(current_state.lowest_free_rows[[col_ix, col_ix + 2]]) - 1)
-    #                 anchor_row = np.maximum(current_state.lowest_free_rows[col_ix + 1],
-    #                                         np.maximum(current_state.lowest_free_rows[col_ix],
-    #                                                    current_state.lowest_free_rows[col_ix + 2]) - 1)
-    #                 if not anchor_row + 2 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-    #                     new_representation[anchor_row, col_ix + 1] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 3, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-    #                                             np.array([1, 3], dtype=np.int64),
-    #                                             0.5,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #
-    #                     # current_state.col_transitions_per_col,
-    #                     # current_state.row_transitions_per_col,
-    #                     # current_state.array_of_rows_with_holes,
-    #                     # current_state.holes_per_col,
-    #                     # current_state.hole_depths_per_col,
-    #                     # current_state.cumulative_wells_per_col)
-    #                     after_states.append(new_state)
-    #     elif self.current_tetromino == 5:
-    #         # RCorner
-    #
-    #         # Vertical placements.
-    #         max_col_index = self.num_columns - 1
-    #         for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #             # Top-right corner
-    #             anchor_row = np.maximum(current_state.lowest_free_rows[col_ix] - 2, current_state.lowest_free_rows[col_ix + 1])
-    #             if not anchor_row + 3 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix: (col_ix + 2)] = anchor_row + 3
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row + 2, col_ix] = 1
-    #                 new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 3, 1, np.int64),
-    #                                         np.array([1, 1, 2], dtype=np.int64),
-    #                                         1,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col)
-    #                 after_states.append(new_state)
-    #
-    #             # Bottom-left corner
-    #             anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)])
-    #             if not anchor_row + 3 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix] = anchor_row + 3
-    #                 new_lowest_free_rows[col_ix + 1] = anchor_row + 1
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-    #                 new_representation[anchor_row, col_ix + 1] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-    #                                         np.array([2], dtype=np.int64),
-    #                                         1,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col)
-    #                 after_states.append(new_state)
-    #
-    #             if col_ix < self.num_columns - 2:
-    #                 # Horizontal placements
-    #                 # max_col_index = self.num_columns - 2
-    #                 # for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #                 # Bottom-right corner
-    #                 anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 3)])
-    #                 if not anchor_row + 2 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     new_lowest_free_rows[col_ix:(col_ix + 2)] = anchor_row + 1
-    #                     new_lowest_free_rows[col_ix + 2] = anchor_row + 2
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-    #                     new_representation[anchor_row + 1, col_ix + 2] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 3, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-    #                                             np.array([3], dtype=np.int64),
-    #                                             0.5,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #                     after_states.append(new_state)
-    #
-    #                 # Top-left corner
-    #                 anchor_row = np.maximum(current_state.lowest_free_rows[col_ix],
-    #                                         np.max(current_state.lowest_free_rows[(col_ix + 1):(col_ix + 3)]) - 1)
-    #                 if not anchor_row + 2 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-    #                     new_representation[anchor_row, col_ix] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 3, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-    #                                             np.array([1, 3], dtype=np.int64),
-    #                                             0.5,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #                     after_states.append(new_state)
-    #
-    #     elif self.current_tetromino == 6:
-    #         # LCorner
-    #         # Vertical placements. 'height' becomes 'width' :)
-    #         max_col_index = self.num_columns - 1
-    #         for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #             # Top-left corner
-    #             anchor_row = np.maximum(current_state.lowest_free_rows[col_ix], current_state.lowest_free_rows[col_ix + 1] - 2)
-    #             if not anchor_row + 3 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix: (col_ix + 2)] = anchor_row + 3
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row + 2, col_ix + 1] = 1
-    #                 new_representation[anchor_row:(anchor_row + 3), col_ix] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 3, 1, np.int64),
-    #                                         np.array([1, 1, 2], dtype=np.int64),
-    #                                         1,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col)
-    #                 after_states.append(new_state)
-    #
-    #             # Bottom-right corner
-    #             anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)])
-    #             if not anchor_row + 3 > current_state.num_rows:
-    #                 new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                 new_lowest_free_rows[col_ix + 1] = anchor_row + 3
-    #                 new_lowest_free_rows[col_ix] = anchor_row + 1
-    #                 new_representation = current_state.representation.copy()
-    #                 new_representation[anchor_row:(anchor_row + 3), col_ix + 1] = 1
-    #                 new_representation[anchor_row, col_ix] = 1
-    #                 new_state = state.State(new_representation,
-    #                                         new_lowest_free_rows,
-    #                                         # np.arange(col_ix, col_ix + 2, 1, np.int64),
-    #                                         np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-    #                                         np.array([2], dtype=np.int64),
-    #                                         1,
-    #                                         self.num_features,
-    #                                         self.feature_type,
-    #                                         False)
-    #
-    #                 # current_state.col_transitions_per_col,
-    #                 # current_state.row_transitions_per_col,
-    #                 # current_state.array_of_rows_with_holes,
-    #                 # current_state.holes_per_col,
-    #                 # current_state.hole_depths_per_col,
-    #                 # current_state.cumulative_wells_per_col)
-    #                 after_states.append(new_state)
-    #
-    #             if col_ix < self.num_columns - 2:
-    #
-    #                 # max_col_index = self.num_columns - 2
-    #                 # for col_ix, free_pos in enumerate(current_state.lowest_free_rows[:max_col_index]):
-    #                 # Bottom-left corner (= 'hole' in top-right corner)
-    #                 anchor_row = np.max(current_state.lowest_free_rows[col_ix:(col_ix + 3)])
-    #                 if not anchor_row + 2 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     new_lowest_free_rows[col_ix] = anchor_row + 2
-    #                     new_lowest_free_rows[(col_ix + 1):(col_ix + 3)] = anchor_row + 1
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row, col_ix:(col_ix + 3)] = 1
-    #                     new_representation[anchor_row + 1, col_ix] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 3, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 1, 1, np.int64),
-    #                                             np.array([3], dtype=np.int64),
-    #                                             0.5,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #                     # current_state.col_transitions_per_col,
-    #                     # current_state.row_transitions_per_col,
-    #                     # current_state.array_of_rows_with_holes,
-    #                     # current_state.holes_per_col,
-    #                     # current_state.hole_depths_per_col,
-    #                     # current_state.cumulative_wells_per_col)
-    #                     after_states.append(new_state)
-    #
-    #                 # Top-right corner
-    #                 anchor_row = np.maximum(np.max(current_state.lowest_free_rows[col_ix:(col_ix + 2)]) - 1,
-    #                                         current_state.lowest_free_rows[col_ix + 2])
-    #                 if not anchor_row + 2 > current_state.num_rows:
-    #                     new_lowest_free_rows = current_state.lowest_free_rows.copy()
-    #                     new_lowest_free_rows[col_ix: (col_ix + 3)] = anchor_row + 2
-    #                     new_representation = current_state.representation.copy()
-    #                     new_representation[anchor_row + 1, col_ix:(col_ix + 3)] = 1
-    #                     new_representation[anchor_row, col_ix + 2] = 1
-    #                     new_state = state.State(new_representation,
-    #                                             new_lowest_free_rows,
-    #                                             # np.arange(col_ix, col_ix + 3, 1, np.int64),
-    #                                             np.arange(anchor_row, anchor_row + 2, 1, np.int64),
-    #                                             np.array([1, 3], dtype=np.int64),
-    #                                             0.5,
-    #                                             self.num_features,
-    #                                             self.feature_type,
-    #                                             False)
-    #
-    #                     # current_state.col_transitions_per_col,
-    #                     # current_state.row_transitions_per_col,
-    #                     # current_state.array_of_rows_with_holes,
-    #                     # current_state.holes_per_col,
-    #                     # current_state.hole_depths_per_col,
-    #                     # current_state.cumulative_wells_per_col)
-    #                     after_states.append(new_state)
-    #     else:
-    #         raise ValueError("wrong current tetromino!")
-    #
-    #     return after_states
 
+@njit(cache=False)
+def make_tetromino(feature_type, num_features, num_columns, sampler_type, preview_size, seed, stream):
+    # Tetromino with a fresh sampler on stream `stream` of `seed` (see Tetromino.seed()) and a disabled cache.
+    sampler = samplers.make_sampler(sampler_type, preview_size, seed, stream)
+    return Tetromino(feature_type, num_features, num_columns, sampler,
+                     hashing.FeatureCache(0, num_features, 4))  # disabled, see use_feature_cache()
@@ -0,0 +1,157 @@
+"""
+Many Tetris games in lock-step.
+
+VecTetris holds B games in contiguous arrays (boards, column heights, column masks, board hashes, current tetrominos,
+cleared lines and done flags) instead of B Tetris/State objects. step() advances every live game by one greedy
+move (argmax of features.dot(weights), ties broken at random like agents.constant_agent.ConstantAgent) for a
+(B x num_features) batch of policy weights; games are stepped in parallel (prange), each with its own
+after_states.AfterStates buffer and rng.CounterRNG stream (so results do not depend on the number of threads).
+A game is done when no non-terminal placement is left or when it has cleared more than max_cleared_test_lines
+lines; done games are skipped until reset().
+"""
+
+import numpy as np
+import numba
+from numba import njit, prange, bool_, int64
+from numba.experimental import jitclass
+from numba.typed import List
+from tetris import state, placements, after_states, hashing, rng
+
+specVecTetris = [
+    ('num_games', int64),
+    ('num_columns', int64),
+    ('num_rows', int64),
+    ('num_features', int64),
+    ('feature_type', numba.types.string),
+    ('max_cleared_test_lines', int64),
+    ('representations', bool_[:, :, :]),
+    ('lowest_free_rows', int64[:, :]),
+    ('column_masks', int64[:, :]),
+    ('board_hashes', int64[:]),
+    ('current_tetrominos', int64[:]),
+    ('cleared_lines', int64[:]),
+    ('done', bool_[:]),
+    ('num_steps', int64),
+    ('rngs', numba.types.ListType(rng.CounterRNG.class_type.instance_type)),
+    ('after_states_buffers', numba.types.ListType(after_states.AfterStates.class_type.instance_type)),
+    ('feature_cache', hashing.FeatureCache.class_type.instance_type)
+]
+
+
+@jitclass(specVecTetris)
+class VecTetris:
+    def __init__(self, num_games, num_columns, num_rows, max_cleared_test_lines, num_features):
+        assert num_rows + state.NUM_HIDDEN_ROWS <= state.MAX_NUM_ROWS_TOTAL, "Too many rows."
+        self.num_games = num_games
+        self.num_columns = num_columns
+        self.num_rows = num_rows
+        self.num_features = num_features
+        self.feature_type = "bcts"
+        self.max_cleared_test_lines = max_cleared_test_lines
+        self.representations = np.zeros((num_games, num_rows + state.NUM_HIDDEN_ROWS, num_columns), dtype=np.bool_)
+        self.lowest_free_rows = np.zeros((num_games, num_columns), dtype=np.int64)
+        self.column_masks = np.zeros((num_games, num_columns), dtype=np.int64)
+        self.board_hashes = np.zeros(num_games, dtype=np.int64)
+        self.current_tetrominos = np.zeros(num_games, dtype=np.int64)
+        self.cleared_lines = np.zeros(num_games, dtype=np.int64)
+        self.done = np.zeros(num_games, dtype=np.bool_)
+        self.num_steps = 0
+        buffers = List()
+        for _ in range(num_games):
+            buffers.append(after_states.AfterStates(num_rows, num_columns, num_features, self.feature_type))
+        self.after_states_buffers = buffers
+        rngs = List()
+        for _ in range(num_games):
+            rngs.append(rng.CounterRNG(0, 0))
+        self.rngs = rngs
+        self.seed(np.random.randint(0, 2 ** 62))
+        # Games run in parallel, so they must not share a (mutable) cache.
+        self.feature_cache = hashing.FeatureCache(0, num_features, 4)
+        self.reset()
+
+    def seed(self, seed):
+        # Game b draws from sub-stream b of the generator keyed by `seed`.
+        base_rng = rng.CounterRNG(seed, 0)
+        for game_ix in range(self.num_games):
+            self.rngs[game_ix] = base_rng.split(game_ix)
+
+    def reset(self):
+        self.representations[:] = False
+        self.lowest_free_rows[:] = 0
+        self.column_masks[:] = 0
+        self.board_hashes[:] = 0
+        self.cleared_lines[:] = 0
+        self.done[:] = False
+        self.num_steps = 0
+        for game_ix in range(self.num_games):
+            self.current_tetrominos[game_ix] = self.rngs[game_ix].randint(len(placements.PIECE_NUM_ROTATIONS))
+
+    def num_live_games(self):
+        return self.num_games - np.sum(self.done)
+
+    def step(self, policy_weights):
+        # Makes one move in every live game (policy_weights[b] is used in game b) and returns the number of
+        # games that are still live.
+        if policy_weights.shape[0] != self.num_games or policy_weights.shape[1] != self.num_features:
+            raise ValueError("policy_weights must be of shape (num_games, num_features).")
+        step_games(self.representations, self.lowest_free_rows, self.column_masks, self.board_hashes,
+                   self.current_tetrominos, self.cleared_lines, self.done, policy_weights,
+                   self.after_states_buffers, self.rngs, self.feature_cache, self.max_cleared_test_lines)
+        self.num_steps += 1
+        return self.num_live_games()
+
+    def play(self, policy_weights):
+        # Plays all games until they are done and returns the cleared lines per game.
+        self.reset()
+        while self.step(policy_weights) > 0:
+            pass
+        return self.cleared_lines.copy()
+
+
+@njit(cache=False, parallel=True)
+def step_games(representations, lowest_free_rows, column_masks, board_hashes, current_tetrominos,
+               cleared_lines, done, policy_weights, after_states_buffers, rngs, feature_cache, max_cleared_test_lines):
+    num_tetrominos = len(placements.PIECE_NUM_ROTATIONS)
+    for game_ix in prange(len(done)):
+        if done[game_ix]:
+            continue
+        buffer = after_states_buffers[game_ix]
+        num_after_states = buffer.fill_from_arrays(representations[game_ix], lowest_free_rows[game_ix],
+                                                   column_masks[game_ix], board_hashes[game_ix],
+                                                   current_tetrominos[game_ix], feature_cache)
+        if num_after_states == 0:
+            done[game_ix] = True
+            continue
+        game_rng = rngs[game_ix]
+        move_index = choose_greedy_index(buffer.features, num_after_states, policy_weights[game_ix], game_rng)
+        representations[game_ix] = buffer.representations[move_index]
+        lowest_free_rows[game_ix] = buffer.lowest_free_rows[move_index]
+        column_masks[game_ix] = buffer.column_masks[move_index]
+        board_hashes[game_ix] = buffer.board_hashes[move_index]
+        cleared_lines[game_ix] += buffer.n_cleared_lines[move_index]
+        current_tetrominos[game_ix] = game_rng.randint(num_tetrominos)
+        if cleared_lines[game_ix] > max_cleared_test_lines:
+            done[game_ix] = True
+
+
+@njit(cache=False)
+def choose_greedy_index(action_features, num_actions, policy_weights, tie_rng):
+    # Argmax of action_features[:num_actions].dot(policy_weights); ties are broken uniformly at random
+    # (reservoir sampling, so that no index array is allocated).
+    num_features = len(policy_weights)
+    best_index = 0
+    num_ties = 0
+    max_utility = -np.inf
+    for ix in range(num_actions):
+        utility = 0.0
+        for f in range(num_features):
+            utility += action_features[ix, f] * policy_weights[f]
+        if utility > max_utility:
+            max_utility = utility
+            best_index = ix
+            num_ties = 1
+        elif utility == max_utility:
+            num_ties += 1
+            if tie_rng.randint(num_ties) == 0:
+                best_index = ix
+    return best_index